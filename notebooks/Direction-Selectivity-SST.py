@@ -22,6 +22,7 @@ from scipy import stats
 
 sys.path.append('../src')
 from analysis import compute_tuning_response_per_cells
+import profiling # profiling.enable('data/profile.jsonl') to log the time and memory per stage
 sys.path.append('../physion/src')
 from physion.analysis.read_NWB import Data, scan_folder_for_NWBfiles
 sys.path.append('../')
@@ -100,6 +101,13 @@ stat_test_props = dict(interval_pre=[-1.,0],
                        interval_post=[1.,2.],                                   
                        test='ttest',                                            
                        positive=True) 
+
+from episodes import build_episode_tensor
+from responsiveness import pvalue_summary, responsive_at, fraction_responsive_curves
+from prefetch import prefetch_sessions
+from progress import track, session_nrois
+from parallel import parallel_pvalue_summary
+from selectivity import vector_sum
     
 def compute_summary_responses(DATASET,
                               quantity='dFoF',
@@ -114,6 +122,10 @@ def compute_summary_responses(DATASET,
                                                    test='anova',                                            
                                                    positive=True),
                               response_significance_threshold=5e-2,
+                              # `compute_tuning_response_per_cells` (ROI per ROI) until `compare_to_physion`
+                              # validates the p-value path on the dataset (see the cell below)
+                              with_physion=True,
+                              Nproc=None, # ROI-parallel stats (for sessions with >2000 ROIs)
                               verbose=True):
     
     SUMMARY = init_summary(DATASET)
@@ -129,72 +141,100 @@ def compute_summary_responses(DATASET,
     for key in ['WT', 'GluN1', 'GluN3']:
 
         SUMMARY[key]['RESPONSES'], SUMMARY[key]['OSI'], SUMMARY[key]['FRAC_RESP'] = [], [], []
+        SUMMARY[key]['PVALUES'], SUMMARY[key]['OSI_vector_sum'] = [], []
         SUMMARY[key+'_c=0.5']['RESPONSES'], SUMMARY[key+'_c=0.5']['OSI'], SUMMARY[key+'_c=0.5']['FRAC_RESP'] = [], [], []
-
-        for f in SUMMARY[key]['FILES'][:Nmax]:
-
-            data = Data(f, verbose=False)
-            
-            print('analyzing "%s" [...] ' % f)
-            data = Data(f, verbose=False)
-
-            if quantity=='dFoF':
-                data.build_dFoF(roi_to_neuropil_fluo_inclusion_factor=\
-                                        roi_to_neuropil_fluo_inclusion_factor,
-                                method_for_F0=method_for_F0,
-                                percentile=percentile,
-                                sliding_window=sliding_window,
-                                neuropil_correction_factor=neuropil_correction_factor,
-                                verbose=False)
-                
-            elif quantity=='rawFluo':
-                data.build_rawFluo(verbose=verbose)
-            elif quantity=='neuropil':
-                data.build_neuropil(verbose=verbose)            
-            else:
-                print('quantity not recognized !!')
-            
-            protocol = 'ff-gratings-8orientation-2contrasts-15repeats' if\
-                        ('ff-gratings-8orientation-2contrasts-15repeats' in data.protocols) else\
-                        'ff-gratings-8orientation-2contrasts-10repeats'
-
-            # at full contrast
-            responses, frac_resp, shifted_angle = compute_tuning_response_per_cells(data,
-                                                                                    imaging_quantity=quantity,
-                                                                                    contrast=1,
-                                                                                    protocol_name=protocol,
-                                                                                    stat_test_props=stat_test_props,
-                                                                                    response_significance_threshold=response_significance_threshold,
-                                                                                    verbose=False)
+        SUMMARY[key+'_c=0.5']['OSI_vector_sum'] = []
+
+        # the next session is read while the current one is analyzed,
+        # the progress (sessions, ROIs/s, ETA) is printed after each session
+        FILES = SUMMARY[key]['FILES'][:Nmax]
+        for f, data in track(prefetch_sessions(FILES,
+                                               quantity=quantity, verbose=verbose,
+                                               **(SUMMARY['quantity_args'] if quantity in ['dFoF', 'deconvolved'] else {})),
+                             total=len(FILES), label='%s sessions' % key,
+                             nrois=lambda item: session_nrois(item[1])):
+
+            with profiling.session(f):
+
+                print('analyzing "%s" [...] ' % f)
+
+                protocol = 'ff-gratings-8orientation-2contrasts-15repeats' if\
+                            ('ff-gratings-8orientation-2contrasts-15repeats' in data.protocols) else\
+                            'ff-gratings-8orientation-2contrasts-10repeats'
+
+                # the raw p-values are stored, the thresholded summaries are derived from them
+                tensor = build_episode_tensor(data, quantity=quantity,
+                                              protocol_name=protocol, verbose=False)
+                if Nproc is None:
+                    pvalues = pvalue_summary(tensor, stat_test_props=stat_test_props)
+                else:
+                    pvalues = parallel_pvalue_summary(tensor, stat_test_props=stat_test_props,
+                                                      Nproc=Nproc)
+                SUMMARY[key]['PVALUES'].append(pvalues)
+
+                def tuning_at(contrast):
+                    if with_physion:
+                        responses, frac_resp, shifted_angle = compute_tuning_response_per_cells(data,
+                                                                    imaging_quantity=quantity,
+                                                                    contrast=contrast,
+                                                                    protocol_name=protocol,
+                                                                    stat_test_props=stat_test_props,
+                                                                    response_significance_threshold=response_significance_threshold,
+                                                                    verbose=False)
+                        return np.reshape(responses, (len(responses), len(shifted_angle))), frac_resp, shifted_angle
+                    tuning = responsive_at(pvalues, threshold=response_significance_threshold, contrast=contrast)
+                    return tuning['RESPONSES'], tuning['FRAC_RESP'], tuning['shifted_angle']
+
+                # at full contrast
+                responses, frac_resp, shifted_angle = tuning_at(1)
             
-            SUMMARY[key]['RESPONSES'].append(responses)
-            SUMMARY[key]['OSI'].append([orientation_selectivity_index(r[1], r[5]) for r in responses])
-            SUMMARY[key]['FRAC_RESP'].append(frac_resp)
-
-            # for those two genotypes (not run for the GluN3-KO), we add:
-            if key in ['WT', 'GluN1']:
-                # at half contrast
-                responses, frac_resp, shifted_angle = compute_tuning_response_per_cells(data,
-                                                                                        contrast=0.5,
-                                                                                        protocol_name=protocol,
-                                                                                        stat_test_props=stat_test_props,
-                                                                                        response_significance_threshold=response_significance_threshold,
-                                                                                        verbose=False)
+                SUMMARY[key]['RESPONSES'].append(responses)
+                SUMMARY[key]['OSI'].append([orientation_selectivity_index(r[1], r[5]) for r in responses])
+                SUMMARY[key]['OSI_vector_sum'].append(vector_sum(responses, shifted_angle)['OSI'])
+                SUMMARY[key]['FRAC_RESP'].append(frac_resp)
+
+                # for those two genotypes (not run for the GluN3-KO), we add:
+                if key in ['WT', 'GluN1']:
+                    # at half contrast
+                    responses, frac_resp, shifted_angle = tuning_at(0.5)
                 
-                SUMMARY[key+'_c=0.5']['RESPONSES'].append(responses)
-                SUMMARY[key+'_c=0.5']['OSI'].append([orientation_selectivity_index(r[1], r[5]) for r in responses])
-                SUMMARY[key+'_c=0.5']['FRAC_RESP'].append(frac_resp)
+                    SUMMARY[key+'_c=0.5']['RESPONSES'].append(responses)
+                    SUMMARY[key+'_c=0.5']['OSI'].append([orientation_selectivity_index(r[1], r[5]) for r in responses])
+                    SUMMARY[key+'_c=0.5']['OSI_vector_sum'].append(vector_sum(responses, shifted_angle)['OSI'])
+                    SUMMARY[key+'_c=0.5']['FRAC_RESP'].append(frac_resp)
                 
     SUMMARY['shifted_angle'] = shifted_angle
+
+    if profiling.enabled():
+        profiling.summarize()
     
     return SUMMARY
 
 
+# %%
+# the p-value path (`pvalue_summary` + `responsive_at`) vs `compute_tuning_response_per_cells`,
+# on the first session of each genotype: use with_physion=False if they agree
+from responsiveness import compare_to_physion
+
+GROUPS = init_summary(DATASET)
+for key in ['WT', 'GluN1', 'GluN3']:
+    for f, data in prefetch_sessions(GROUPS[key]['FILES'][:1]):
+        protocol = 'ff-gratings-8orientation-2contrasts-15repeats' if\
+                    ('ff-gratings-8orientation-2contrasts-15repeats' in data.protocols) else\
+                    'ff-gratings-8orientation-2contrasts-10repeats'
+        for contrast in [0.5, 1]:
+            print(key, 'c=%.1f' % contrast, compare_to_physion(data, protocol_name=protocol, contrast=contrast,
+                                                               stat_test_props=dict(interval_pre=[-1.,0],
+                                                                                    interval_post=[1.,2.],
+                                                                                    test='anova',
+                                                                                    positive=True),
+                                                               response_significance_threshold=5e-2))
+
 # %% [markdown]
 # ## Varying the preprocessing parameters
 
 # %%
-for quantity in ['rawFluo', 'neuropil', 'dFoF']:
+for quantity in ['rawFluo', 'neuropil', 'dFoF', 'deconvolved']:
     SUMMARY = compute_summary_responses(DATASET, quantity=quantity, verbose=False)
     np.save('data/%s-ff-gratings.npy' % quantity, SUMMARY)
     
@@ -211,6 +251,34 @@ for roi_to_neuropil_fluo_inclusion_factor in [1.05, 1.1, 1.15, 1.2, 1.25, 1.3]:
                                    verbose=False)
     np.save('data/inclusion-factor-neuropil-%.1f-ff-gratings.npy' % roi_to_neuropil_fluo_inclusion_factor, SUMMARY)
 
+# %%
+# same sensitivity analysis from the grid file, the shared stages run once per session
+# and the results are stored per (parameters, session) in a single file
+from sweep import run_sweep, query
+
+run_sweep('sweep-ff-gratings.json', store='data/sweep-ff-gratings.db')
+
+SUMMARY = init_summary(DATASET)
+for point, f, result in query('data/sweep-ff-gratings.db', quantity='dFoF', neuropil_correction_factor=0.8):
+    key = [k for k in ['WT', 'GluN1', 'GluN3'] if f in SUMMARY[k]['FILES']][0]
+    print(key, f, 'responsive: %.1f%%' % (100*result['FRAC_RESP']))
+
+# %%
+# responsiveness vs threshold, from the stored p-values (no re-analysis)
+SUMMARY = np.load('data/dFoF-ff-gratings.npy', allow_pickle=True).item()
+thresholds = np.logspace(-4, -1, 31)
+
+fig, ax = plt.subplots(1, figsize=(2, 1.5))
+for key, color in zip(['WT', 'GluN1', 'GluN3'], ['k', 'tab:blue', 'tab:green']):
+    for correction, ls in zip([None, 'fdr_bh'], ['-', ':']):
+        curves = fraction_responsive_curves(SUMMARY[key]['PVALUES'],
+                                            thresholds=thresholds, correction=correction)
+        ax.plot(thresholds, 100.*np.mean(curves, axis=0), ls, color=color, lw=1,
+                label=key if correction is None else None)
+ax.set_xscale('log')
+ax.legend(frameon=False, fontsize=6)
+pt.set_plot(ax, xlabel='p-value threshold', ylabel='% responsive\n(mean over sessions)')
+
 # %% [markdown]
 # ## Quantification & Data visualization
 
@@ -307,7 +375,7 @@ fig, ax = generate_comparison_figs(SUMMARY, ['WT', 'WT_c=0.5'], average_by='ROIs
 ax.set_title('WT: full vs half contrast');
 
 # %%
-for quantity in ['rawFluo', 'neuropil', 'dFoF']:
+for quantity in ['rawFluo', 'neuropil', 'dFoF', 'deconvolved']:
     SUMMARY = np.load('data/%s-ff-gratings.npy' % quantity, allow_pickle=True).item()
     _ = generate_comparison_figs(SUMMARY, ['WT', 'GluN1'])
 
@@ -343,24 +411,267 @@ ax.set_title('GluN1: full vs half contrast');
 # ## Testing different "visual-responsiveness" criteria
 
 # %%
-# most permissive
-SUMMARY = compute_summary_responses(stat_test_props=dict(interval_pre=[-1.,0],                                   
-                                                         interval_post=[1.,2.],                                   
-                                                         test='ttest',                                            
-                                                         positive=True),
-                                    response_significance_threshold=5e-2)
-FIGS = generate_comparison_figs(SUMMARY, 'WT', 'GluN1',
-                                color1='k', color2='tab:blue')
-
-# %%
-# most strict
-SUMMARY = compute_summary_responses(stat_test_props=dict(interval_pre=[-1.5,0],                                   
-                                                         interval_post=[1.,2.5],                                   
-                                                         test='anova',                                            
-                                                         positive=True),
-                                    response_significance_threshold=1e-3)
-FIGS = generate_comparison_figs(SUMMARY, 'WT', 'GluN1',
-                                color1='k', color2='tab:blue')
+# the episodes of each session are extracted once,
+# then all criteria are evaluated on the same episode tensor
+from episodes import build_episode_tensor
+from responsiveness import stat_window_sweep
+from prefetch import prefetch_sessions
+
+def compute_criteria_sweep(DATASET,
+                           interval_pre=[[-1.,0], [-1.5,0]],
+                           interval_post=[[1.,2.], [1.,2.5]],
+                           test=['ttest', 'anova'],
+                           response_significance_threshold=[5e-2, 1e-2, 1e-3],
+                           Nmax=999):
+
+    SUMMARY = init_summary(DATASET)
+    SUMMARY['quantity'] = 'dFoF'
+
+    for key in ['WT', 'GluN1', 'GluN3']:
+
+        SUMMARY[key]['GRID'] = []
+
+        for f, data in prefetch_sessions(SUMMARY[key]['FILES'][:Nmax],
+                                         roi_to_neuropil_fluo_inclusion_factor=1.15,
+                                         neuropil_correction_factor=0.7,
+                                         method_for_F0='sliding_percentile',
+                                         percentile=5.,
+                                         sliding_window=300):
+
+            print('analyzing "%s" [...] ' % f)
+
+            protocol = 'ff-gratings-8orientation-2contrasts-15repeats' if\
+                        ('ff-gratings-8orientation-2contrasts-15repeats' in data.protocols) else\
+                        'ff-gratings-8orientation-2contrasts-10repeats'
+
+            tensor = build_episode_tensor(data, protocol_name=protocol, verbose=False)
+            SUMMARY[key]['GRID'].append(stat_window_sweep(tensor,
+                                                          interval_pre=interval_pre,
+                                                          interval_post=interval_post,
+                                                          test=test,
+                                                          response_significance_threshold=\
+                                                                response_significance_threshold,
+                                                          verbose=False))
+            SUMMARY['shifted_angle'] = tensor['varied_parameters']['angle']-\
+                                            tensor['varied_parameters']['angle'][1]
+    return SUMMARY
+
+def summary_at_grid_point(CRITERIA, igrid):
+    """ re-shapes one grid point of the sweep into the format of `compute_summary_responses` """
+    SUMMARY = {'quantity':CRITERIA['quantity'], 'shifted_angle':CRITERIA['shifted_angle']}
+    for key in ['WT', 'GluN1', 'GluN3']:
+        SUMMARY[key] = {'subjects':CRITERIA[key]['subjects'],
+                        'RESPONSES':[grid[igrid]['RESPONSES'] for grid in CRITERIA[key]['GRID']],
+                        'FRAC_RESP':[grid[igrid]['FRAC_RESP'] for grid in CRITERIA[key]['GRID']]}
+    return SUMMARY
+
+CRITERIA = compute_criteria_sweep(DATASET)
+np.save('data/criteria-sweep-ff-gratings.npy', CRITERIA)
+
+# %%
+CRITERIA = np.load('data/criteria-sweep-ff-gratings.npy', allow_pickle=True).item()
+for igrid, grid in enumerate(CRITERIA['WT']['GRID'][0]):
+    fig, ax = generate_comparison_figs(summary_at_grid_point(CRITERIA, igrid), ['WT', 'GluN1'], norm='norm. ')
+    ax.set_title('pre=%s, post=%s, %s, p<%.0e' % (grid['stat_test_props']['interval_pre'],
+                                                 grid['stat_test_props']['interval_post'],
+                                                 grid['stat_test_props']['test'],
+                                                 grid['response_significance_threshold']), fontsize=6)
+
+# %% [markdown]
+# ## Population decoding of the grating orientation
+
+# %%
+from decoding import decoding_data, decode_sessions
+
+def compute_decoding(DATASET,
+                     NROIS=[1, 2, 5, 10, 20, 50, 100],
+                     Nsubsamples=20,
+                     decoder='nearest_centroid',
+                     Nmax=999):
+
+    SUMMARY = init_summary(DATASET)
+
+    for key in ['WT', 'GluN1', 'GluN3']:
+
+        SESSIONS = []
+        for f, data in prefetch_sessions(SUMMARY[key]['FILES'][:Nmax]):
+
+            protocol = 'ff-gratings-8orientation-2contrasts-15repeats' if\
+                        ('ff-gratings-8orientation-2contrasts-15repeats' in data.protocols) else\
+                        'ff-gratings-8orientation-2contrasts-10repeats'
+            tensor = build_episode_tensor(data, protocol_name=protocol, verbose=False)
+            SESSIONS.append(decoding_data(tensor, contrast=1))
+
+        # one process per session
+        SUMMARY[key]['DECODING'] = decode_sessions(SESSIONS, NROIS=NROIS,
+                                                   Nsubsamples=Nsubsamples, decoder=decoder)
+    return SUMMARY
+
+DECODING = compute_decoding(DATASET)
+np.save('data/decoding-ff-gratings.npy', DECODING)
+
+# %%
+DECODING = np.load('data/decoding-ff-gratings.npy', allow_pickle=True).item()
+fig, ax = plt.subplots(1, figsize=(1.5,1.2))
+for i, key, color in zip(range(3), ['WT', 'GluN1', 'GluN3'], ['k', 'tab:blue', 'tab:green']):
+    for result in DECODING[key]['DECODING']:
+        ax.plot(result['nROIs'], 100*result['accuracy'].mean(axis=1), color=color, lw=0.3)
+    ax.annotate(i*'\n'+'%s (n=%i sessions)' % (key, len(DECODING[key]['DECODING'])),
+                (1,1), va='top', color=color, xycoords='axes fraction', fontsize=7)
+ax.plot(result['nROIs'], 100*result['chance']+0*result['nROIs'], 'k:', lw=0.5)
+ax.set_xscale('log')
+pt.set_plot(ax, xlabel='# ROIs', ylabel='decoding acc. (%)')
+
+# %% [markdown]
+# ## Noise correlations vs distance
+
+# %%
+from correlations import noise_correlations, signal_correlations, roi_positions, distance_binned
+
+def compute_correlations(DATASET,
+                         bins=np.arange(0, 520, 40),
+                         Nmax=999):
+
+    SUMMARY = init_summary(DATASET)
+
+    for key in ['WT', 'GluN1', 'GluN3']:
+
+        SUMMARY[key]['NOISE'], SUMMARY[key]['SIGNAL'] = [], []
+        for f, data in prefetch_sessions(SUMMARY[key]['FILES'][:Nmax]):
+
+            protocol = 'ff-gratings-8orientation-2contrasts-15repeats' if\
+                        ('ff-gratings-8orientation-2contrasts-15repeats' in data.protocols) else\
+                        'ff-gratings-8orientation-2contrasts-10repeats'
+            tensor = build_episode_tensor(data, protocol_name=protocol, verbose=False)
+            positions = roi_positions(data)
+
+            SUMMARY[key]['NOISE'].append(distance_binned(noise_correlations(tensor)['pairs'],
+                                                         positions, bins=bins))
+            SUMMARY[key]['SIGNAL'].append(distance_binned(signal_correlations(tensor),
+                                                          positions, bins=bins))
+    return SUMMARY
+
+CORRELATIONS = compute_correlations(DATASET)
+np.save('data/correlations-ff-gratings.npy', CORRELATIONS)
+
+# %%
+CORRELATIONS = np.load('data/correlations-ff-gratings.npy', allow_pickle=True).item()
+fig, AX = plt.subplots(1, 2, figsize=(3.5,1.2))
+for i, key, color in zip(range(3), ['WT', 'GluN1', 'GluN3'], ['k', 'tab:blue', 'tab:green']):
+    for ax, quantity in zip(AX, ['NOISE', 'SIGNAL']):
+        bins = CORRELATIONS[key][quantity][0]['bins']
+        mean = np.nanmean([c['mean'] for c in CORRELATIONS[key][quantity]], axis=0)
+        ax.plot(.5*(bins[1:]+bins[:-1]), mean, color=color)
+    AX[1].annotate(i*'\n'+key, (1,1), va='top', color=color, xycoords='axes fraction', fontsize=7)
+for ax, quantity in zip(AX, ['noise', 'signal']):
+    pt.set_plot(ax, xlabel='distance (pix.)', ylabel='%s corr.' % quantity)
+
+# %% [markdown]
+# ## Modulation by locomotion
+
+# %%
+from locomotion import running_modulation, sensitivity_curves
+
+def compute_running_modulation(DATASET,
+                               thresholds=[0.05, 0.1, 0.2, 0.5, 1.], # cm/s
+                               Nmax=999):
+
+    SUMMARY = init_summary(DATASET)
+
+    for key in ['WT', 'GluN1', 'GluN3']:
+
+        SUMMARY[key]['MODULATION'] = []
+        for f, data in prefetch_sessions(SUMMARY[key]['FILES'][:Nmax]):
+
+            protocol = 'ff-gratings-8orientation-2contrasts-15repeats' if\
+                        ('ff-gratings-8orientation-2contrasts-15repeats' in data.protocols) else\
+                        'ff-gratings-8orientation-2contrasts-10repeats'
+            tensor = build_episode_tensor(data, protocol_name=protocol,
+                                          with_running_speed=True, verbose=False)
+            # all thresholds in one pass
+            SUMMARY[key]['MODULATION'].append(sensitivity_curves(running_modulation(tensor,
+                                                                                    thresholds=thresholds)))
+    return SUMMARY
+
+MODULATION = compute_running_modulation(DATASET)
+np.save('data/running-modulation-ff-gratings.npy', MODULATION)
+
+# %%
+MODULATION = np.load('data/running-modulation-ff-gratings.npy', allow_pickle=True).item()
+fig, AX = plt.subplots(1, 2, figsize=(3.5,1.2))
+for i, key, color in zip(range(3), ['WT', 'GluN1', 'GluN3'], ['k', 'tab:blue', 'tab:green']):
+    for ax, quantity in zip(AX, ['fraction_modulated', 'mean_modulation_index']):
+        for session in MODULATION[key]['MODULATION']:
+            ax.plot(session['thresholds'], session[quantity], color=color, lw=0.3)
+    AX[1].annotate(i*'\n'+key, (1,1), va='top', color=color, xycoords='axes fraction', fontsize=7)
+for ax, label in zip(AX, ['frac. modulated', 'modulation index']):
+    ax.set_xscale('log')
+    pt.set_plot(ax, xlabel='run. threshold (cm/s)', ylabel=label)
+
+# %% [markdown]
+# ## Time-resolved orientation tuning
+
+# %%
+from tuning_dynamics import sliding_windows, time_resolved_tuning
+
+def compute_tuning_dynamics(DATASET,
+                            width=0.25, # s
+                            tstop=3.,
+                            Nmax=999):
+
+    SUMMARY = init_summary(DATASET)
+
+    for key in ['WT', 'GluN1', 'GluN3']:
+
+        SUMMARY[key]['OSI'] = []
+        for f, data in prefetch_sessions(SUMMARY[key]['FILES'][:Nmax]):
+
+            protocol = 'ff-gratings-8orientation-2contrasts-15repeats' if\
+                        ('ff-gratings-8orientation-2contrasts-15repeats' in data.protocols) else\
+                        'ff-gratings-8orientation-2contrasts-10repeats'
+            tensor = build_episode_tensor(data, protocol_name=protocol, verbose=False)
+            pvalues = pvalue_summary(tensor, stat_test_props=stat_test_props)
+            responsive = responsive_at(pvalues, threshold=0.05)['responsive']
+
+            dynamics = time_resolved_tuning(tensor, sliding_windows(tensor['t'], width=width, tstop=tstop))
+            SUMMARY[key]['OSI'].append(dynamics['OSI'][:,responsive])
+            SUMMARY['centers'] = dynamics['centers']
+    return SUMMARY
+
+DYNAMICS = compute_tuning_dynamics(DATASET)
+np.save('data/tuning-dynamics-ff-gratings.npy', DYNAMICS)
+
+# %%
+DYNAMICS = np.load('data/tuning-dynamics-ff-gratings.npy', allow_pickle=True).item()
+fig, ax = plt.subplots(1, figsize=(1.5,1.2))
+for i, key, color in zip(range(3), ['WT', 'GluN1', 'GluN3'], ['k', 'tab:blue', 'tab:green']):
+    OSI = np.concatenate(DYNAMICS[key]['OSI'], axis=1)
+    pt.plot(DYNAMICS['centers'], np.mean(OSI, axis=1), sy=stats.sem(OSI, axis=1), ax=ax, color=color)
+    ax.annotate(i*'\n'+'%s (n=%i ROIs)' % (key, OSI.shape[1]), (1,1), va='top', color=color,
+                xycoords='axes fraction', fontsize=7)
+pt.set_plot(ax, xlabel='time from stim. (s)', ylabel='OSI (vector sum)')
+
+# %% [markdown]
+# ## Quick look
+#
+# stratified subset of the sessions and ROIs, with bootstrap error bars
+# (their width is the expected deviation from the full run)
+
+# %%
+from quick_look import quick_look
+
+SUMMARY = init_summary(DATASET)
+QL = quick_look(SUMMARY, session_fraction=0.3, roi_fraction=0.25, verbose=False)
+
+fig, ax = plt.subplots(1, figsize=(1.5,1.2))
+for i, key, color in zip(range(3), ['WT','GluN1','GluN3'], ['k','tab:blue','tab:green']):
+    if 'mean_curve' in QL[key]:
+        ax.plot(QL[key]['x'], QL[key]['mean_curve'], color=color)
+        ax.fill_between(QL[key]['x'], *QL[key]['curve_ci'], color=color, alpha=.2, lw=0)
+        ax.annotate(i*'\n'+'%s, resp.: %.0f%% [%.0f, %.0f]' % (key, 100*QL[key]['frac_resp'],
+                                                          *(100*QL[key]['frac_resp_ci'])),
+                    (1,1), va='top', color=color, xycoords='axes fraction', fontsize=7)
+pt.set_plot(ax, xlabel='angle from pref. ($^o$)', ylabel='$\Delta$F/F')
 
 # %% [markdown]
 # # Visualizing some evoked response in single ROI
@@ -77,3 +77,48 @@ AX[0][1].set_title('corrected Fluo.')
 AX[0][2].set_title('$\Delta$F/F');
 
 # %%
+# for multi-hour recordings: time-streaming dF/F, written to a memory-mapped file
+# (the peak memory depends on `chunk_duration`, not on the recording duration)
+sys.path.append('../src')
+from dfof import build_dFoF_streaming
+
+data = Data(DATASET['files'][2])
+build_dFoF_streaming(data,
+                     roi_to_neuropil_fluo_inclusion_factor=1.2,
+                     neuropil_correction_factor=0.8,
+                     sliding_window=180,
+                     percentile=10,
+                     chunk_duration=600,
+                     filename='data/dFoF-streaming.npy',
+                     verbose=False)
+print(data.dFoF.shape, data.vNrois)
+
+# %%
+# the streaming F0 re-implements physion's 'sliding_percentile' method: check it on this session
+from dfof import check_against_build_dFoF
+check_against_build_dFoF(DATASET['files'][2],
+                         roi_to_neuropil_fluo_inclusion_factor=1.2,
+                         neuropil_correction_factor=0.8,
+                         sliding_window=180,
+                         percentile=10)
+
+# %%
+# quick look at a few cells: only the (ROIs x time window) hyperslabs are read
+from imaging import load_roi_window
+
+data = Data(DATASET['files'][2])
+load_roi_window(data,
+                roiIndices=[0, 5, 12],
+                tlim=[1200, 1300],
+                neuropil_correction_factor=0.8,
+                sliding_window=180,
+                percentile=10)
+
+fig, AX = plt.subplots(data.vNrois, 1, figsize=(6,0.6*data.vNrois))
+for i, roi in enumerate(data.valid_roiIndices):
+    AX[i].plot(data.t_dFoF, data.dFoF[i,:], color='tab:green')
+    pt.annotate(AX[i], 'roi #%i' % (roi+1), (1,0), fontsize=7)
+    pt.set_plot(AX[i], xlim=[data.t_dFoF[0], data.t_dFoF[-1]], xticks=[])
+pt.draw_bar_scales(AX[0], Xbar=10, Xbar_label='10s', Ybar=1e-21)
+
+# %%
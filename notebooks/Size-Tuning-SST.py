@@ -22,6 +22,7 @@ from scipy import stats
 
 sys.path.append('../src')
 from analysis import compute_tuning_response_per_cells
+import profiling # profiling.enable('data/profile.jsonl') to log the time and memory per stage
 sys.path.append('../physion/src')
 from physion.analysis.read_NWB import Data, scan_folder_for_NWBfiles
 sys.path.append('../')
@@ -76,9 +77,18 @@ def init_summary(DATASET):
 
 # %%
 from physion.analysis.protocols.size_tuning import center_and_compute_size_tuning
+from prefetch import prefetch_sessions
+from progress import track, session_nrois
+from deconvolution import episode_quantity
+from episodes import build_episode_tensor
+from receptive_fields import rf_centers
+from size_tuning import size_tuning, ragged_to_dense
 
 def run_dataset_analysis(DATASET,
                          quantity='dFoF',
+                         # `center_and_compute_size_tuning` (ROI per ROI) until `compare_to_physion`
+                         # validates the `size_tuning` engine on the dataset (see the cell below)
+                         with_physion_centering=True,
                          roi_to_neuropil_fluo_inclusion_factor=1.15,
                          neuropil_correction_factor = 0.7,
                          method_for_F0 = 'sliding_percentile',
@@ -99,50 +109,86 @@ def run_dataset_analysis(DATASET,
     
     for key in ['WT', 'GluN1', 'GluN3']:
 
-        for k in ['RESPONSES', 'CENTERED_ROIS', 'PREF_ANGLES']:
+        for k in ['RESPONSES', 'CENTERED_ROIS', 'PREF_ANGLES', 'RF']:
             SUMMARY[key][k] = [] 
 
-        for f in SUMMARY[key]['FILES'][:Nmax]:
-
-            print('analyzing "%s" [...] ' % f)
-            data = Data(f, verbose=False)
-
-            if quantity=='dFoF':
-                data.build_dFoF(roi_to_neuropil_fluo_inclusion_factor=\
-                                        roi_to_neuropil_fluo_inclusion_factor,
-                                method_for_F0=method_for_F0,
-                                percentile=percentile,
-                                sliding_window=sliding_window,
-                                neuropil_correction_factor=neuropil_correction_factor,
-                                verbose=False)
-            elif quantity=='rawFluo':
-                data.build_rawFluo(verbose=verbose)
-            elif quantity=='neuropil':
-                data.build_neuropil(verbose=verbose)            
-            else:
-                print('quantity not recognized !!')
-
-            #print('-->', data.vNrois)
-            radii, size_resps, rois, pref_angles = center_and_compute_size_tuning(data,
-                                                                                  imaging_quantity=quantity,
-                                                                                  with_rois_and_angles=True,
-                                                                                  verbose=False)
-            if len(size_resps)>0:
-                for k, q in zip(['RESPONSES', 'CENTERED_ROIS', 'PREF_ANGLES'],
-                                [size_resps, rois, pref_angles]):
-                    SUMMARY[key][k].append(q)
-
-            if len(radii)>0:
-                SUMMARY['radii'] = radii
+        # the next session is read while the current one is analyzed,
+        # the progress (sessions, ROIs/s, ETA) is printed after each session
+        FILES = SUMMARY[key]['FILES'][:Nmax]
+        for f, data in track(prefetch_sessions(FILES,
+                                               quantity=quantity, verbose=verbose,
+                                               **(SUMMARY['quantity_args'] if quantity in ['dFoF', 'deconvolved'] else {})),
+                             total=len(FILES), label='%s sessions' % key,
+                             nrois=lambda item: session_nrois(item[1])):
+
+            with profiling.session(f):
+
+                print('analyzing "%s" [...] ' % f)
+
+                #print('-->', data.vNrois)
+                # receptive fields, whatever the centering (stored for the RF cell below)
+                rf = rf_centers(data, quantity=quantity, verbose=False)\
+                        if 'spatial-mapping' in data.protocols else None
+                if rf is not None:
+                    SUMMARY[key]['RF'].append(rf) # with the same build arguments than the responses
+
+                if with_physion_centering:
+                    # physion centers on the largest response, not on the receptive fields
+                    with episode_quantity(data, quantity) as q, profiling.stage('size_tuning'):
+                        radii, size_resps, rois, pref_angles = center_and_compute_size_tuning(data,
+                                                                                              imaging_quantity=q,
+                                                                                              with_rois_and_angles=True,
+                                                                                              verbose=False)
+                elif 'size-tuning-protocol-loc' in data.protocols:
+                    # all ROIs at once, centered on the receptive fields if available
+                    with profiling.stage('size_tuning'):
+                        ST = size_tuning(build_episode_tensor(data, quantity=quantity,
+                                                              protocol_name='size-tuning-protocol-loc',
+                                                              verbose=False),
+                                         tensor_sizes=build_episode_tensor(data, quantity=quantity,
+                                                              protocol_name='size-tuning-protocol-dep',
+                                                              verbose=False)\
+                                            if 'size-tuning-protocol-dep' in data.protocols else None,
+                                         rf=rf)
+                    radii, size_resps, rois, pref_angles = ST['radii'], ST['responses'],\
+                                                           ST['rois'], ST['pref_angles']
+                else:
+                    radii, size_resps = [], []
+                if len(size_resps)>0:
+                    for k, q in zip(['RESPONSES', 'CENTERED_ROIS', 'PREF_ANGLES'],
+                                    [size_resps, rois, pref_angles]):
+                        SUMMARY[key][k].append(q)
+
+                if len(radii)>0:
+                    SUMMARY['radii'] = radii
+
+        # sessions concatenated along the ROI axis, session i: OFFSETS[i]:OFFSETS[i+1]
+        SUMMARY[key]['RESPONSES'], SUMMARY[key]['OFFSETS'] = ragged_to_dense(SUMMARY[key]['RESPONSES'])
+        for k in ['CENTERED_ROIS', 'PREF_ANGLES']:
+            SUMMARY[key][k] = np.concatenate(SUMMARY[key][k]) if len(SUMMARY[key][k])>0 else np.zeros(0)
+
+    if profiling.enabled():
+        profiling.summarize()
                 
     return SUMMARY
 
 
+# %%
+# the `size_tuning` engine (all ROIs at once) vs `center_and_compute_size_tuning`,
+# on the first session of each genotype: use with_physion_centering=False if they agree
+from size_tuning import compare_to_physion
+
+GROUPS = init_summary(DATASET)
+for key in ['WT', 'GluN1', 'GluN3']:
+    for f, data in prefetch_sessions(GROUPS[key]['FILES'][:1]):
+        if 'size-tuning-protocol-loc' in data.protocols:
+            print(key, compare_to_physion(data))
+
 # %% [markdown]
 # ## Varying the preprocessing parameters
 
 # %%
-for quantity in ['rawFluo', 'neuropil', 'dFoF']:
+for quantity in ['rawFluo', 'neuropil', 'dFoF', 'deconvolved']:
     SUMMARY = run_dataset_analysis(DATASET, quantity=quantity, verbose=False)
     np.save('data/%s-summary.npy' % quantity, SUMMARY)
     
@@ -167,6 +213,7 @@ for roi_to_neuropil_fluo_inclusion_factor in [1.1, 1.15, 1.2, 1.25, 1.3]:
 # %%
 from scipy.special import erf
 from scipy.optimize import minimize
+from size_tuning import ragged_to_dense, population_summary
 
 def func(S, X):
     """ fitting function """
@@ -179,9 +226,15 @@ def angle_lin_to_true_angle(angle):
     """
     return 180./np.pi*np.arctan(angle/180.*np.pi)
 
-def suppression_index(resp1, resp2):
-    resp1 = np.clip(resp1, 1e-2, np.inf)
-    return np.clip((resp1-resp2)/resp1, 0, 1)
+def population(SUMMARY, key):
+    """ ROI- and session-averaged summaries of a genotype, computed once per SUMMARY """
+    if 'POPULATION' not in SUMMARY[key]:
+        if 'OFFSETS' in SUMMARY[key]:
+            dense, offsets = SUMMARY[key]['RESPONSES'], SUMMARY[key]['OFFSETS']
+        else: # summaries saved as lists of sessions
+            dense, offsets = ragged_to_dense(SUMMARY[key]['RESPONSES'], Nradii=len(SUMMARY['radii']))
+        SUMMARY[key]['POPULATION'] = population_summary(dense, offsets)
+    return SUMMARY[key]['POPULATION']
     
 def plot_summary(SUMMARY,
                  average_by='sessions',
@@ -202,23 +255,19 @@ def plot_summary(SUMMARY,
     
     for i, key, color in zip(range(2), ['WT', 'GluN1', 'GluN3'], ['k', 'tab:blue', 'g']):
 
-        if average_by=='sessions':
-            resp = np.array([np.mean(np.clip(r, 0, np.inf), axis=0) for r in SUMMARY[key]['RESPONSES']])
-        else:
-            resp = np.concatenate([np.clip(r, 0, np.inf) for r in SUMMARY[key]['RESPONSES']])
-            
-        #resp = np.clip(resp, 0, 100) # CLIP RESPONSIVE TO POSITIVE VALUES
+        POP = population(SUMMARY, key)
+        resp = POP[average_by]['responses'] # clipped to positive values
         
-        SIs.append([suppression_index(np.mean(r[2:5]), np.mean(r[-3:])) for r in resp])
+        SIs.append(POP[average_by]['SI'])
 
         # data
-        pt.scatter(stim_size, np.mean(resp, axis=0),
-                   sy=stats.sem(resp, axis=0),
+        pt.scatter(stim_size, POP[average_by]['mean'],
+                   sy=POP[average_by]['sem'],
                    ax=AX[i], color=color, ms=ms)
 
         # fit
         def to_minimize(x0):
-            return np.sum((resp.mean(axis=0)-\
+            return np.sum((POP[average_by]['mean']-\
                            func(stim_size, x0))**2)
         res = minimize(to_minimize,
                        [2, 20, 40, 0])
@@ -228,13 +277,13 @@ def plot_summary(SUMMARY,
         AX[i].set_title(key, color=color)
         if average_by=='sessions':
             inset.annotate(i*'\n'+'\nN=%i %s (%i ROIs, %i mice)' % (len(resp),
-                                                average_by, np.sum([len(r) for r in SUMMARY[key]['RESPONSES']]),
+                                                average_by, np.sum(POP['n_rois']),
                                                 len(np.unique(SUMMARY[key]['subjects']))),
                            (0,0), fontsize=7,
                            va='top',color=color, xycoords='axes fraction')
         else:
             inset.annotate(i*'\n'+'\nn=%i %s (%i sessions, %i mice)' % (len(resp),
-                                                average_by, len(SUMMARY[key]['RESPONSES']),
+                                                average_by, np.sum(POP['n_rois']>0),
                                                                 len(np.unique(SUMMARY[key]['subjects']))),
                            (0,0), fontsize=7,
                            va='top',color=color, xycoords='axes fraction')
@@ -264,7 +313,7 @@ fig = plot_summary(SUMMARY, average_by='ROIs')
 fig = plot_summary(SUMMARY, average_by='sessions')
 
 # %%
-for quantity in ['rawFluo', 'neuropil', 'dFoF']:
+for quantity in ['rawFluo', 'neuropil', 'dFoF', 'deconvolved']:
     SUMMARY = np.load('data/%s-summary.npy' % quantity, allow_pickle=True).item()
     fig = plot_summary(SUMMARY, average_by='ROIs')
 
@@ -284,6 +333,28 @@ for roi_to_neuropil_fluo_inclusion_factor in [1.05, 1.1, 1.15, 1.2, 1.25, 1.3]:
     plt.annotate('roiFluo/Neuropil inclusion-factor: %.2f\n' % roi_to_neuropil_fluo_inclusion_factor,
                  (1,1), xycoords='axes fraction')
 
+# %% [markdown]
+# ## Receptive fields (spatial mapping)
+#
+# 2-D gaussian fits of the (x,y) response maps of all ROIs, computed in
+# `run_dataset_analysis` (on the same dFoF as the size tuning) whenever the session has
+# a spatial-mapping protocol, and used for the centering with `with_physion_centering=False`
+
+# %%
+SUMMARY = np.load('data/dFoF-summary.npy', allow_pickle=True).item() # default preprocessing
+RF = {key:SUMMARY[key].get('RF', []) for key in ['WT', 'GluN1', 'GluN3']}
+fig, AX = plt.subplots(1, 2, figsize=(3.5,1.2))
+for i, key, color in zip(range(3), ['WT','GluN1','GluN3'], ['k','tab:blue','tab:green']):
+    if len(RF[key])>0:
+        good = [rf['residual']<0.5 for rf in RF[key]]
+        AX[0].scatter(np.concatenate([rf['x0'][g] for rf, g in zip(RF[key], good)]),
+                      np.concatenate([rf['y0'][g] for rf, g in zip(RF[key], good)]), s=1, color=color)
+        AX[1].hist(np.concatenate([np.sqrt(rf['sx']*rf['sy'])[g] for rf, g in zip(RF[key], good)]),
+                   bins=np.linspace(0, 50, 26), histtype='step', color=color)
+    AX[1].annotate(i*'\n'+key, (1,1), va='top', color=color, xycoords='axes fraction', fontsize=7)
+pt.set_plot(AX[0], xlabel='x-center (deg.)', ylabel='y-center (deg.)')
+pt.set_plot(AX[1], xlabel='RF size (deg.)', ylabel='count')
+
 # %% [markdown]
 # # Visualizing some evoked response in single ROI
 
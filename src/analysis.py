@@ -4,7 +4,24 @@ import numpy as np
 physion_folder = os.path.join(pathlib.Path(__file__).resolve().parent,
                               '..', 'physion', 'src')
 sys.path.append(os.path.join(physion_folder))
-from physion.analysis.process_NWB import EpisodeData
+
+import profiling
+
+
+def load_EpisodeData():
+    """
+    physion (and with it pynwb, matplotlib, ...) is only imported
+    on first use, so that importing this module stays fast
+    """
+    from physion.analysis.process_NWB import EpisodeData
+    return EpisodeData
+
+
+def __getattr__(name):
+    # `analysis.EpisodeData` stays available, imported on first access
+    if name=='EpisodeData':
+        return load_EpisodeData()
+    raise AttributeError("module 'analysis' has no attribute '%s'" % name)
 
 
 stat_test_props = dict(interval_pre=[-1.5,0],
@@ -43,45 +60,91 @@ def compute_tuning_response_per_cells(data,
                                       response_significance_threshold = response_significance_threshold,
                                       contrast=1,
                                       protocol_name='ff-gratings-8orientation-2contrasts-10repeats',
+                                      with_screen=False,
                                       verbose=True):
-
-    RESPONSES = []
+    """
+    with_screen: the per-ROI summaries are only computed for the ROIs that
+    can be responsive (see `responsiveness.screen`, on the closed windows of
+    `EpisodeData.compute_interval_cond`), same output
+    """
 
     protocol_id = data.get_protocol_id(protocol_name=protocol_name)
 
-    EPISODES = EpisodeData(data,
-                           quantities=[imaging_quantity],
-                           protocol_id=protocol_id,
-                           verbose=verbose)
+    EpisodeData = load_EpisodeData()
+    from deconvolution import episode_quantity
+
+    # 'deconvolved' is read by EpisodeData in place of dFoF
+    with episode_quantity(data, imaging_quantity) as quantity,\
+            profiling.stage('EpisodeData'):
+        EPISODES = EpisodeData(data,
+                               quantities=[quantity],
+                               protocol_id=protocol_id,
+                               verbose=verbose)
+
+    return tuning_response_per_cells(EPISODES, quantity, data.nROIs,
+                                     stat_test_props=stat_test_props,
+                                     response_significance_threshold=response_significance_threshold,
+                                     contrast=contrast,
+                                     with_screen=with_screen)
+
+
+def tuning_response_per_cells(EPISODES, quantity, nROIs,
+                              stat_test_props=stat_test_props,
+                              response_significance_threshold = response_significance_threshold,
+                              contrast=1,
+                              with_screen=False):
+    """
+    per-ROI part of `compute_tuning_response_per_cells`, from the EpisodeData
+    """
+
+    RESPONSES = []
 
     shifted_angle = EPISODES.varied_parameters['angle']-\
                             EPISODES.varied_parameters['angle'][1]
 
-    for roi in np.arange(data.nROIs):
+    with profiling.stage('stat_tests'):
+
+        rois = np.arange(nROIs)
+        if with_screen:
+            from episodes import episode_tensor, cumulative_responses, window_mean
+            from responsiveness import screen
+            tensor = episode_tensor(EPISODES, quantity=quantity)
+            C = cumulative_responses(tensor['responses'])
+            rois = rois[screen(window_mean(C, tensor['t'], stat_test_props['interval_pre']),
+                               window_mean(C, tensor['t'], stat_test_props['interval_post']),
+                               tensor['condition'],
+                               test=stat_test_props['test'],
+                               threshold=response_significance_threshold,
+                               positive=stat_test_props['positive'],
+                               conditions=(tensor['conditions']['contrast']==contrast)\
+                                            if 'contrast' in tensor['conditions'] else None)]
+            del tensor, C
+
+        for roi in rois:
 
-        cell_resp = EPISODES.compute_summary_data(stat_test_props,
-                        response_significance_threshold=response_significance_threshold,
-                        response_args=dict(quantity=imaging_quantity, roiIndex=roi))
+            cell_resp = EPISODES.compute_summary_data(stat_test_props,
+                            response_significance_threshold=response_significance_threshold,
+                            response_args=dict(quantity=quantity, roiIndex=roi))
 
-        condition = (cell_resp['contrast']==contrast)
+            condition = (cell_resp['contrast']==contrast)
 
-        # if significant in at least one orientation
-        if np.sum(cell_resp['significant'][condition]):
+            # if significant in at least one orientation
+            if np.sum(cell_resp['significant'][condition]):
 
-            ipref = np.argmax(cell_resp['value'][condition])
-            prefered_angle = cell_resp['angle'][condition][ipref]
+                ipref = np.argmax(cell_resp['value'][condition])
+                prefered_angle = cell_resp['angle'][condition][ipref]
 
-            RESPONSES.append(np.zeros(len(shifted_angle)))
+                RESPONSES.append(np.zeros(len(shifted_angle)))
 
-            for angle, value in zip(cell_resp['angle'][condition],
-                                    cell_resp['value'][condition]):
+                for angle, value in zip(cell_resp['angle'][condition],
+                                        cell_resp['value'][condition]):
 
-                new_angle = shift_orientation_according_to_pref(angle,
-                                                                pref_angle=prefered_angle,
-                                                                start_angle=-22.5,
-                                                                angle_range=180)
-                iangle = np.flatnonzero(shifted_angle==new_angle)[0]
+                    new_angle = shift_orientation_according_to_pref(angle,
+                                                                    pref_angle=prefered_angle,
+                                                                    start_angle=-22.5,
+                                                                    angle_range=180)
+                    iangle = np.flatnonzero(shifted_angle==new_angle)[0]
 
-                RESPONSES[-1][iangle] = value
+                    RESPONSES[-1][iangle] = value
 
-    return RESPONSES, len(RESPONSES)/data.nROIs, shifted_angle
+    return RESPONSES, len(RESPONSES)/nROIs, shifted_angle
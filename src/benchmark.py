@@ -0,0 +1,197 @@
+"""
+benchmark of the analysis pipeline on synthetic sessions
+
+    python src/benchmark.py --nROIs 100 1000 5000 --durations 10 30 90
+
+each scale point runs in its own process (so that peak memories are not mixed)
+and the results are written to a json file:
+    [{'nROIs', 'duration', 'stage', 'wall_time', 'peak_rss', 'throughput'}, ...]
+with the throughput in (ROIs x minutes of recording) per second
+
+    python src/benchmark.py --import_time
+
+checks that importing the analysis modules stays fast
+(no physion/pynwb/matplotlib at import), exits with an error otherwise
+"""
+import os, sys, time, json, tempfile, pathlib, subprocess
+import multiprocessing as mp
+import numpy as np
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parent))
+from synthetic_data import write_session
+from profiling import PeakMemory
+
+
+def run_stages(filename, nROIs, duration,
+               with_pdf=False):
+    """
+    times the successive stages of the pipeline on one session
+    """
+    from analysis import compute_tuning_response_per_cells, stat_test_props
+    from physion.analysis.read_NWB import Data
+    from episodes import build_episode_tensor
+    from responsiveness import pvalue_summary
+    from imaging import as_roi_major
+    from parallel import parallel_pvalue_summary
+
+    RESULTS = []
+
+    def stage(name, func):
+        with PeakMemory() as mem:
+            tstart = time.perf_counter()
+            output = func()
+            wall_time = time.perf_counter()-tstart
+        RESULTS.append(dict(nROIs=nROIs, duration=duration, stage=name,
+                            wall_time=wall_time,
+                            peak_rss=mem.peak,
+                            throughput=nROIs*duration/wall_time))
+        print('    - %s: %.2fs, peak memory: %.1fMB' % (name, wall_time, mem.peak/1024**2))
+        return output
+
+    data = stage('read', lambda: Data(filename, verbose=False))
+    stage('build_dFoF', lambda: data.build_dFoF(verbose=False))
+    tensor = stage('EpisodeData', lambda: build_episode_tensor(data, verbose=False))
+    stage('pvalue_summary', lambda: pvalue_summary(tensor, stat_test_props=stat_test_props))
+    tensor32 = dict(tensor, responses=as_roi_major(tensor['responses'], dtype=np.float32))
+    stage('pvalue_summary_float32', lambda: pvalue_summary(tensor32, stat_test_props=stat_test_props))
+    stage('pvalue_summary_parallel', lambda: parallel_pvalue_summary(tensor, stat_test_props=stat_test_props))
+    stage('compute_tuning_response_per_cells',
+          lambda: compute_tuning_response_per_cells(data, verbose=False))
+
+    if 'size-tuning-protocol-loc' in data.protocols:
+        from size_tuning import size_tuning
+        from physion.analysis.protocols.size_tuning import center_and_compute_size_tuning
+        stage('size_tuning', lambda: size_tuning(build_episode_tensor(data,
+                                                       protocol_name='size-tuning-protocol-loc',
+                                                       verbose=False),
+                                                 tensor_sizes=build_episode_tensor(data,
+                                                       protocol_name='size-tuning-protocol-dep',
+                                                       verbose=False)))
+        stage('center_and_compute_size_tuning',
+              lambda: center_and_compute_size_tuning(data, with_rois_and_angles=True, verbose=False))
+        from size_tuning import compare_to_physion
+        comparison = compare_to_physion(data)
+        print('    - size_tuning vs center_and_compute_size_tuning: %s' % comparison)
+        RESULTS.append(dict(nROIs=nROIs, duration=duration, stage='size_tuning_vs_physion', **comparison))
+
+    if with_pdf:
+        import argparse
+        from pdf_lum_with_tuning import generate_pdf
+        args = argparse.Namespace(datafile=filename, imaging_quantity='dFoF',
+                                  unique_run_ID=np.random.randint(10000),
+                                  iprotocol=0, nROIs=5, dtype='float64', show_all_ROIs=False,
+                                  seed=1, Nmax=1000000, debug=False, verbose=False)
+        stage('generate_pdf', lambda: generate_pdf(args))
+
+    return RESULTS
+
+
+HEAVY_MODULES = ['physion', 'pynwb', 'matplotlib', 'h5py']
+
+def import_time(module='analysis', repeat=5):
+    """
+    best import time (in s) of a module of src/ over fresh interpreters,
+    and the heavy dependencies that this import loaded
+    """
+    code = 'import sys, time; sys.path.append(%r); t0 = time.perf_counter(); import %s; '\
+           'print(time.perf_counter()-t0); print(",".join(m for m in %r if m in sys.modules))' %\
+                (str(pathlib.Path(__file__).resolve().parent), module, HEAVY_MODULES)
+    TIMES = []
+    for i in range(repeat):
+        output = subprocess.run([sys.executable, '-c', code],
+                                capture_output=True, text=True, check=True).stdout.split('\n')
+        TIMES.append(float(output[0]))
+    return min(TIMES), [m for m in output[1].split(',') if m!='']
+
+
+def check_import_time(MODULES=['analysis', 'episodes'],
+                      budget=0.5): # s
+    """
+    guard on the import of the light-weight modules
+    """
+    success = True
+    for module in MODULES:
+        duration, heavy = import_time(module)
+        print('import %s: %.0fms %s' % (module, 1e3*duration,
+                                        ('/!\\ loads %s' % ', '.join(heavy)) if len(heavy)>0 else ''))
+        if (duration>budget) or (len(heavy)>0):
+            success = False
+    return success
+
+
+def _run_in_process(queue, *args, **kwargs):
+    queue.put(run_stages(*args, **kwargs))
+
+
+def run_benchmark(NROIS=[100, 500, 1000, 5000],
+                  DURATIONS=[10, 30, 90], # min
+                  frame_rate=30.,
+                  folder=os.path.join(tempfile.gettempdir(), 'synthetic-sessions'),
+                  with_pdf=False,
+                  with_size_tuning=False,
+                  output='benchmark.json'):
+
+    os.makedirs(folder, exist_ok=True)
+    RESULTS = []
+
+    for duration in DURATIONS:
+        for nROIs in NROIS:
+
+            filename = os.path.join(folder, 'synthetic-%iROIs-%imin-%iHz%s.nwb' % (nROIs, duration,
+                                                    frame_rate, '-sizes' if with_size_tuning else ''))
+            if not os.path.isfile(filename):
+                write_session(filename, nROIs=nROIs, duration=duration,
+                              frame_rate=frame_rate,
+                              protocols=['luminosity',
+                                         'ff-gratings-8orientation-2contrasts-10repeats']+\
+                                    (['size-tuning-protocol-loc', 'size-tuning-protocol-dep']\
+                                        if with_size_tuning else []))
+
+            print('benchmarking %i ROIs, %i min [...]' % (nROIs, duration))
+            ctx = mp.get_context('spawn')
+            queue = ctx.Queue()
+            process = ctx.Process(target=_run_in_process, args=(queue, filename, nROIs, duration),
+                                  kwargs=dict(with_pdf=with_pdf))
+            process.start()
+            RESULTS += queue.get()
+            process.join()
+
+            # written after each scale point, so that partial runs are kept
+            with open(output, 'w') as f:
+                json.dump(RESULTS, f, indent=1)
+
+    return RESULTS
+
+
+if __name__=='__main__':
+
+    import argparse
+
+    parser=argparse.ArgumentParser(description='benchmark of the analysis pipeline')
+
+    parser.add_argument("--nROIs", type=int, nargs='*', default=[100, 500, 1000, 5000])
+    parser.add_argument("--durations", type=float, nargs='*', default=[10, 30, 90],
+                        help='in minutes')
+    parser.add_argument("--frame_rate", type=float, default=30.)
+    parser.add_argument("--folder", type=str,
+                        default=os.path.join(tempfile.gettempdir(), 'synthetic-sessions'),
+                        help='where the synthetic sessions are written (and re-used)')
+    parser.add_argument("--with_pdf", action='store_true')
+    parser.add_argument("--with_size_tuning", action='store_true',
+                        help='adds the size-tuning protocol to the sessions (and its stages)')
+    parser.add_argument("-o", "--output", type=str, default='benchmark.json')
+    parser.add_argument("--import_time", action='store_true')
+    parser.add_argument("--import_budget", type=float, default=0.5, help='in seconds')
+
+    args = parser.parse_args()
+
+    if args.import_time:
+        sys.exit(0 if check_import_time(budget=args.import_budget) else 1)
+
+    run_benchmark(NROIS=args.nROIs,
+                  DURATIONS=args.durations,
+                  frame_rate=args.frame_rate,
+                  folder=args.folder,
+                  with_pdf=args.with_pdf,
+                  with_size_tuning=args.with_size_tuning,
+                  output=args.output)
@@ -0,0 +1,172 @@
+"""
+pairwise noise and signal correlations of the ROIs
+
+the (ROIs x ROIs) matrices are stored as their upper triangle in the
+condensed format of `scipy.spatial.distance` (pair (i,j), i<j, in row-major order),
+in float32: `squareform` gives back the full matrix when needed
+
+    - noise correlation: correlation of the trial residuals (response minus
+      the mean response of its condition), averaged over conditions
+      (weighted by their number of trials)
+    - signal correlation: correlation of the condition-averaged responses
+"""
+import numpy as np
+from scipy.spatial.distance import pdist, squareform
+
+from episodes import cumulative_responses, window_mean
+
+
+def condensed_index(i, j, n):
+    """ position of the pair (i,j), i<j, in the condensed upper triangle """
+    return n*i-i*(i+1)//2+j-i-1
+
+
+def blocked_correlation(Z,
+                        block_size=256,
+                        dtype=np.float32):
+    """
+    condensed upper triangle of Z^T Z, computed by (block_size x block_size)
+    blocks of ROIs so that the full matrix never sits in memory
+
+    Z: (samples x ROIs) normalized columns (see `normalized_residuals`)
+    """
+    n = Z.shape[1]
+    C = np.zeros(n*(n-1)//2, dtype=dtype)
+
+    for i0 in range(0, n, block_size):
+        i1 = min([i0+block_size, n])
+        for j0 in range(i0, n, block_size):
+            j1 = min([j0+block_size, n])
+            block = Z[:,i0:i1].T @ Z[:,j0:j1]
+            I, J = np.meshgrid(np.arange(i0, i1), np.arange(j0, j1), indexing='ij')
+            upper = I<J
+            C[condensed_index(I[upper], J[upper], n)] = block[upper]
+
+    return C
+
+
+def normalized_residuals(X, condition):
+    """
+    trial residuals, z-scored within each condition and weighted so that
+    Z^T Z is the trial-weighted average of the per-condition correlations
+
+    X: (episodes x ROIs), condition: (episodes,) condition index
+    (constant ROIs within a condition do not contribute)
+    """
+    Z = np.zeros(X.shape)
+    for c in np.unique(condition):
+        cond = (condition==c)
+        residual = X[cond]-np.mean(X[cond], axis=0)
+        norm = np.sqrt(np.sum(residual**2, axis=0))
+        Z[cond] = np.divide(residual, norm, out=np.zeros_like(residual), where=norm>0)*\
+                        np.sqrt(np.sum(cond)/len(condition))
+    return Z
+
+
+def response_matrix(tensor, interval, episodes=None):
+    """ (episodes x ROIs) window means and condition index, restricted to `episodes` """
+    X = window_mean(cumulative_responses(tensor['responses']), tensor['t'], interval)
+    condition = tensor['condition']
+    if episodes is not None:
+        X, condition = X[episodes], condition[episodes]
+    return X, condition
+
+
+def noise_correlations(tensor,
+                       interval=[1,2.5],
+                       episodes=None,
+                       per_condition=False,
+                       block_size=256):
+    """
+    noise correlations from an episode tensor (see `episodes.build_episode_tensor`)
+
+    interval: response window (the mean over the window is the trial response)
+    episodes: boolean mask to restrict to a subset of episodes (e.g. a behavioral state)
+    per_condition: also returns the (conditions x pairs) per-condition correlations,
+                   computed one condition at a time
+
+    returns {'pairs': condensed float32 correlations, ['per_condition']}
+    """
+    X, condition = response_matrix(tensor, interval, episodes)
+
+    output = {'pairs':blocked_correlation(normalized_residuals(X, condition),
+                                          block_size=block_size)}
+
+    if per_condition:
+        conds = np.unique(condition)
+        output['per_condition'] = np.zeros((len(conds), len(output['pairs'])), dtype=np.float32)
+        for k, c in enumerate(conds):
+            cond = (condition==c)
+            output['per_condition'][k] = blocked_correlation(\
+                    normalized_residuals(X[cond], np.zeros(np.sum(cond), dtype=int)),
+                    block_size=block_size)
+
+    return output
+
+
+def signal_correlations(tensor,
+                        interval=[1,2.5],
+                        episodes=None,
+                        block_size=256):
+    """
+    correlations of the condition-averaged responses (condensed float32)
+    """
+    X, condition = response_matrix(tensor, interval, episodes)
+    conds = np.unique(condition)
+    means = np.array([np.mean(X[condition==c], axis=0) for c in conds])
+    return blocked_correlation(normalized_residuals(means, np.zeros(len(conds), dtype=int)),
+                               block_size=block_size)
+
+
+def roi_positions(data,
+                  um_per_pixel=1.):
+    """
+    (valid ROIs x 2) centroids of the ROI masks of a `physion` Data object,
+    in the order of `data.valid_roiIndices`
+
+    the pixel masks are read at once from the PlaneSegmentation table
+    and averaged per ROI with `np.add.reduceat`
+    """
+    segmentation = data.nwbfile.processing['ophys'].data_interfaces['ImageSegmentation']
+    masks = segmentation.plane_segmentations['PlaneSegmentation']['pixel_mask']
+
+    ends = np.array(masks.data[:])
+    pixels = np.array(masks.target.data[:])
+    starts = np.concatenate([[0], ends[:-1]])
+
+    xy = np.array([pixels['x'], pixels['y']], dtype=float).T \
+            if pixels.dtype.names else np.asarray(pixels, dtype=float)[:,:2]
+    positions = np.add.reduceat(xy, starts, axis=0)/(ends-starts)[:,np.newaxis]
+
+    cells = np.flatnonzero(data.iscell) if hasattr(data, 'iscell') else np.arange(len(ends))
+    return um_per_pixel*positions[cells][data.valid_roiIndices]
+
+
+def distance_binned(pairs, positions,
+                    bins=np.arange(0, 520, 20)):
+    """
+    mean, s.e.m. and number of pairs of a condensed pairwise quantity
+    per bin of distance between the ROI centroids
+
+    returns {'bins', 'mean', 'sem', 'count'}
+    """
+    distance = pdist(positions)
+    ibin = np.digitize(distance, bins)-1
+    valid = (ibin>=0) & (ibin<len(bins)-1) & np.isfinite(pairs)
+
+    count = np.bincount(ibin[valid], minlength=len(bins)-1)
+    total = np.bincount(ibin[valid], weights=pairs[valid], minlength=len(bins)-1)
+    squares = np.bincount(ibin[valid], weights=pairs[valid].astype(float)**2, minlength=len(bins)-1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total/count
+        sem = np.sqrt(np.clip(squares/count-mean**2, 0, None)/np.clip(count-1, 1, None))
+
+    return {'bins':bins, 'mean':mean, 'sem':sem, 'count':count}
+
+
+def full_matrix(pairs):
+    """ (ROIs x ROIs) matrix from the condensed pairs (ones on the diagonal) """
+    C = squareform(pairs, checks=False)
+    np.fill_diagonal(C, 1)
+    return C
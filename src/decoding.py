@@ -0,0 +1,176 @@
+"""
+cross-validated decoding of the stimulus angle from the population responses
+
+decoders:
+    - 'nearest_centroid' : closest class mean (euclidean distance)
+    - 'ridge' : one-vs-rest regularized least squares (ridge classifier)
+
+the k folds are solved together: the training statistics of each fold are
+the statistics of the full set minus those of the test fold, and the ridge
+systems of all folds go through a single batched `np.linalg.solve`
+"""
+import os
+import multiprocessing as mp
+import numpy as np
+
+from selectivity import trial_responses
+
+
+def decoding_data(tensor,
+                  interval_pre=[-1.5,0],
+                  interval_post=[1,2.5],
+                  contrast=1):
+    """
+    (episodes x ROIs) evoked responses and (episodes,) angles of an episode tensor
+    (see `episodes.build_episode_tensor`)
+    """
+    return trial_responses(tensor,
+                           interval_pre=interval_pre,
+                           interval_post=interval_post,
+                           contrast=contrast)
+
+
+def stratified_folds(y, K=5, seed=0):
+    """
+    fold index of each sample, the classes being evenly split across folds
+    """
+    rng = np.random.default_rng(seed)
+    fold = np.zeros(len(y), dtype=int)
+    for label in np.unique(y):
+        samples = rng.permutation(np.flatnonzero(y==label))
+        fold[samples] = np.arange(len(samples))%K
+    return fold
+
+
+def one_hot(labels, N=None):
+    N = labels.max()+1 if N is None else N
+    return (labels[:,np.newaxis]==np.arange(N)[np.newaxis,:]).astype(float)
+
+
+def centroid_distances(X, labels, fold):
+    """
+    (samples x classes x ROIs) squared differences between each sample
+    and the class centroids of its training set (all folds but its own)
+
+    summing over any subset of ROIs gives the distances restricted to that subset
+    """
+    K, C = fold.max()+1, labels.max()+1
+    FC = (one_hot(fold, K)[:,:,np.newaxis]*one_hot(labels, C)[:,np.newaxis,:]).reshape(len(X), K*C)
+
+    sums, counts = (FC.T @ X).reshape(K, C, -1), FC.sum(axis=0).reshape(K, C)
+    centroids = (sums.sum(axis=0)-sums)/(counts.sum(axis=0)-counts)[:,:,np.newaxis]
+
+    return (X[:,np.newaxis,:]-centroids[fold])**2
+
+
+def nearest_centroid_cv(X, labels, fold):
+    """ cross-validated predictions of the nearest-centroid decoder """
+    return np.argmin(centroid_distances(X, labels, fold).sum(axis=2), axis=1)
+
+
+def ridge_cv(X, labels, fold,
+             alpha=1.):
+    """
+    cross-validated predictions of the ridge classifier (with a bias term)
+
+    the primal (ROIs x ROIs) systems are solved when there are fewer ROIs
+    than samples, the dual (samples x samples) systems otherwise,
+    where the test samples of a fold are decoupled by zeroing their kernel rows
+    """
+    K, C = fold.max()+1, labels.max()+1
+    Xa = np.concatenate([X, np.ones((len(X), 1))], axis=1)
+    Y = one_hot(labels, C)
+    train = (fold[np.newaxis,:]!=np.arange(K)[:,np.newaxis]).astype(float) # (folds x samples)
+
+    if Xa.shape[1]<=len(Xa):
+        # primal: (folds x P x P) Gram matrices of the training sets
+        XK = train[:,:,np.newaxis]*Xa[np.newaxis]
+        G = np.matmul(XK.transpose(0,2,1), Xa)+alpha*np.eye(Xa.shape[1])
+        W = np.linalg.solve(G, np.matmul(XK.transpose(0,2,1), Y))
+        scores = np.einsum('np,npc->nc', Xa, W[fold])
+    else:
+        # dual: W = Xa^T A, with (Ktrain + alpha I) A = Ytrain
+        Kernel = Xa @ Xa.T
+        A = np.linalg.solve(train[:,:,np.newaxis]*Kernel[np.newaxis]*train[:,np.newaxis,:]+\
+                                alpha*np.eye(len(Xa)),
+                            train[:,:,np.newaxis]*Y[np.newaxis])
+        scores = np.einsum('nm,nmc->nc', Kernel, A[fold])
+
+    return np.argmax(scores, axis=1)
+
+
+def cv_accuracy(X, y,
+                decoder='nearest_centroid',
+                K=5,
+                alpha=1.,
+                seed=0):
+    """ k-fold cross-validated accuracy """
+    classes, labels = np.unique(y, return_inverse=True)
+    fold = stratified_folds(labels, K=K, seed=seed)
+    if decoder=='nearest_centroid':
+        prediction = nearest_centroid_cv(X, labels, fold)
+    elif decoder=='ridge':
+        prediction = ridge_cv(X, labels, fold, alpha=alpha)
+    else:
+        raise ValueError('decoder "%s" not recognized !!' % decoder)
+    return np.mean(prediction==labels)
+
+
+def accuracy_vs_nROIs(X, y,
+                      NROIS=[1, 2, 5, 10, 20, 50, 100],
+                      Nsubsamples=20,
+                      decoder='nearest_centroid',
+                      K=5,
+                      alpha=1.,
+                      seed=0):
+    """
+    cross-validated accuracy for random subsets of ROIs of increasing size
+
+    for the nearest-centroid decoder, the (samples x classes x ROIs) distances
+    are computed once and all the subsets are evaluated with one matrix product
+
+    returns {'nROIs', 'accuracy' (nROIs x subsamples), 'chance'}
+    """
+    rng = np.random.default_rng(seed)
+    classes, labels = np.unique(y, return_inverse=True)
+    fold = stratified_folds(labels, K=K, seed=seed)
+
+    NROIS = np.array([n for n in NROIS if n<=X.shape[1]], dtype=int)
+    # (subsets x ROIs) selection masks
+    masks = np.zeros((len(NROIS)*Nsubsamples, X.shape[1]))
+    for i, n in enumerate(np.repeat(NROIS, Nsubsamples)):
+        masks[i, rng.choice(X.shape[1], n, replace=False)] = 1
+
+    if decoder=='nearest_centroid':
+        D = centroid_distances(X, labels, fold)
+        distances = D.reshape(-1, X.shape[1]) @ masks.T # (samples*classes x subsets)
+        prediction = np.argmin(distances.reshape(len(X), len(classes), -1), axis=1)
+        accuracy = np.mean(prediction==labels[:,np.newaxis], axis=0)
+    elif decoder=='ridge':
+        accuracy = np.array([np.mean(ridge_cv(X[:,mask>0], labels, fold, alpha=alpha)==labels)\
+                                for mask in masks])
+    else:
+        raise ValueError('decoder "%s" not recognized !!' % decoder)
+
+    return {'nROIs':NROIS,
+            'accuracy':accuracy.reshape(len(NROIS), Nsubsamples),
+            'chance':1./len(classes)}
+
+
+def _decode_session(args):
+    X, y, kwargs = args
+    return accuracy_vs_nROIs(X, y, **kwargs)
+
+
+def decode_sessions(SESSIONS,
+                    Nproc=None,
+                    **kwargs):
+    """
+    `accuracy_vs_nROIs` on a list of (X, y) sessions (see `decoding_data`),
+    one process per session
+    """
+    Nproc = min([Nproc or os.cpu_count(), len(SESSIONS)])
+    if Nproc<=1:
+        return [accuracy_vs_nROIs(X, y, **kwargs) for X, y in SESSIONS]
+    with mp.Pool(Nproc) as pool:
+        return pool.map(_decode_session, [(X, y, kwargs) for X, y in SESSIONS])
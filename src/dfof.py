@@ -0,0 +1,233 @@
+"""
+time-streaming computation of dF/F for long recordings
+
+the recording is processed by time chunks, with the overlap that the
+sliding F0 window needs, and the result is written to a memory-mapped
+.npy file: the peak memory depends on the chunk size, not on the duration
+
+definitions (shared by the in-memory and streaming versions):
+    - included ROIs: <rawFluo> > roi_to_neuropil_fluo_inclusion_factor * <neuropil>
+    - correctedFluo = rawFluo - neuropil_correction_factor * neuropil
+    - F0 = sliding percentile of correctedFluo over `sliding_window` seconds,
+           computed every `subsampling` frames and linearly interpolated
+    - ROIs with a non-positive F0 are discarded
+    - dFoF = (correctedFluo - F0) / F0
+
+this F0 is an implementation of physion's 'sliding_percentile' method,
+not a call to it: `check_against_build_dFoF` compares the two on a session
+before the streaming dFoF is mixed with `data.build_dFoF` results
+(only method_for_F0='sliding_percentile' is supported)
+"""
+import os, tempfile, weakref
+import numpy as np
+from scipy.ndimage import percentile_filter
+
+
+def roi_response_series(data, name='Fluorescence'):
+    """ the 'Fluorescence' / 'Neuropil' series of the ophys module """
+    if hasattr(data, name):
+        return getattr(data, name)
+    return data.nwbfile.processing['ophys'].data_interfaces[name].roi_response_series[name]
+
+
+def read_block(dataset, rois, i0, i1, Nt):
+    """
+    (ROIs x time) block of a dataset stored either ROI-major or time-major
+    (Nt samples), only the requested hyperslab is read from disk
+    """
+    if dataset.shape[-1]==Nt:
+        return np.asarray(dataset[rois, i0:i1], dtype=np.float64)
+    else:
+        return np.asarray(dataset[i0:i1, rois], dtype=np.float64).T
+
+
+def interpolate_F0(F0d, i0, i1, j0, subsampling):
+    """
+    linear interpolation at frames [i0, i1) of a F0 computed every
+    `subsampling` frames, F0d[:, j] being the value at frame (j0+j)*subsampling
+    """
+    frames = np.arange(i0, i1)
+    j = frames//subsampling-j0
+    w = (frames%subsampling)/subsampling
+    jnext = np.clip(j+1, 0, F0d.shape[1]-1)
+    return (1-w)*F0d[:,j]+w*F0d[:,jnext]
+
+
+def sliding_F0(correctedFluo, percentile=5., Window=1000):
+    """ sliding percentile along time (Window in samples) """
+    return percentile_filter(correctedFluo, percentile,
+                             size=(1, max([1, Window])), mode='reflect')
+
+
+def check_method(method_for_F0='sliding_percentile',
+                 with_correctedFluo_and_F0=False):
+    """ the `build_dFoF` options without streaming equivalent are rejected """
+    if method_for_F0!='sliding_percentile':
+        raise ValueError('method_for_F0="%s" has no streaming version, use data.build_dFoF' %\
+                                  method_for_F0)
+    if with_correctedFluo_and_F0:
+        raise ValueError('with_correctedFluo_and_F0 has no streaming version, use data.build_dFoF')
+
+
+def compute_dFoF(rawFluo, neuropil, dt,
+                 roi_to_neuropil_fluo_inclusion_factor=1.15,
+                 neuropil_correction_factor=0.7,
+                 method_for_F0='sliding_percentile',
+                 percentile=5.,
+                 sliding_window=300, # seconds
+                 subsampling=10,
+                 with_correctedFluo_and_F0=False):
+    """
+    in-memory version (reference for the streaming computation)
+
+    returns dFoF, valid_roiIndices
+    """
+    check_method(method_for_F0, with_correctedFluo_and_F0)
+
+    included = np.flatnonzero(np.mean(rawFluo, axis=1)>\
+                    roi_to_neuropil_fluo_inclusion_factor*np.mean(neuropil, axis=1))
+
+    correctedFluo = rawFluo[included]-neuropil_correction_factor*neuropil[included]
+    F0d = sliding_F0(correctedFluo[:,::subsampling], percentile=percentile,
+                     Window=int(sliding_window/dt/subsampling))
+    F0 = interpolate_F0(F0d, 0, rawFluo.shape[1], 0, subsampling)
+
+    positive = np.min(F0d, axis=1)>0
+
+    return ((correctedFluo-F0)/F0)[positive], included[positive]
+
+
+def build_dFoF_streaming(data,
+                         roi_to_neuropil_fluo_inclusion_factor=1.15,
+                         neuropil_correction_factor=0.7,
+                         method_for_F0='sliding_percentile',
+                         percentile=5.,
+                         sliding_window=300, # seconds
+                         subsampling=10, # frames
+                         chunk_duration=600, # seconds
+                         filename=None,
+                         dtype=np.float64,
+                         roiIndices=None,
+                         with_correctedFluo_and_F0=False,
+                         verbose=True):
+    """
+    streaming equivalent of `compute_dFoF` on a `physion` Data object
+
+    sets data.dFoF (a (valid ROIs x time) memory-mapped array), data.t_dFoF,
+    data.valid_roiIndices and data.vNrois, as `data.build_dFoF`
+
+    filename: where the array is kept, by default a temporary file
+    removed when the array is released
+    roiIndices: only these cells (indices among the cells), the rows of
+    the other ones are not read (each ROI is processed independently)
+    """
+    check_method(method_for_F0, with_correctedFluo_and_F0)
+
+    Fluorescence = roi_response_series(data, 'Fluorescence')
+    Neuropil = roi_response_series(data, 'Neuropil')
+
+    t = np.array(Fluorescence.timestamps[:])
+    dt, Nt = t[1]-t[0], len(t)
+    rois = np.flatnonzero(data.iscell) if hasattr(data, 'iscell') else\
+                np.arange(min(Fluorescence.data.shape))
+    if roiIndices is not None:
+        rois = rois[np.unique(roiIndices)]
+
+    # chunks are aligned on the subsampling
+    Window = int(sliding_window/dt/subsampling)
+    chunk = subsampling*max([1, int(chunk_duration/dt/subsampling)])
+    halo = Window//2+2 # in subsampled frames
+
+    # 1) inclusion criterion, from the time averages
+    meanFluo, meanNeuropil = np.zeros(len(rois)), np.zeros(len(rois))
+    for i0 in range(0, Nt, chunk):
+        meanFluo += read_block(Fluorescence.data, rois, i0, min([i0+chunk, Nt]), Nt).sum(axis=1)/Nt
+        meanNeuropil += read_block(Neuropil.data, rois, i0, min([i0+chunk, Nt]), Nt).sum(axis=1)/Nt
+    included = rois[meanFluo>roi_to_neuropil_fluo_inclusion_factor*meanNeuropil]
+
+    temporary = (filename is None)
+    if temporary:
+        fd, filename = tempfile.mkstemp(prefix='dFoF-', suffix='.npy')
+        os.close(fd)
+    dFoF = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype,
+                                     shape=(len(included), Nt))
+
+    # 2) F0 and dFoF per time chunk
+    minF0 = np.full(len(included), np.inf)
+    for i0 in range(0, Nt, chunk):
+
+        i1 = min([i0+chunk, Nt])
+        if verbose:
+            print('   - dFoF: [%.0f, %.0f]s / %.0fs ' % (t[i0], t[i1-1], t[-1]))
+
+        j0 = max([0, i0//subsampling-halo])
+        k1 = min([Nt, (i1//subsampling+halo)*subsampling])
+
+        correctedFluo = read_block(Fluorescence.data, included, j0*subsampling, k1, Nt)-\
+                neuropil_correction_factor*read_block(Neuropil.data, included, j0*subsampling, k1, Nt)
+
+        F0d = sliding_F0(correctedFluo[:,::subsampling], percentile=percentile, Window=Window)
+        # only the F0 of the chunk itself is used (the overlap is only needed for the window)
+        jc0, jc1 = i0//subsampling-j0, min([F0d.shape[1], (i1-1)//subsampling-j0+1])
+        minF0 = np.minimum(minF0, np.min(F0d[:,jc0:jc1], axis=1))
+
+        F0 = interpolate_F0(F0d, i0, i1, j0, subsampling)
+        correctedFluo = correctedFluo[:, i0-j0*subsampling:i1-j0*subsampling]
+        dFoF[:,i0:i1] = (correctedFluo-F0)/F0
+
+    # 3) ROIs with non-positive F0 are removed, chunk by chunk
+    positive = np.flatnonzero(minF0>0)
+    if len(positive)<len(included):
+        dFoF.flush()
+        kept = np.lib.format.open_memmap(filename+'.tmp', mode='w+', dtype=dtype,
+                                         shape=(len(positive), Nt))
+        for i0 in range(0, Nt, chunk):
+            kept[:,i0:i0+chunk] = dFoF[positive, i0:i0+chunk]
+        kept.flush()
+        del dFoF, kept
+        os.replace(filename+'.tmp', filename)
+        dFoF = np.load(filename, mmap_mode='r+')
+
+    if temporary:
+        # the array stays readable through its mapping, the disk space is freed with it
+        try:
+            os.remove(filename)
+        except PermissionError: # (Windows) a mapped file can not be removed
+            weakref.finalize(dFoF, os.remove, filename)
+
+    data.dFoF = dFoF
+    data.t_dFoF = t
+    data.valid_roiIndices = included[positive]
+    data.vNrois = len(positive)
+
+    return data.dFoF
+
+
+def check_against_build_dFoF(filename,
+                             chunk_duration=600,
+                             **build_args):
+    """
+    streaming vs physion's `data.build_dFoF` on the same session and arguments
+
+    returns {'same_rois': bool, 'max_abs_diff', 'median_abs_diff' (on the common ROIs)}
+    """
+    import analysis # adds physion to the path
+    from physion.analysis.read_NWB import Data
+
+    data = Data(filename, verbose=False)
+    data.build_dFoF(verbose=False, **build_args)
+    dFoF, rois = np.array(data.dFoF), np.array(data.valid_roiIndices)
+    data.io.close()
+
+    data = Data(filename, verbose=False)
+    with tempfile.TemporaryDirectory() as folder:
+        build_dFoF_streaming(data, chunk_duration=chunk_duration,
+                             filename=os.path.join(folder, 'dFoF.npy'), verbose=False, **build_args)
+        common, i, j = np.intersect1d(rois, data.valid_roiIndices, return_indices=True)
+        diff = np.abs(dFoF[i]-data.dFoF[j]) if len(common)>0 else np.zeros(1)
+        output = {'same_rois':np.array_equal(rois, data.valid_roiIndices),
+                  'max_abs_diff':float(np.max(diff)),
+                  'median_abs_diff':float(np.median(diff))}
+        del data.dFoF
+    data.io.close()
+    return output
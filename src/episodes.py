@@ -0,0 +1,125 @@
+import numpy as np
+
+from analysis import load_EpisodeData
+import profiling
+
+
+def build_episode_tensor(data,
+                         quantity='dFoF',
+                         protocol_name='ff-gratings-8orientation-2contrasts-10repeats',
+                         dtype=np.float64,
+                         with_running_speed=False,
+                         verbose=True):
+    """
+    extracts once the (episodes x ROIs x time) responses of a protocol
+    so that many analysis settings can be evaluated on them afterwards
+
+    dtype=np.float32 halves the memory (see `imaging.dtype_deviation` to validate)
+    with_running_speed: adds the mean running speed of each episode
+    """
+    protocol_id = data.get_protocol_id(protocol_name=protocol_name)
+    EpisodeData = load_EpisodeData()
+    from deconvolution import episode_quantity
+
+    # 'deconvolved' is read by EpisodeData in place of dFoF
+    with episode_quantity(data, quantity) as episode_q,\
+            profiling.stage('EpisodeData'):
+        EPISODES = EpisodeData(data,
+                               quantities=[episode_q]+\
+                                    (['Running-Speed'] if with_running_speed else []),
+                               protocol_id=protocol_id,
+                               verbose=verbose)
+
+    tensor = episode_tensor(EPISODES, quantity=episode_q, dtype=dtype)
+    tensor['quantity'] = quantity
+    return tensor
+
+
+def episode_tensor(EPISODES, quantity='dFoF', dtype=np.float64):
+    """
+    converts an EpisodeData object into a plain dictionary:
+        - 't' : time relative to stimulus onset
+        - 'responses' : (episodes x ROIs x time) C-contiguous array
+        - 'varied_parameters' : {key: unique values}
+        - one (episodes,) array per varied parameter (e.g. 'angle', 'contrast')
+        - 'condition' : condition index of each episode
+        - 'conditions' : {key: parameter value of each condition}
+        - 'running_speed' : mean speed of each episode (if computed in EPISODES)
+    """
+    responses = np.ascontiguousarray(getattr(EPISODES, quantity), dtype=dtype)
+    if responses.ndim==2:
+        # single ROI recordings
+        responses = responses[:,np.newaxis,:]
+
+    tensor = {'t':np.asarray(EPISODES.t),
+              'quantity':quantity,
+              'responses':responses,
+              'varied_parameters':{key:np.array(values) for key, values\
+                                        in EPISODES.varied_parameters.items()}}
+
+    for key in tensor['varied_parameters']:
+        tensor[key] = np.array(getattr(EPISODES, key))
+
+    tensor['condition'], tensor['conditions'] = condition_index(tensor)
+
+    if hasattr(EPISODES, 'RunningSpeed'):
+        tensor['running_speed'] = np.mean(EPISODES.RunningSpeed, axis=1)
+
+    return tensor
+
+
+def condition_index(tensor, keys=None):
+    """
+    labels each episode with the index of its combination of varied parameters
+
+    conditions are sorted as in `EpisodeData.compute_summary_data`
+    (lexicographic order over the varied parameters)
+
+    returns labels (episodes,) and {key: parameter value of each condition}
+    """
+    if keys is None:
+        keys = list(tensor['varied_parameters'].keys())
+
+    Nepisodes = tensor['responses'].shape[0]
+
+    if len(keys)==0:
+        return np.zeros(Nepisodes, dtype=int), {}
+
+    values = np.array([tensor[key] for key in keys]).T
+    uniques, labels = np.unique(values, axis=0, return_inverse=True)
+
+    return labels.ravel(), {key:uniques[:,i] for i, key in enumerate(keys)}
+
+
+def cumulative_responses(responses):
+    """
+    cumulative sum over the time axis, with a leading zero:
+        C[..., i1]-C[..., i0] = sum(responses[..., i0:i1])
+
+    all window means then cost O(1) per window
+    (accumulated in the dtype of the responses)
+    """
+    C = np.zeros(responses.shape[:-1]+(responses.shape[-1]+1,), dtype=responses.dtype)
+    np.cumsum(responses, axis=-1, out=C[...,1:])
+    return C
+
+
+def window_slice(t, interval):
+    """
+    index bounds of the samples inside the closed interval, i.e. the same
+    samples than (t>=interval[0]) & (t<=interval[1]), as in physion's
+    `EpisodeData.compute_interval_cond`
+    """
+    i0 = np.searchsorted(t, interval[0], side='left')
+    i1 = np.searchsorted(t, interval[1], side='right')
+    if i1<=i0:
+        raise ValueError('no time sample in the interval [%.2f, %.2f]' % tuple(interval))
+    return i0, i1
+
+
+def window_mean(C, t, interval):
+    """
+    mean over a time window from the cumulative responses (see `cumulative_responses`)
+    """
+    i0, i1 = window_slice(t, interval)
+    return (C[...,i1]-C[...,i0])/(i1-i0)
@@ -0,0 +1,172 @@
+"""
+storage of the imaging arrays: dtype and memory layout
+
+all (ROIs x time) arrays are stored C-contiguous (ROI-major), so that the
+per-ROI accesses like `data.dFoF[roi,:]` read contiguous memory,
+and can be stored in float32 to halve the memory and bandwidth
+"""
+import hashlib
+import numpy as np
+
+IMAGING_QUANTITIES = ['dFoF', 'rawFluo', 'neuropil', 'correctedFluo', 'correctedFluo0']
+
+
+def as_roi_major(array, dtype=np.float32):
+    """ C-contiguous (ROIs x time) copy of the array (no copy if already fine) """
+    return np.ascontiguousarray(array, dtype=dtype)
+
+
+def array_digest(array, block=256):
+    """
+    md5 of the content of a (ROIs x time) array (with its dtype and shape),
+    read by blocks of ROIs so that memory-mapped arrays are not loaded at once
+    """
+    md5 = hashlib.md5(('%s%s' % (np.dtype(array.dtype).str, array.shape)).encode())
+    for r0 in range(0, len(array), block):
+        md5.update(np.ascontiguousarray(array[r0:r0+block]).tobytes())
+    return md5.hexdigest()
+
+
+def format_imaging_arrays(data,
+                          dtype=np.float32,
+                          quantities=IMAGING_QUANTITIES,
+                          verbose=False):
+    """
+    converts in place the imaging arrays of a `physion` Data object
+
+    memory-mapped arrays (see `dfof.build_dFoF_streaming`) are left on disk
+    """
+    for quantity in quantities:
+        array = getattr(data, quantity, None)
+        if isinstance(array, np.ndarray) and not isinstance(array, np.memmap):
+            setattr(data, quantity, as_roi_major(array, dtype=dtype))
+            if verbose:
+                print('   - %s: %s, %.1fMB' % (quantity, np.dtype(dtype).name,
+                                              getattr(data, quantity).nbytes/1024**2))
+    return data
+
+
+def dtype_deviation(tensor,
+                    stat_test_props=dict(interval_pre=[-1.5,0],
+                                         interval_post=[1,2.5],
+                                         test='ttest',
+                                         positive=True),
+                    thresholds=[5e-2, 1e-2, 1e-3],
+                    dtype=np.float32,
+                    verbose=True):
+    """
+    validation of the reduced precision on an episode tensor:
+    the p-value summaries are computed in float64 and in `dtype`
+
+    returns the max. deviations of the evoked values and p-values,
+    and the number of ROIs whose responsiveness changes at each threshold
+    """
+    from responsiveness import pvalue_summary, roi_min_pvalue
+
+    SUMMARIES = [pvalue_summary(dict(tensor, responses=as_roi_major(tensor['responses'], dtype=d)),
+                                stat_test_props=stat_test_props) for d in [np.float64, dtype]]
+
+    deviation = {'value':np.max(np.abs(SUMMARIES[0]['value']-SUMMARIES[1]['value'])),
+                 'pvalue':np.max(np.abs(SUMMARIES[0]['pvalue']-SUMMARIES[1]['pvalue'])),
+                 'changed_ROIs':{}}
+
+    min_p = [roi_min_pvalue(summary) for summary in SUMMARIES]
+    for threshold in thresholds:
+        deviation['changed_ROIs'][threshold] = int(np.sum((min_p[0]<threshold)!=(min_p[1]<threshold)))
+
+    if verbose:
+        print('%s vs float64: max. deviation of values %.1e, of p-values %.1e' % (\
+                np.dtype(dtype).name, deviation['value'], deviation['pvalue']))
+        for threshold in thresholds:
+            print('   - p<%.0e: %i ROIs change responsiveness' % (threshold,
+                                                              deviation['changed_ROIs'][threshold]))
+
+    return deviation
+
+
+def load_roi_window(data,
+                    roiIndices=None,
+                    tlim=None,
+                    roi_to_neuropil_fluo_inclusion_factor=None,
+                    neuropil_correction_factor=0.7,
+                    method_for_F0='sliding_percentile',
+                    percentile=5.,
+                    sliding_window=300, # seconds
+                    subsampling=10, # frames
+                    chunk_duration=600, # seconds, for the inclusion criterion
+                    dtype=np.float64):
+    """
+    partial loading of a ROI subset and a time window of a `physion` Data object:
+    only the (ROIs x window) hyperslabs are read from the NWB file
+
+    roiIndices: indices among the cells (rows of `data.rawFluo`), all if None,
+                in any order and possibly repeated (the rows follow that order)
+    tlim: [tstart, tstop] in seconds, full recording if None
+
+    sets data.rawFluo, data.neuropil, data.dFoF (same definitions than
+    `dfof.compute_dFoF`, without the inclusion criterion unless a factor is given),
+    data.t_rawFluo, data.t_dFoF, data.valid_roiIndices and data.vNrois,
+    so that the figure functions can be used on the subset
+
+    the F0 window is read around tlim, so that dFoF is the one
+    of the full recording (except within sliding_window/2 of the edges),
+    the inclusion criterion uses the means over the full recording (as `build_dFoF`),
+    read by chunks of `chunk_duration`
+    """
+    from dfof import roi_response_series, read_block, sliding_F0, interpolate_F0, check_method
+
+    check_method(method_for_F0)
+
+    Fluorescence = roi_response_series(data, 'Fluorescence')
+    Neuropil = roi_response_series(data, 'Neuropil')
+
+    t = np.array(Fluorescence.timestamps[:])
+    dt, Nt = t[1]-t[0], len(t)
+
+    cells = np.flatnonzero(data.iscell) if hasattr(data, 'iscell') else\
+                np.arange(min(Fluorescence.data.shape))
+    roiIndices = np.arange(len(cells)) if roiIndices is None else np.array(roiIndices)
+
+    # h5py selections need increasing and unique indices
+    unique, inverse = np.unique(roiIndices, return_inverse=True)
+    rows = cells[unique]
+
+    i0, i1 = (0, Nt) if tlim is None else (np.searchsorted(t, tlim[0]), np.searchsorted(t, tlim[1]))
+    # subsampled frames of the F0 window around the time window
+    Window = int(sliding_window/dt/subsampling)
+    j0 = max([0, i0//subsampling-Window//2-2])
+    k1 = min([Nt, (i1//subsampling+Window//2+2)*subsampling])
+
+    rawFluo = read_block(Fluorescence.data, rows, j0*subsampling, k1, Nt)[inverse]
+    neuropil = read_block(Neuropil.data, rows, j0*subsampling, k1, Nt)[inverse]
+
+    correctedFluo = rawFluo-neuropil_correction_factor*neuropil
+    F0 = interpolate_F0(sliding_F0(correctedFluo[:,::subsampling],
+                                   percentile=percentile, Window=Window),
+                        i0, i1, j0, subsampling)
+
+    window = slice(i0-j0*subsampling, i1-j0*subsampling)
+    data.rawFluo = as_roi_major(rawFluo[:,window], dtype=dtype)
+    data.neuropil = as_roi_major(neuropil[:,window], dtype=dtype)
+    data.dFoF = as_roi_major((correctedFluo[:,window]-F0)/F0, dtype=dtype)
+    data.t_rawFluo = data.t_dFoF = t[i0:i1]
+
+    valid = np.ones(len(roiIndices), dtype=bool)
+    if roi_to_neuropil_fluo_inclusion_factor is not None:
+        if (j0==0) and (k1==Nt):
+            meanFluo, meanNeuropil = np.mean(rawFluo, axis=1), np.mean(neuropil, axis=1)
+        else:
+            meanFluo, meanNeuropil = np.zeros(len(rows)), np.zeros(len(rows))
+            chunk = max([1, int(chunk_duration/dt)])
+            for k0 in range(0, Nt, chunk):
+                meanFluo += read_block(Fluorescence.data, rows, k0, min([k0+chunk, Nt]), Nt).sum(axis=1)/Nt
+                meanNeuropil += read_block(Neuropil.data, rows, k0, min([k0+chunk, Nt]), Nt).sum(axis=1)/Nt
+            meanFluo, meanNeuropil = meanFluo[inverse], meanNeuropil[inverse]
+        valid = meanFluo>roi_to_neuropil_fluo_inclusion_factor*meanNeuropil
+        for quantity in ['rawFluo', 'neuropil', 'dFoF']:
+            setattr(data, quantity, getattr(data, quantity)[valid])
+
+    data.valid_roiIndices = roiIndices[valid]
+    data.vNrois = int(np.sum(valid))
+
+    return data
@@ -0,0 +1,121 @@
+"""
+modulation of the evoked responses by locomotion
+
+episodes are split into running / still by their mean running speed,
+for every ROI, condition and speed threshold at once:
+
+    - run / still evoked responses (post-pre window means)
+    - modulation index: (run-still)/(|run|+|still|)
+    - permutation p-value of run-still (labels shuffled within each condition)
+
+all the (threshold, condition) averages are rows of one weight matrix applied
+to the (episodes x ROIs) evoked responses, so each permutation batch is a
+single matrix product
+"""
+import numpy as np
+
+from episodes import cumulative_responses, window_mean
+
+
+def evoked_responses(tensor,
+                     interval_pre=[-1,0],
+                     interval_post=[1,2]):
+    """ (episodes x ROIs) post-pre window means of an episode tensor """
+    C = cumulative_responses(tensor['responses'])
+    return window_mean(C, tensor['t'], interval_post)-window_mean(C, tensor['t'], interval_pre)
+
+
+def split_weights(running, condition, Nconds):
+    """
+    (thresholds x conditions x episodes) weights giving the running and the
+    still means of each condition, and the (thresholds x conditions) counts
+
+    running: (thresholds x episodes) boolean
+    """
+    onehot = (condition[np.newaxis,:]==np.arange(Nconds)[:,np.newaxis]) # (conds x episodes)
+    run = running[:,np.newaxis,:] & onehot[np.newaxis]
+    still = ~running[:,np.newaxis,:] & onehot[np.newaxis]
+    n_run, n_still = run.sum(axis=2), still.sum(axis=2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        W_run = run/n_run[:,:,np.newaxis]
+        W_still = still/n_still[:,:,np.newaxis]
+    return W_run, W_still, n_run, n_still
+
+
+def running_modulation(tensor,
+                       thresholds=[0.1], # cm/s
+                       interval_pre=[-1,0],
+                       interval_post=[1,2],
+                       Npermutations=1000,
+                       permutation_batch=50,
+                       seed=0):
+    """
+    run vs still responses for all ROIs, conditions and thresholds
+
+    the tensor needs the episode running speed
+    (`episodes.build_episode_tensor(..., with_running_speed=True)`)
+
+    returns a dictionary with:
+        'run', 'still', 'modulation_index', 'pvalue' : (thresholds x ROIs x conditions)
+        'n_run', 'n_still' : (thresholds x conditions) number of episodes
+        'thresholds', 'conditions'
+    conditions without running or without still episodes give nan values and p=1
+    """
+    rng = np.random.default_rng(seed)
+    thresholds = np.atleast_1d(thresholds)
+
+    X = evoked_responses(tensor, interval_pre=interval_pre, interval_post=interval_post)
+    condition, Nconds = tensor['condition'], tensor['condition'].max()+1
+    running = tensor['running_speed'][np.newaxis,:]>thresholds[:,np.newaxis]
+
+    W_run, W_still, n_run, n_still = split_weights(running, condition, Nconds)
+    T, Nrois = len(thresholds), X.shape[1]
+    run = (W_run.reshape(T*Nconds, -1) @ X).reshape(T, Nconds, Nrois).transpose(0,2,1)
+    still = (W_still.reshape(T*Nconds, -1) @ X).reshape(T, Nconds, Nrois).transpose(0,2,1)
+    diff = np.abs(run-still)
+
+    # permutations of the episodes within each condition
+    exceed = np.zeros((T, Nrois, Nconds))
+    groups = [np.flatnonzero(condition==c) for c in range(Nconds)]
+    for p0 in range(0, Npermutations, permutation_batch):
+        P = min([permutation_batch, Npermutations-p0])
+        perm = np.tile(np.arange(len(condition)), (P, 1))
+        for group in groups:
+            perm[:,group] = group[rng.permuted(np.tile(np.arange(len(group)), (P, 1)), axis=1)]
+        # the running labels follow the permuted episodes, the counts are unchanged
+        W = np.concatenate([(W_run-W_still)[:,:,perm[i]] for i in range(P)], axis=1)
+        D = (W.reshape(T*P*Nconds, -1) @ X).reshape(T, P, Nconds, Nrois)
+        # ties count as exceedances (up to rounding errors)
+        exceed += np.sum(np.abs(D)>=diff.transpose(0,2,1)[:,np.newaxis]-1e-12, axis=1).transpose(0,2,1)
+
+    pvalue = (1+exceed)/(1+Npermutations)
+    valid = ((n_run>0) & (n_still>0))[:,np.newaxis,:]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        modulation_index = (run-still)/(np.abs(run)+np.abs(still))
+
+    return {'run':np.where(valid, run, np.nan),
+            'still':np.where(valid, still, np.nan),
+            'modulation_index':np.where(valid, modulation_index, np.nan),
+            'pvalue':np.where(valid, pvalue, 1.),
+            'n_run':n_run, 'n_still':n_still,
+            'thresholds':thresholds,
+            'conditions':tensor['conditions']}
+
+
+def sensitivity_curves(modulation,
+                       alpha=0.05,
+                       rois=None):
+    """
+    per threshold: fraction of (ROI, condition) pairs with a significant
+    modulation and mean modulation index, over the ROIs `rois` (all if None)
+
+    returns {'thresholds', 'fraction_modulated', 'mean_modulation_index'}
+    """
+    rois = slice(None) if rois is None else rois
+    pvalue, index = modulation['pvalue'][:,rois], modulation['modulation_index'][:,rois]
+    valid = np.isfinite(index)
+    return {'thresholds':modulation['thresholds'],
+            'fraction_modulated':np.sum((pvalue<alpha) & valid, axis=(1,2))/\
+                                    np.clip(np.sum(valid, axis=(1,2)), 1, None),
+            'mean_modulation_index':np.nanmean(index.reshape(len(index), -1), axis=1)}
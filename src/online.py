@@ -0,0 +1,232 @@
+"""
+online tuning estimates, updated episode by episode during the acquisition
+
+    online = OnlineTuning(nROIs, conditions)
+    for episode in file_stream('episodes.jsonl'):
+        online.update(episode['pre'], episode['post'], episode['parameters'])
+        online.tuning()['responsive'] # provisional
+
+per (ROI, condition): running means and sums of squared deviations (Welford)
+of the pre and post window means and of their difference, so that the memory
+is O(ROIs x conditions) and an episode costs O(ROIs), whatever the number of
+episodes already received. With all the episodes, the values and p-values are
+those of `responsiveness.evoked_stats` ('ttest' or 'anova').
+
+acquisition stand-ins (one episode per json line, see `episode_message`):
+    - `replay_stream`: the episodes of a recorded session (episode tensor)
+    - `file_stream`: a file where the episodes are appended
+    - `socket_stream`: a TCP connection
+"""
+import os, json, time, socket, itertools
+import numpy as np
+from scipy import stats
+
+from responsiveness import significant, tuning_summary
+from selectivity import vector_sum
+
+
+class Welford:
+    """ running (conditions x ROIs) means and sums of squared deviations """
+
+    def __init__(self, Nconds, nROIs):
+        self.mean = np.zeros((Nconds, nROIs))
+        self.M2 = np.zeros((Nconds, nROIs))
+
+    def update(self, c, n, x):
+        """ adds x (ROIs,) as the n-th sample of condition c """
+        delta = x-self.mean[c]
+        self.mean[c] += delta/n
+        self.M2[c] += delta*(x-self.mean[c])
+
+
+class OnlineTuning:
+    """
+    nROIs: number of ROIs of the stream
+    conditions: {key: parameter value of each condition} (see `episodes.condition_index`)
+    """
+
+    def __init__(self, nROIs, conditions,
+                 test='ttest'):
+        self.conditions = {k:np.asarray(v) for k, v in conditions.items()}
+        self.keys = list(self.conditions)
+        Nconds = len(self.conditions[self.keys[0]])
+        self.index = {tuple(float(self.conditions[k][c]) for k in self.keys):c for c in range(Nconds)}
+        self.test = test
+        self.n = np.zeros(Nconds, dtype=int)
+        self.pre, self.post, self.diff = [Welford(Nconds, nROIs) for i in range(3)]
+
+    def condition(self, parameters):
+        """ condition index of an episode from its parameters {key: value} """
+        return self.index[tuple(float(parameters[k]) for k in self.keys)]
+
+    def update(self, pre, post, parameters):
+        """ adds an episode: (ROIs,) pre and post window means """
+        c = self.condition(parameters) if isinstance(parameters, dict) else parameters
+        pre, post = np.asarray(pre, dtype=float), np.asarray(post, dtype=float)
+        self.n[c] += 1
+        for W, x in zip([self.pre, self.post, self.diff], [pre, post, post-pre]):
+            W.update(c, self.n[c], x)
+
+    def summary(self):
+        """ current (ROIs x conditions) 'value', 'std-value', 'pvalue', 'ntrials' (as `evoked_stats`) """
+        n = self.n
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if self.test=='ttest':
+                t = self.diff.mean/np.sqrt(self.diff.M2/(n-1)[:,np.newaxis]/n[:,np.newaxis])
+                pvalue = 2*stats.t.sf(np.abs(t), (n-1)[:,np.newaxis])
+            elif self.test=='anova':
+                F = (n/2)[:,np.newaxis]*(self.post.mean-self.pre.mean)**2/\
+                        ((self.pre.M2+self.post.M2)/(2*n-2)[:,np.newaxis])
+                pvalue = stats.f.sf(F, 1, (2*n-2)[:,np.newaxis])
+            else:
+                raise ValueError('no online estimate for test "%s"' % self.test)
+            std = np.sqrt(self.diff.M2/n[:,np.newaxis])
+
+        pvalue[~np.isfinite(pvalue)] = 1. # too few episodes (or constant responses)
+        return {'value':self.diff.mean.T.copy(),
+                'std-value':std.T,
+                'pvalue':pvalue.T,
+                'ntrials':n.copy()}
+
+    def tuning(self,
+               threshold=0.01,
+               positive=True,
+               contrast=1):
+        """
+        provisional orientation tuning of all ROIs, the `tuning_summary` output
+        plus 'SI' (Pref-Orth)/(Pref+Orth) and the vector-sum 'OSI' (ROIs,)
+        """
+        summary = self.summary()
+        angles = np.unique(self.conditions['angle'])
+        output = tuning_summary(summary, self.conditions, angles,
+                                signif=significant(summary, threshold=threshold, positive=positive),
+                                contrast=contrast)
+
+        cond = np.ones(len(self.conditions['angle']), dtype=bool)
+        if 'contrast' in self.conditions:
+            cond = (self.conditions['contrast']==contrast)
+        values, cond_angles = summary['value'][:,cond], self.conditions['angle'][cond]
+
+        ipref = np.argmax(values, axis=1)
+        iorth = np.argmin(((cond_angles[ipref][:,np.newaxis]+90)%180-cond_angles[np.newaxis,:])**2, axis=1)
+        pref, orth = values[np.arange(len(values)), ipref], values[np.arange(len(values)), iorth]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            output['SI'] = np.where(pref>0, np.clip((pref-orth)/(pref+orth), 0, 1), 0)
+        output['OSI'] = vector_sum(values, cond_angles)['OSI']
+        output['ntrials'] = summary['ntrials']
+        return output
+
+
+def condition_grid(VALUES):
+    """ conditions of all the combinations of the parameter values {key: [values]} """
+    keys = list(VALUES)
+    combinations = list(itertools.product(*[VALUES[k] for k in keys]))
+    return {k:np.array([c[i] for c in combinations], dtype=float) for i, k in enumerate(keys)}
+
+
+# --------------------------------------------------------------- #
+#                   acquisition stream stand-ins                  #
+# --------------------------------------------------------------- #
+
+def episode_message(pre, post, parameters):
+    """ json line of an episode """
+    return json.dumps({'parameters':{k:float(v) for k, v in parameters.items()},
+                       'pre':np.asarray(pre, dtype=float).tolist(),
+                       'post':np.asarray(post, dtype=float).tolist()})+'\n'
+
+
+def read_message(line):
+    episode = json.loads(line)
+    episode['pre'], episode['post'] = np.array(episode['pre']), np.array(episode['post'])
+    return episode
+
+
+def replay_stream(tensor,
+                  interval_pre=[-1,0],
+                  interval_post=[1,2],
+                  delay=0.):
+    """ the episodes of an episode tensor, in their order, every `delay` seconds """
+    from episodes import cumulative_responses, window_mean
+    C = cumulative_responses(tensor['responses'])
+    pre = window_mean(C, tensor['t'], interval_pre)
+    post = window_mean(C, tensor['t'], interval_post)
+    keys = list(tensor['conditions'])
+    for i in range(len(pre)):
+        time.sleep(delay)
+        yield {'parameters':{k:tensor[k][i] for k in keys}, 'pre':pre[i], 'post':post[i]}
+
+
+def file_stream(filename,
+                poll=0.5, # s
+                timeout=60.): # s without new episode -> end of the stream
+    """ the episodes appended (as json lines) to `filename` """
+    while not os.path.isfile(filename):
+        time.sleep(poll)
+    last = time.time()
+    buffer = ''
+    with open(filename) as io:
+        while time.time()-last<timeout:
+            buffer += io.read()
+            # complete lines only (the writer may be in the middle of one)
+            lines = buffer.split('\n')
+            buffer = lines.pop()
+            for line in lines:
+                if line.strip():
+                    last = time.time()
+                    yield read_message(line)
+            if len(lines)==0:
+                time.sleep(poll)
+
+
+def socket_stream(host='localhost',
+                  port=5555):
+    """ the episodes received (as json lines) on a TCP connection, until it is closed """
+    with socket.create_connection((host, port)) as connection:
+        for line in connection.makefile('r'):
+            if line.strip():
+                yield read_message(line)
+
+
+if __name__=='__main__':
+
+    import argparse
+
+    parser=argparse.ArgumentParser(description='online tuning estimates of an episode stream')
+
+    parser.add_argument("source", type=str, help='episode file (json lines) or host:port')
+    parser.add_argument("--angles", type=float, nargs='*',
+                        default=[0, 22.5, 45, 67.5, 90, 112.5, 135, 157.5])
+    parser.add_argument("--contrasts", type=float, nargs='*', default=[0.5, 1.],
+                        help='if the episodes have a contrast parameter')
+    parser.add_argument("--contrast", type=float, default=1., help='of the reported tuning')
+    parser.add_argument("--test", type=str, default='ttest')
+    parser.add_argument("--threshold", type=float, default=0.01)
+    parser.add_argument("--every", type=int, default=8, help='report every N episodes')
+    parser.add_argument("--timeout", type=float, default=60., help='(s) without new episode')
+
+    args = parser.parse_args()
+
+    if os.path.isfile(args.source) or (':' not in args.source):
+        stream = file_stream(args.source, timeout=args.timeout)
+    else:
+        host, port = args.source.split(':')
+        stream = socket_stream(host, int(port))
+
+    online = None
+    for i, episode in enumerate(stream):
+        if online is None:
+            # the conditions: all the combinations of the parameters of the episodes
+            VALUES = {'angle':args.angles, 'contrast':args.contrasts}
+            unknown = [k for k in episode['parameters'] if k not in VALUES]
+            if len(unknown)>0:
+                raise ValueError('no values for the episode parameters: %s' % ', '.join(unknown))
+            online = OnlineTuning(len(episode['pre']),
+                                  condition_grid({k:VALUES[k] for k in episode['parameters']}),
+                                  test=args.test)
+        online.update(episode['pre'], episode['post'], episode['parameters'])
+        if (i+1)%args.every==0:
+            tuning = online.tuning(threshold=args.threshold, contrast=args.contrast)
+            print('[%i episodes] %i/%i responsive ROIs, mean SI (responsive): %.2f' % (\
+                    i+1, tuning['responsive'].sum(), len(tuning['responsive']),
+                    np.mean(tuning['SI'][tuning['responsive']]) if tuning['responsive'].any() else np.nan),
+                  flush=True)
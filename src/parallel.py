@@ -0,0 +1,92 @@
+"""
+ROI-parallel statistics within one session
+
+the episode tensor is copied once into a `multiprocessing.shared_memory`
+block, the workers attach to it and process blocks of ROIs, only the small
+(ROIs x conditions) results travel back to the parent process
+
+complements the parallelism across sessions (one process per session):
+use it for the few very large sessions (>2000 ROIs)
+"""
+import os
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+
+from episodes import cumulative_responses, window_mean
+from responsiveness import evoked_stats
+import profiling
+
+# state of the worker processes (see `_attach`)
+_worker = {}
+
+
+def _attach(name, shape, dtype, t, condition, stat_test_props):
+    shm = shared_memory.SharedMemory(name=name)
+    _worker.update(shm=shm, # keeps the mapping alive
+                   responses=np.ndarray(shape, dtype=dtype, buffer=shm.buf),
+                   t=t, condition=condition,
+                   stat_test_props=stat_test_props)
+
+
+def _roi_block_stats(block):
+    i0, i1 = block
+    props = _worker['stat_test_props']
+    C = cumulative_responses(_worker['responses'][:,i0:i1,:])
+    return i0, i1, evoked_stats(window_mean(C, _worker['t'], props['interval_pre']),
+                                window_mean(C, _worker['t'], props['interval_post']),
+                                _worker['condition'],
+                                test=props['test'])
+
+
+def parallel_pvalue_summary(tensor,
+                            stat_test_props=dict(interval_pre=[-1.5,0],
+                                                 interval_post=[1,2.5],
+                                                 test='ttest',
+                                                 positive=True),
+                            Nproc=None,
+                            block_size=None):
+    """
+    same output than `responsiveness.pvalue_summary`,
+    with the ROIs split in blocks over `Nproc` worker processes
+
+    block_size: ROIs per task, default gives ~4 tasks per worker
+    """
+    responses = tensor['responses']
+    Nep, nROIs, Nt = responses.shape
+    Nproc = Nproc or os.cpu_count()
+    block_size = block_size or max([1, int(np.ceil(nROIs/Nproc/4))])
+    blocks = [(i0, min([i0+block_size, nROIs])) for i0 in range(0, nROIs, block_size)]
+
+    Nconds = tensor['condition'].max()+1
+    summary = {'value':np.zeros((nROIs, Nconds)),
+               'std-value':np.zeros((nROIs, Nconds)),
+               'pvalue':np.ones((nROIs, Nconds)),
+               'ntrials':np.bincount(tensor['condition'], minlength=Nconds)}
+
+    with profiling.stage('stat_tests'):
+
+        shm = shared_memory.SharedMemory(create=True, size=max([1, responses.nbytes]))
+        try:
+            shared = np.ndarray(responses.shape, dtype=responses.dtype, buffer=shm.buf)
+            shared[:] = responses
+
+            # 'spawn': forking a process with threads holding locks (e.g. the HDF5
+            # reads of `prefetch.prefetch_sessions`) can deadlock the workers
+            with mp.get_context('spawn').Pool(Nproc, initializer=_attach,
+                                              initargs=(shm.name, responses.shape, responses.dtype,
+                                                        tensor['t'], tensor['condition'],
+                                                        dict(stat_test_props))) as pool:
+                for i0, i1, block in pool.imap_unordered(_roi_block_stats, blocks):
+                    for key in ['value', 'std-value', 'pvalue']:
+                        summary[key][i0:i1] = block[key]
+            del shared
+        finally:
+            shm.close()
+            shm.unlink()
+
+    summary['conditions'] = tensor['conditions']
+    summary['angles'] = tensor['varied_parameters']['angle']
+    summary['stat_test_props'] = dict(stat_test_props)
+
+    return summary
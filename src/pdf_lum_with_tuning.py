@@ -1,4 +1,4 @@
-import os, tempfile, subprocess, sys, pathlib
+import os, tempfile, subprocess, sys, pathlib, traceback
 import numpy as np
 from scipy.stats import skew
 from PIL import Image
@@ -16,6 +16,9 @@ from physion.dataviz.episodes.trial_average import plot_trial_average
 from physion.analysis.process_NWB import EpisodeData
 from physion.utils.plot_tools import pie
 
+import profiling
+from imaging import format_imaging_arrays
+
 tempfile.gettempdir()
 
 
@@ -29,48 +32,50 @@ def generate_pdf(args,
 
     rois = generate_figs(args)
 
-    width, height = int(8.27 * 300), int(11.7 * 300) # A4 at 300dpi : (2481, 3510)
+    with profiling.stage('pdf'):
+
+        width, height = int(8.27 * 300), int(11.7 * 300) # A4 at 300dpi : (2481, 3510)
 
-    ### Page 1 - Raw Data
+        ### Page 1 - Raw Data
 
-    # let's create the A4 page
-    page = Image.new('RGB', (width, height), 'white')
+        # let's create the A4 page
+        page = Image.new('RGB', (width, height), 'white')
 
-    KEYS = ['metadata',
-            'raw-full', 'lum-resp', 'raw-0',
-            'FOV']
+        KEYS = ['metadata',
+                'raw-full', 'lum-resp', 'raw-0',
+                'FOV']
 
-    LOCS = [(200, 130),
-            (150, 650), (150, 1600), (150, 2400),
-            (900, 130)]
+        LOCS = [(200, 130),
+                (150, 650), (150, 1600), (150, 2400),
+                (900, 130)]
 
-    for key, loc in zip(KEYS, LOCS):
+        for key, loc in zip(KEYS, LOCS):
         
-        fig = Image.open(os.path.join(tempfile.tempdir, '%s-%i.png' % (key, args.unique_run_ID)))
-        page.paste(fig, box=loc)
-        fig.close()
+            fig = Image.open(os.path.join(tempfile.tempdir, '%s-%i.png' % (key, args.unique_run_ID)))
+            page.paste(fig, box=loc)
+            fig.close()
 
-    page.save(PAGES[0])
+        page.save(PAGES[0])
 
-    ### Page 2 - Analysis
+        ### Page 2 - Analysis
 
-    page = Image.new('RGB', (width, height), 'white')
+        page = Image.new('RGB', (width, height), 'white')
 
-    KEYS = ['tuning-summary', 'tuning-examples']
+        KEYS = ['tuning-summary', 'tuning-examples']
 
-    LOCS = [(300, 150), (200, 700)]
+        LOCS = [(300, 150), (200, 700)]
 
-    for key, loc in zip(KEYS, LOCS):
+        for key, loc in zip(KEYS, LOCS):
         
-        if os.path.isfile(os.path.join(tempfile.tempdir, '%s-%i.png' % (key, args.unique_run_ID))):
+            if os.path.isfile(os.path.join(tempfile.tempdir, '%s-%i.png' % (key, args.unique_run_ID))):
 
-            fig = Image.open(os.path.join(tempfile.tempdir, '%s-%i.png' % (key, args.unique_run_ID)))
-            page.paste(fig, box=loc)
-            fig.close()
+                fig = Image.open(os.path.join(tempfile.tempdir, '%s-%i.png' % (key, args.unique_run_ID)))
+                page.paste(fig, box=loc)
+                fig.close()
 
-    page.save(PAGES[1])
+        page.save(PAGES[1])
 
-    join_pdf(PAGES, pdf_file)
+        join_pdf(PAGES, pdf_file)
 
 
 def generate_lum_response_fig(results, data, args):
@@ -118,9 +123,10 @@ def annotate_luminosity_and_get_summary(data, args, ax=None):
             ax.annotate(lum, (.5*(tstart+tstop), 0), va='top', ha='center')
             ax.fill_between([tstart, tstop], np.zeros(2), np.ones(2), lw=0, 
                             alpha=.2, color='k')
-        for roi in range(data.vNrois):
-            for key, func in zip(['mean', 'std', 'skewness'], [np.mean, np.std, skew]):
-                summary[lum][key].append(func(data.dFoF[roi,t_cond]))
+        # all ROIs at once on the (ROIs x time) slice
+        dFoF = data.dFoF[:,t_cond]
+        for key, func in zip(['mean', 'std', 'skewness'], [np.mean, np.std, skew]):
+            summary[lum][key] += list(func(dFoF, axis=1))
                 
     return summary
 
@@ -242,53 +248,63 @@ def generate_figs(args,
 
     pdf_folder = summary_pdf_folder(args.datafile)
 
-    data = Data(args.datafile)
-    if args.imaging_quantity=='dFoF':
-        data.build_dFoF()
-    else:
-        data.build_rawFluo()
+    with profiling.stage('read'):
+        data = Data(args.datafile)
 
-    # ## --- METADATA  ---
-    fig = metadata_fig(data, short=True)
-    fig.savefig(os.path.join(tempfile.tempdir, 'metadata-%i.png' % args.unique_run_ID), dpi=300)
+    with profiling.stage('build_dFoF'):
+        if args.imaging_quantity=='dFoF':
+            data.build_dFoF()
+        else:
+            data.build_rawFluo()
+        format_imaging_arrays(data, dtype=args.dtype)
 
-    # ##  --- FOVs ---
-    fig = generate_FOV_fig(data, args)
-    fig.savefig(os.path.join(tempfile.tempdir, 'FOV-%i.png' % args.unique_run_ID), dpi=300)
+    with profiling.stage('plot_metadata_and_FOV'):
 
-    # ## --- FULL RECORDING VIEW --- 
-    args.raw_figsize=(7, 3.2)
-    if 'BlankLast' in data.metadata['protocol']:
-        tlims = (50, 150)
-    else:
-        tlims = (1200, 1300)
-       
-    figs, axs = generate_raw_data_figs(data, args,
-                                      TLIMS = [tlims],
-                                      return_figs=True)
-    figs[0].subplots_adjust(bottom=0.05, top=0.9, left=0.05, right=0.9)
+        # ## --- METADATA  ---
+        fig = metadata_fig(data, short=True)
+        fig.savefig(os.path.join(tempfile.tempdir, 'metadata-%i.png' % args.unique_run_ID), dpi=300)
+
+        # ##  --- FOVs ---
+        fig = generate_FOV_fig(data, args)
+        fig.savefig(os.path.join(tempfile.tempdir, 'FOV-%i.png' % args.unique_run_ID), dpi=300)
+
+    with profiling.stage('plot_raw'):
 
-    results = annotate_luminosity_and_get_summary(data, args, ax=axs[0])
-    figs[0].savefig(os.path.join(tempfile.tempdir,
-                    'raw-full-%i.png' % args.unique_run_ID), dpi=300)
+        # ## --- FULL RECORDING VIEW --- 
+        args.raw_figsize=(7, 3.2)
+        if 'BlankLast' in data.metadata['protocol']:
+            tlims = (50, 150)
+        else:
+            tlims = (1200, 1300)
+           
+        figs, axs = generate_raw_data_figs(data, args,
+                                          TLIMS = [tlims],
+                                          return_figs=True)
+        figs[0].subplots_adjust(bottom=0.05, top=0.9, left=0.05, right=0.9)
+
+        results = annotate_luminosity_and_get_summary(data, args, ax=axs[0])
+        figs[0].savefig(os.path.join(tempfile.tempdir,
+                        'raw-full-%i.png' % args.unique_run_ID), dpi=300)
 
-    fig = generate_lum_response_fig(results, data, args)
-    fig.savefig(os.path.join(tempfile.tempdir,
-        'lum-resp-%i.png' % args.unique_run_ID), dpi=300)
+        fig = generate_lum_response_fig(results, data, args)
+        fig.savefig(os.path.join(tempfile.tempdir,
+            'lum-resp-%i.png' % args.unique_run_ID), dpi=300)
 
 
     # ## --- EPISODES AVERAGE -- 
 
-    fig = cell_tuning_example_fig(data)
-    fig.savefig(os.path.join(tempfile.tempdir,
-        'tuning-examples-%i.png' % args.unique_run_ID), dpi=300)
+    with profiling.stage('plot_tuning_examples'):
+        fig = cell_tuning_example_fig(data)
+        fig.savefig(os.path.join(tempfile.tempdir,
+            'tuning-examples-%i.png' % args.unique_run_ID), dpi=300)
 
     RESPONSES, _, shifted_angle = compute_tuning_response_per_cells(data,
                                                                     stat_test_props=stat_test_props)
 
-    fig, AX = plot_tunning_summary(data, shifted_angle, RESPONSES)
-    fig.savefig(os.path.join(tempfile.tempdir,
-        'tuning-summary-%i.png' % args.unique_run_ID), dpi=300)
+    with profiling.stage('plot_tuning_summary'):
+        fig, AX = plot_tunning_summary(data, shifted_angle, RESPONSES)
+        fig.savefig(os.path.join(tempfile.tempdir,
+            'tuning-summary-%i.png' % args.unique_run_ID), dpi=300)
 
 
 if __name__=='__main__':
@@ -302,25 +318,59 @@ if __name__=='__main__':
     parser.add_argument("--iprotocol", type=int, default=0,
         help='index for the protocol in case of multiprotocol in datafile')
     parser.add_argument("--imaging_quantity", default='dFoF')
+    parser.add_argument("--dtype", default='float64', choices=['float32', 'float64'],
+        help='storage of the imaging arrays')
     parser.add_argument("--nROIs", type=int, default=5)
     parser.add_argument("--show_all_ROIs", action='store_true')
     parser.add_argument("-s", "--seed", type=int, default=1)
     parser.add_argument('-nmax', "--Nmax", type=int, default=1000000)
     parser.add_argument("-d", "--debug", action="store_true")
     parser.add_argument("-v", "--verbose", action="store_true")
+    parser.add_argument("--profile", type=str, default='',
+        help='json-lines file where the time and memory of each stage are logged')
 
     args = parser.parse_args()
 
+    if args.profile!='':
+        profiling.enable(args.profile)
+
     args.unique_run_ID = np.random.randint(10000)
     print('unique run ID', args.unique_run_ID)
 
     if '.nwb' in args.datafile:
-        if args.debug:
-            generate_figs(args)
-            pt.plt.show()
-        else:
-            generate_pdf(args)
+        with profiling.session(args.datafile):
+            if args.debug:
+                generate_figs(args)
+                pt.plt.show()
+            else:
+                generate_pdf(args)
+        if profiling.enabled():
+            profiling.summarize()
+
+    elif os.path.isdir(args.datafile):
+        # batch mode: one pdf per NWB file of the folder, with the progress and ETA
+        from progress import track, session_size, session_cost
+        FILES = sorted(str(f) for f in pathlib.Path(args.datafile).glob('**/*.nwb'))
+        SIZES = [session_size(f) for f in FILES]
+        FAILED = []
+        for f, size in track(list(zip(FILES, SIZES)),
+                             costs=[session_cost(size) for size in SIZES],
+                             nrois=lambda item: item[1]['nROIs'] if np.isfinite(item[1]['nROIs']) else 0):
+            args.datafile = f
+            args.unique_run_ID = np.random.randint(10000)
+            print('generating the pdf of "%s" [...]' % f)
+            try:
+                with profiling.session(f):
+                    generate_pdf(args)
+            except Exception:
+                # a failing session is reported, the batch goes on (as in `sweep`)
+                FAILED.append(f)
+                print(traceback.format_exc())
+        if len(FAILED)>0:
+            print('/!\\ %i/%i pdf(s) failed:\n    %s' % (len(FAILED), len(FILES), '\n    '.join(FAILED)))
+        if profiling.enabled():
+            profiling.summarize()
 
     else:
-        print('/!\ Need to provide a NWB datafile as argument ')
+        print('/!\ Need to provide a NWB datafile (or a folder of NWB files) as argument ')
 
@@ -0,0 +1,101 @@
+"""
+asynchronous prefetch of the sessions of a dataset loop
+
+    for f, data in prefetch_sessions(SUMMARY[key]['FILES'], load=read_session):
+        [...] # analysis of session N while session N+1 is read
+
+the next sessions are loaded in a background thread (the HDF5 reads and most
+numpy operations release the GIL), a semaphore caps the memory to `depth`
+prefetched sessions on top of the one being analyzed: the slot of a session
+is only released when the loop requests the next one (i.e. once it is done
+with it), a load waits for a free slot
+"""
+import threading, queue
+
+import profiling
+
+
+def build_quantity(data,
+                   quantity='dFoF',
+                   verbose=False,
+                   **build_args):
+    """
+    `data.build_<quantity>(**build_args)`
+    ('deconvolved': `build_dFoF(**build_args)` then `deconvolution.build_deconvolved`)
+    """
+    with profiling.stage('build_%s' % quantity):
+        if quantity=='deconvolved':
+            from deconvolution import build_deconvolved
+            data.build_dFoF(verbose=verbose, **build_args)
+            build_deconvolved(data, verbose=verbose)
+        else:
+            getattr(data, 'build_%s' % quantity)(verbose=verbose, **build_args)
+
+
+def read_session(f,
+                 quantity='dFoF',
+                 verbose=False,
+                 **build_args):
+    """
+    default loader: `Data(f)` and its `build_<quantity>(**build_args)`
+    """
+    import analysis # adds physion to the path
+    from physion.analysis.read_NWB import Data
+
+    with profiling.session(f):
+        with profiling.stage('read'):
+            data = Data(f, verbose=False)
+        build_quantity(data, quantity=quantity, verbose=verbose, **build_args)
+
+    return data
+
+
+def prefetch_sessions(FILES,
+                      load=read_session,
+                      depth=1,
+                      **load_args):
+    """
+    yields (f, load(f, **load_args)) for all files in FILES,
+    with the next `depth` sessions loaded in a background thread
+
+    an error while loading a session is raised in the loop, at that session
+    """
+    Queue = queue.Queue()
+    # one slot per session in memory: the analyzed one and the `depth` next ones
+    slots = threading.Semaphore(max([1, depth])+1)
+    stop = threading.Event()
+
+    def worker():
+        for f in FILES:
+            # waits for a free slot before loading, unless the loop was left
+            while not (stop.is_set() or slots.acquire(timeout=0.1)):
+                pass
+            if stop.is_set():
+                return
+            try:
+                item = (f, load(f, **load_args), None)
+            except Exception as error:
+                item = (f, None, error)
+            Queue.put(item)
+            if item[2] is not None:
+                return
+        Queue.put(None)
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item = Queue.get()
+            if item is None:
+                break
+            f, data, error = item
+            if error is not None:
+                raise error
+            yield f, data
+            # the next session is requested: the loop is done with this one
+            del item, data
+            slots.release()
+    finally:
+        # loop left early (break or exception): the worker stops after its current load
+        stop.set()
@@ -0,0 +1,190 @@
+"""
+opt-in timing and memory instrumentation of the analysis stages
+
+    import profiling
+    profiling.enable('profile.jsonl')
+    for f in FILES:
+        with profiling.session(f):
+            with profiling.stage('read'):
+                data = Data(f)
+            [...]
+    profiling.summarize()
+
+each stage appends a json line to the log:
+    {'run', 'session', 'stage', 'wall_time', 'cpu_time', 'peak_rss', 'bytes_read', 'overlapped'}
+when profiling is not enabled, the stages do nothing
+
+cpu_time is the cpu time of the thread running the stage, peak_rss and
+bytes_read are process-wide: when stages run at the same time in several
+threads (see `prefetch`), they are flagged 'overlapped' and their memory
+and reads include those of the other stages
+
+the log accumulates the runs (the cost model of `progress` uses them all),
+each `enable` starts a new run id and `summarize` reports the current run only
+"""
+import os, time, json, uuid, threading, contextlib
+
+_state = {'logfile':None, 'run':None}
+# the session is per thread, so that a session prefetched
+# in a background thread (see `prefetch`) is tagged with its own name
+_local = threading.local()
+# the stages running (in any thread), to flag the overlapping ones
+_active, _lock = {}, threading.Lock()
+
+
+def new_run_id():
+    return '%s-%s' % (time.strftime('%Y%m%d-%H%M%S'), uuid.uuid4().hex[:8])
+
+
+def enable(logfile='profile.jsonl',
+           run=None):
+    """ run: id of the records (a new one if None), shared e.g. by the worker processes of a sweep """
+    _state['logfile'], _state['run'] = logfile, (run or new_run_id())
+    return _state['run']
+
+
+def disable():
+    _state['logfile'], _state['run'] = None, None
+
+
+def current_run():
+    return _state['run']
+
+
+def enabled():
+    return _state['logfile'] is not None
+
+
+def current_rss():
+    """ resident memory of the process (in bytes) """
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')
+
+
+def bytes_read():
+    """ bytes read by the process through read syscalls (page cache included) """
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('rchar'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+class PeakMemory:
+    """
+    samples the resident memory in a background thread
+    to get the peak over a block of code:
+
+        with PeakMemory() as mem:
+            ...
+        mem.peak
+    """
+    def __init__(self, dt=0.005):
+        self.dt, self.peak = dt, 0
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max([self.peak, current_rss()])
+            self._stop.wait(self.dt)
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max([self.peak, current_rss()])
+
+
+@contextlib.contextmanager
+def session(name):
+    """ tags the stages run inside the block with the session name """
+    previous, _local.session = getattr(_local, 'session', None), name
+    try:
+        yield
+    finally:
+        _local.session = previous
+
+
+@contextlib.contextmanager
+def stage(name):
+    """ records wall time, cpu time, peak memory and bytes read of the block """
+    if not enabled():
+        yield
+        return
+
+    key = object()
+    with _lock:
+        for other in _active:
+            _active[other] = True
+        _active[key] = len(_active)>0
+
+    read0 = bytes_read()
+    with PeakMemory() as mem:
+        wall0, cpu0 = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            wall_time, cpu_time = time.perf_counter()-wall0, time.thread_time()-cpu0
+            with _lock:
+                overlapped = _active.pop(key)
+
+    record = dict(run=_state['run'], session=getattr(_local, 'session', None), stage=name,
+                  wall_time=wall_time, cpu_time=cpu_time,
+                  peak_rss=mem.peak, bytes_read=bytes_read()-read0, overlapped=overlapped)
+
+    with open(_state['logfile'], 'a') as f:
+        f.write(json.dumps(record)+'\n')
+
+
+def read_log(logfile=None,
+             run=None):
+    """ the records of the log, of a single run if `run` is given """
+    with open(logfile or _state['logfile']) as f:
+        RECORDS = [json.loads(line) for line in f if line.strip()]
+    if run is not None:
+        RECORDS = [record for record in RECORDS if record.get('run')==run]
+    return RECORDS
+
+
+def summarize(logfile=None, N=5,
+              run='current',
+              verbose=True):
+    """
+    totals per stage and per session, sorted from the slowest
+
+    run: 'current' (the run started by `enable`), a run id, or None for all the runs of the log
+    """
+    RECORDS = read_log(logfile, run=current_run() if run=='current' else run)
+
+    summary = {'stages':{}, 'sessions':{}}
+    for record in RECORDS:
+        for key, name in zip(['stages', 'sessions'], [record['stage'], str(record['session'])]):
+            if name not in summary[key]:
+                summary[key][name] = dict(wall_time=0., cpu_time=0., bytes_read=0, peak_rss=0, n=0)
+            for k in ['wall_time', 'cpu_time', 'bytes_read']:
+                summary[key][name][k] += record[k]
+            summary[key][name]['peak_rss'] = max([summary[key][name]['peak_rss'], record['peak_rss']])
+            summary[key][name]['n'] += 1
+
+    if verbose:
+        overlapped = sum(record.get('overlapped', False) for record in RECORDS)
+        if overlapped>0:
+            print(' (%i/%i stages overlapped with other threads: their memory and reads are process-wide)' % (\
+                    overlapped, len(RECORDS)))
+        for key in ['stages', 'sessions']:
+            print(' --- slowest %s --- ' % key)
+            for name in sorted(summary[key], key=lambda n: -summary[key][n]['wall_time'])[:N]:
+                s = summary[key][name]
+                print('  %s: %.1fs (cpu %.1fs), peak memory %.0fMB, read %.0fMB [n=%i]' % (\
+                        name, s['wall_time'], s['cpu_time'], s['peak_rss']/1024**2,
+                        s['bytes_read']/1024**2, s['n']))
+
+    return summary
@@ -0,0 +1,236 @@
+"""
+progress of the dataset loops and run-time predictions
+
+    for f, data in track(prefetch_sessions(FILES), total=len(FILES),
+                         nrois=lambda item: session_nrois(item[1])):
+        [...]
+
+prints after each session:
+    [3/20 sessions, 15%] 1250 ROIs/s, elapsed 1m20s, ETA 7m32s
+
+the ETA scales the elapsed time by the remaining fraction of the work,
+in number of sessions or, if `costs` are given, in predicted cost per session
+
+cost model: the stage timings of the profiling logs (see `profiling`) are
+fitted as a + b x (ROIs x frames) per stage, the runtime of a sweep
+(see `sweep`) is then predicted from the sizes of its files before launch:
+
+    python src/progress.py grid.json --log profile.jsonl --Nproc 8
+"""
+import os, sys, time, json, pathlib
+import numpy as np
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parent))
+import profiling
+
+
+def format_duration(seconds):
+    if not np.isfinite(seconds):
+        return '?'
+    h, m, s = int(seconds//3600), int(seconds%3600//60), int(seconds%60)
+    return ('%ih%02im' % (h, m)) if h>0 else (('%im%02is' % (m, s)) if m>0 else '%is' % s)
+
+
+class Progress:
+    """
+    counts the completed items (and ROIs), reports the rate and the ETA
+
+    costs: predicted cost of each item (in the order of completion), e.g. from `session_cost`
+    """
+    def __init__(self, total,
+                 costs=None,
+                 label='sessions',
+                 stream=None,
+                 min_interval=0.):
+        self.total, self.label = total, label
+        self.costs = None if costs is None else np.asarray(costs, dtype=float)
+        self.stream = stream or sys.stdout
+        self.min_interval = min_interval
+        self.done, self.nROIs = 0, 0
+        self.tstart = time.perf_counter()
+        self.last_report = -np.inf
+
+    def elapsed(self):
+        return time.perf_counter()-self.tstart
+
+    def fraction(self):
+        """ fraction of the work done (in cost if available) """
+        if self.total==0:
+            return 1.
+        if (self.costs is not None) and (self.costs.sum()>0):
+            return self.costs[:self.done].sum()/self.costs.sum()
+        return self.done/self.total
+
+    def eta(self):
+        f = self.fraction()
+        return self.elapsed()*(1-f)/f if f>0 else np.inf
+
+    def report(self):
+        elapsed = self.elapsed()
+        line = '[%i/%i %s, %.0f%%] ' % (self.done, self.total, self.label, 100*self.fraction())
+        if self.nROIs>0:
+            line += '%.0f ROIs/s, ' % (self.nROIs/elapsed)
+        return line+'elapsed %s, ETA %s' % (format_duration(elapsed), format_duration(self.eta()))
+
+    def step(self, nROIs=0):
+        """ one item completed """
+        self.done += 1
+        self.nROIs += nROIs
+        if (time.perf_counter()-self.last_report>=self.min_interval) or (self.done==self.total):
+            print('   '+self.report(), file=self.stream, flush=True)
+            self.last_report = time.perf_counter()
+
+
+def session_nrois(data):
+    """ number of ROIs of a loaded session: the valid ones once the dFoF is built, all the cells otherwise """
+    for key in ['vNrois', 'nROIs']:
+        if hasattr(data, key):
+            return int(getattr(data, key))
+    return 0
+
+
+def track(iterable,
+          total=None,
+          costs=None,
+          nrois=None,
+          label='sessions',
+          min_interval=0.):
+    """
+    yields the items of `iterable`, an item counts as completed
+    when the next one is requested (i.e. once the loop body is done)
+
+    nrois: function giving the number of ROIs of an item (for the ROIs/s rate)
+    """
+    progress = Progress(len(iterable) if total is None else total,
+                        costs=costs, label=label, min_interval=min_interval)
+    for item in iterable:
+        yield item
+        progress.step(nROIs=nrois(item) if nrois is not None else 0)
+
+
+# --------------------------------------------------------------- #
+#                          cost model                             #
+# --------------------------------------------------------------- #
+
+ROI_RESPONSE_PATH = 'processing/ophys/Fluorescence/Fluorescence/data'
+TIMESTAMPS_PATH = 'processing/ophys/Fluorescence/Fluorescence/timestamps'
+
+def session_size(f):
+    """
+    {'nROIs', 'nframes', 'bytes'} of an NWB file, from the shape of its
+    fluorescence dataset (nan if not found), without loading it
+    """
+    size = {'nROIs':np.nan, 'nframes':np.nan,
+            'bytes':os.path.getsize(f) if os.path.isfile(f) else np.nan}
+    try:
+        import h5py
+        with h5py.File(f, 'r') as io:
+            shape = io[ROI_RESPONSE_PATH].shape
+            Nt = len(io[TIMESTAMPS_PATH]) if TIMESTAMPS_PATH in io else None
+        # stored either ROI-major or time-major (as in `dfof.read_block`):
+        # the time axis is the one of the timestamps (the longest one without them)
+        itime = (1 if shape[1]==Nt else 0) if Nt is not None else int(np.argmax(shape))
+        size['nROIs'], size['nframes'] = shape[1-itime], shape[itime]
+    except (OSError, KeyError, ImportError):
+        pass
+    return size
+
+
+def session_cost(size):
+    """ cost variable of the model: ROIs x frames (or the file size if unknown) """
+    cost = size['nROIs']*size['nframes']
+    return cost if np.isfinite(cost) else size['bytes']
+
+
+def fit_cost_model(logfile):
+    """
+    per stage of the profiling log: wall_time = a + b x session cost
+
+    returns {stage: (a, b)}, the sessions whose files are missing are ignored
+    """
+    costs, DATA = {}, {}
+    for record in profiling.read_log(logfile):
+        f = record['session']
+        if f not in costs:
+            costs[f] = session_cost(session_size(f)) if (f is not None and os.path.isfile(str(f)))\
+                            else None
+        if costs[f] is not None:
+            DATA.setdefault(record['stage'], []).append((costs[f], record['wall_time']))
+
+    MODEL = {}
+    for stage, points in DATA.items():
+        x, y = np.array(points).T
+        if np.ptp(x)>0:
+            b, a = np.polyfit(x, y, 1)
+            a, b = max([a, 0.]), max([b, 0.])
+        else:
+            # a single session size: proportional model (constant for empty files)
+            a, b = (0., np.mean(y)/x[0]) if x[0]>0 else (np.mean(y), 0.)
+        MODEL[stage] = (float(a), float(b))
+    return MODEL
+
+
+def predict(model, stage, cost):
+    a, b = model.get(stage, (np.nan, np.nan))
+    return a+b*cost
+
+
+def predict_sweep(config,
+                  model,
+                  FILES=None,
+                  Nproc=1):
+    """
+    predicted runtime of `sweep.run_sweep(config)` from the cost model
+
+    returns {'per_file': [s, ...], 'total' (cpu time, s), 'wall' (s, with Nproc processes),
+             'missing': stages without timings (counted as 0)}
+    """
+    import sweep
+
+    POINTS = sweep.expand_grid(config)
+    FILES = sweep.list_files(config) if FILES is None else FILES
+
+    builds = sorted(set(sweep.stage_keys(p)[0] for p in POINTS))
+    counts = sweep.stage_counts(POINTS)
+    STAGES = [('read', 1)]+[('build_%s' % quantity, 1) for quantity, _ in builds]+\
+                [('EpisodeData', counts['tensor']), ('stat_tests', counts['stats'])]
+
+    missing = sorted(set(stage for stage, _ in STAGES if stage not in model))
+    per_file = []
+    for f in FILES:
+        cost = session_cost(session_size(f))
+        per_file.append(np.nansum([n*predict(model, stage, cost) for stage, n in STAGES]))
+
+    # longest sessions first, each on the least loaded process
+    loads = np.zeros(max([1, Nproc]))
+    for duration in sorted(per_file, reverse=True):
+        loads[np.argmin(loads)] += duration
+
+    return {'per_file':per_file, 'total':float(np.sum(per_file)),
+            'wall':float(loads.max()), 'missing':missing}
+
+
+if __name__=='__main__':
+
+    import argparse
+
+    parser=argparse.ArgumentParser(description='runtime prediction of a sweep')
+
+    parser.add_argument("grid", type=str, help='json grid file (see sweep.py)')
+    parser.add_argument("--log", type=str, default='profile.jsonl',
+                        help='profiling log of earlier runs (see profiling.py)')
+    parser.add_argument("--Nproc", type=int, default=1)
+
+    args = parser.parse_args()
+
+    with open(args.grid) as f:
+        config = json.load(f)
+
+    model = fit_cost_model(args.log)
+    prediction = predict_sweep(config, model, Nproc=args.Nproc)
+
+    print('%i sessions, cpu time: %s, wall time with %i processes: %s' % (\
+            len(prediction['per_file']), format_duration(prediction['total']),
+            args.Nproc, format_duration(prediction['wall'])))
+    if len(prediction['missing'])>0:
+        print('/!\\ no timings for the stages: %s' % ', '.join(prediction['missing']))
@@ -0,0 +1,272 @@
+"""
+quick look: the dataset analysis on a stratified random subset
+
+    QL = quick_look(SUMMARY, session_fraction=0.3, roi_fraction=0.25)
+    QL['WT']['mean_curve'], QL['WT']['curve_ci'], QL['WT']['frac_resp_ci']
+
+instead of the first `Nmax` files, a subset of:
+    - sessions: drawn across the subjects of each genotype (one session per subject first)
+    - ROIs: uniformly within each session, only their traces are read and
+      their dFoF built (see `read_roi_subset`, the other quantities are
+      built on all ROIs and subsampled afterwards)
+    - episodes: the same fraction of the repeats of every condition
+
+the error bars come from a hierarchical bootstrap (sessions, then ROIs within
+sessions), their width estimates how far the full run can be from the quick look
+"""
+import zlib
+import numpy as np
+
+from episodes import build_episode_tensor
+from responsiveness import pvalue_summary, responsive_at
+from prefetch import prefetch_sessions
+import profiling
+
+# quantities built for a subset of ROIs (see `build_roi_subset`)
+SUBSET_QUANTITIES = ['dFoF', 'rawFluo', 'neuropil']
+
+
+def sample_sessions(FILES,
+                    subjects=None,
+                    fraction=0.3,
+                    Nmin=1,
+                    seed=0):
+    """
+    max(Nmin, fraction x N) files, spread over the subjects:
+    one random session per subject (in random subject order), then a second one, ...
+    """
+    rng = np.random.default_rng(seed)
+    N = len(FILES)
+    n = min([N, max([Nmin, int(np.round(fraction*N))])])
+    subjects = np.arange(N) if subjects is None else np.asarray(subjects)
+
+    # rank of each session within its (shuffled) subject, subjects in random order
+    order = rng.permutation(N)
+    subject_rank = {s:r for r, s in enumerate(rng.permutation(np.unique(subjects)))}
+    rank_within = np.zeros(N, dtype=int)
+    seen = {}
+    for i in order:
+        rank_within[i] = seen.get(subjects[i], 0)
+        seen[subjects[i]] = rank_within[i]+1
+
+    keys = [(rank_within[i], subject_rank[subjects[i]]) for i in range(N)]
+    chosen = sorted(range(N), key=lambda i: keys[i])[:n]
+    return [FILES[i] for i in sorted(chosen)]
+
+
+def build_roi_subset(data, rois,
+                     quantity='dFoF',
+                     roi_to_neuropil_fluo_inclusion_factor=1.15,
+                     **build_args):
+    """
+    the quantity of the cells `rois` (indices among the cells) only
+
+    - 'dFoF': `dfof.build_dFoF_streaming` restricted to the ROIs, i.e. the
+        F0, inclusion criterion and valid_roiIndices of the full streaming run,
+        validated against physion's `data.build_dFoF` by `dfof.check_against_build_dFoF`
+    - 'rawFluo', 'neuropil': `imaging.load_roi_window`, without inclusion criterion
+        (as `data.build_rawFluo` and `data.build_neuropil`)
+    """
+    if quantity=='dFoF':
+        from dfof import build_dFoF_streaming
+        build_dFoF_streaming(data, roiIndices=rois,
+                             roi_to_neuropil_fluo_inclusion_factor=roi_to_neuropil_fluo_inclusion_factor,
+                             verbose=False, **build_args)
+    elif quantity in SUBSET_QUANTITIES:
+        from imaging import load_roi_window
+        load_roi_window(data, roiIndices=rois, **build_args)
+    else:
+        raise ValueError('no subset version of the quantity "%s"' % quantity)
+    return data
+
+
+def read_roi_subset(f,
+                    roi_fraction=0.25,
+                    quantity='dFoF',
+                    seed=0,
+                    verbose=False,
+                    **build_args):
+    """
+    loader (see `prefetch.read_session`) reading the traces of a random fraction
+    of the cells only, over the full recording (see `build_roi_subset`)
+
+    the ROIs are drawn before the inclusion criterion, data.valid_roiIndices
+    are the kept ones
+    """
+    import analysis # adds physion to the path
+    from physion.analysis.read_NWB import Data
+    from dfof import roi_response_series
+
+    with profiling.session(f):
+        with profiling.stage('read'):
+            data = Data(f, verbose=False)
+        Ncells = int(np.sum(data.iscell)) if hasattr(data, 'iscell') else\
+                    min(roi_response_series(data, 'Fluorescence').data.shape)
+        # a different (reproducible) subset per session
+        rng = np.random.default_rng(seed+zlib.crc32(str(f).encode()))
+        rois = np.sort(rng.choice(Ncells, max([1, int(np.round(roi_fraction*Ncells))]), replace=False))
+        with profiling.stage('build_%s_subset' % quantity):
+            build_roi_subset(data, rois, quantity=quantity, **build_args)
+    return data
+
+
+def subsample_tensor(tensor,
+                     roi_fraction=0.25,
+                     episode_fraction=1.,
+                     min_episodes=3,
+                     seed=0):
+    """
+    episode tensor restricted to a random subset of ROIs and to the same
+    fraction of episodes in every condition (at least `min_episodes`)
+
+    the kept ROIs are in tensor['roi_indices']
+    """
+    rng = np.random.default_rng(seed)
+    Nep, Nrois = tensor['responses'].shape[:2]
+
+    rois = np.sort(rng.choice(Nrois, max([1, int(np.round(roi_fraction*Nrois))]), replace=False))
+
+    episodes = []
+    for c in range(tensor['condition'].max()+1):
+        group = np.flatnonzero(tensor['condition']==c)
+        n = min([len(group), max([min_episodes, int(np.round(episode_fraction*len(group)))])])
+        episodes.append(rng.choice(group, n, replace=False))
+    episodes = np.sort(np.concatenate(episodes))
+
+    sub = dict(tensor)
+    sub['responses'] = tensor['responses'][episodes][:,rois]
+    for key in list(tensor['varied_parameters'])+['condition', 'running_speed']:
+        if key in tensor:
+            sub[key] = tensor[key][episodes]
+    sub['roi_indices'] = rois
+    return sub
+
+
+def tuning_analysis(tensor,
+                    stat_test_props=dict(interval_pre=[-1.,0],
+                                         interval_post=[1.,2.],
+                                         test='anova',
+                                         positive=True),
+                    response_significance_threshold=5e-2,
+                    contrast=1):
+    """
+    default quick-look analysis: the orientation tuning of the responsive ROIs
+    (as in `compute_summary_responses` of the Direction-Selectivity notebook)
+
+    returns 'curves' (responsive ROIs x angles), 'responsive' (ROIs,), 'x' (shifted angles)
+    """
+    tuning = responsive_at(pvalue_summary(tensor, stat_test_props=stat_test_props),
+                           threshold=response_significance_threshold, contrast=contrast)
+    return {'curves':tuning['RESPONSES'],
+            'responsive':tuning['responsive'],
+            'x':tuning['shifted_angle']}
+
+
+def hierarchical_bootstrap(values,
+                           Nboot=1000,
+                           alpha=0.05,
+                           batch=100,
+                           seed=0):
+    """
+    bootstrap of the mean over the pooled rows of a list of per-session
+    (rows x ...) arrays: sessions resampled, then rows within each drawn session
+
+    the resamples are count matrices applied to the pooled rows
+
+    returns 'mean', 'std' (bootstrap standard deviation) and 'ci' (2 x ...)
+    """
+    rng = np.random.default_rng(seed)
+    sessions = [np.asarray(v, dtype=float) for v in values if len(v)>0]
+    X = np.concatenate(sessions)
+    offsets = np.concatenate([[0], np.cumsum([len(v) for v in sessions])])
+    S = len(sessions)
+
+    BOOT = []
+    for b0 in range(0, Nboot, batch):
+        B = min([batch, Nboot-b0])
+        # number of times each session is drawn
+        draws = rng.multinomial(S, np.ones(S)/S, size=B)     # (B x sessions)
+        W = np.zeros((B, len(X)))
+        for s in range(S):
+            n = offsets[s+1]-offsets[s]
+            # the rows of the k draws of a session: k*n rows among its n
+            W[:, offsets[s]:offsets[s+1]] = rng.multinomial(draws[:,s]*n, np.ones(n)/n)
+        BOOT.append(np.tensordot(W, X, axes=(1,0))/W.sum(axis=1).reshape((-1,)+(1,)*(X.ndim-1)))
+    BOOT = np.concatenate(BOOT)
+
+    return {'mean':np.mean(X, axis=0),
+            'std':np.std(BOOT, axis=0),
+            'ci':np.percentile(BOOT, [100*alpha/2, 100*(1-alpha/2)], axis=0)}
+
+
+def quick_look(SUMMARY,
+               keys=['WT', 'GluN1', 'GluN3'],
+               analysis=tuning_analysis,
+               protocol_name=['ff-gratings-8orientation-2contrasts-15repeats',
+                              'ff-gratings-8orientation-2contrasts-10repeats'],
+               quantity='dFoF',
+               session_fraction=0.3,
+               roi_fraction=0.25,
+               episode_fraction=1.,
+               Nboot=1000,
+               alpha=0.05,
+               seed=0,
+               verbose=True,
+               **load_args):
+    """
+    runs `analysis(tensor)` (-> 'curves', 'responsive', 'x') on the subset
+    of each genotype of SUMMARY (as built by `init_summary`)
+
+    protocol_name: the first of the list found in the session
+    episode_fraction<1 lowers the power of the tests: the responsive fractions
+    are then biased downwards (not covered by the bootstrap error bars)
+
+    returns {key: {'x', 'mean_curve', 'curve_ci', 'curve_deviation',
+                   'frac_resp', 'frac_resp_ci', 'frac_resp_deviation',
+                   'FILES', 'n_rois'}}
+    with the deviations = bootstrap std (expected deviation from the full run)
+    """
+    protocols = [protocol_name] if isinstance(protocol_name, str) else list(protocol_name)
+    # only the sampled ROIs are read (and their dFoF built)
+    partial = (roi_fraction<1) and (quantity in SUBSET_QUANTITIES)
+    QL = {}
+
+    for k, key in enumerate(keys):
+
+        FILES = sample_sessions(SUMMARY[key]['FILES'], subjects=SUMMARY[key]['subjects'],
+                                fraction=session_fraction, seed=seed+k)
+        CURVES, RESPONSIVE = [], []
+
+        for i, (f, data) in enumerate(prefetch_sessions(FILES, quantity=quantity, **load_args)\
+                                      if not partial else\
+                                      prefetch_sessions(FILES, load=read_roi_subset, quantity=quantity,
+                                                        roi_fraction=roi_fraction, seed=seed, **load_args)):
+            if verbose:
+                print(' - %s, quick look at "%s" [...]' % (key, f))
+            protocol = [p for p in protocols if p in data.protocols][0]
+            tensor = subsample_tensor(build_episode_tensor(data, quantity=quantity,
+                                                           protocol_name=protocol, verbose=False),
+                                      roi_fraction=1. if partial else roi_fraction,
+                                      episode_fraction=episode_fraction,
+                                      seed=seed+i)
+            if partial:
+                tensor['roi_indices'] = np.array(data.valid_roiIndices)
+            output = analysis(tensor)
+            CURVES.append(output['curves'])
+            RESPONSIVE.append(output['responsive'])
+
+        QL[key] = {'FILES':FILES, 'n_rois':[len(r) for r in RESPONSIVE]}
+        if len(RESPONSIVE)==0:
+            continue
+
+        frac = hierarchical_bootstrap(RESPONSIVE, Nboot=Nboot, alpha=alpha, seed=seed)
+        QL[key].update({'frac_resp':frac['mean'], 'frac_resp_ci':frac['ci'],
+                        'frac_resp_deviation':frac['std']})
+
+        if np.sum([len(c) for c in CURVES])>0:
+            curve = hierarchical_bootstrap(CURVES, Nboot=Nboot, alpha=alpha, seed=seed)
+            QL[key].update({'x':output['x'],
+                            'mean_curve':curve['mean'], 'curve_ci':curve['ci'],
+                            'curve_deviation':curve['std']})
+
+    return QL
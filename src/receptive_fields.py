@@ -0,0 +1,163 @@
+"""
+receptive fields from the spatial-mapping protocol
+
+    - response maps: (ROIs x y x x) trial-averaged evoked responses,
+      one averaging matrix applied to the (episodes x ROIs) responses
+    - 2-D gaussian fits of all maps at once: Levenberg-Marquardt steps
+      with batched (ROIs x 6 x 6) normal equations
+
+the fitted centers are stored per session (see `rf_centers`), so that
+the size-tuning analysis can reuse them instead of re-estimating them
+"""
+import os, json, hashlib, tempfile
+import numpy as np
+
+from episodes import cumulative_responses, window_mean
+
+PARAMETERS = ['amplitude', 'x0', 'y0', 'log_sx', 'log_sy', 'offset']
+
+
+def response_maps(tensor,
+                  interval_pre=[-1,0],
+                  interval_post=[1,2],
+                  xkey='x-center',
+                  ykey='y-center'):
+    """
+    (ROIs x Ny x Nx) trial-averaged evoked responses (post-pre)
+    per stimulus position, averaged over the other varied parameters
+
+    returns {'x', 'y', 'maps'}
+    """
+    C = cumulative_responses(tensor['responses'])
+    evoked = window_mean(C, tensor['t'], interval_post)-window_mean(C, tensor['t'], interval_pre)
+
+    x, ix = np.unique(tensor[xkey], return_inverse=True)
+    y, iy = np.unique(tensor[ykey], return_inverse=True)
+    position = iy*len(x)+ix
+
+    counts = np.bincount(position, minlength=len(x)*len(y))
+    A = (position[np.newaxis,:]==np.arange(len(x)*len(y))[:,np.newaxis])/\
+            np.clip(counts, 1, None)[:,np.newaxis]
+    maps = (A @ evoked).T.reshape(evoked.shape[1], len(y), len(x))
+    maps[:, (counts==0).reshape(len(y), len(x))] = np.nan
+
+    return {'x':x, 'y':y, 'maps':maps}
+
+
+def gaussian_2d(params, X, Y):
+    """ (ROIs x pixels) gaussians, params: (ROIs x 6) in the order of PARAMETERS """
+    A, x0, y0, lsx, lsy, c = [params[:,i:i+1] for i in range(6)]
+    return A*np.exp(-(X-x0)**2/2/np.exp(2*lsx)-(Y-y0)**2/2/np.exp(2*lsy))+c
+
+
+def gaussian_jacobian(params, X, Y):
+    """ (ROIs x pixels x 6) derivatives of `gaussian_2d` """
+    A, x0, y0, lsx, lsy, c = [params[:,i:i+1] for i in range(6)]
+    dx2, dy2 = (X-x0)**2/np.exp(2*lsx), (Y-y0)**2/np.exp(2*lsy)
+    G = np.exp(-dx2/2-dy2/2)
+    return np.stack([G,
+                     A*G*(X-x0)/np.exp(2*lsx),
+                     A*G*(Y-y0)/np.exp(2*lsy),
+                     A*G*dx2,
+                     A*G*dy2,
+                     np.ones(G.shape)], axis=-1)
+
+
+def fit_gaussians(maps, x, y,
+                  Niter=50,
+                  damping=1e-2):
+    """
+    2-D gaussian fits of all the (ROIs x Ny x Nx) maps at once
+
+    the initial guess is the peak of each map, the Levenberg-Marquardt
+    damping is adapted per ROI (a step is kept only if it lowers the error)
+
+    returns a dictionary of (ROIs,) arrays: the PARAMETERS,
+    'sx', 'sy', 'residual' (fraction of variance unexplained)
+    """
+    X, Y = np.meshgrid(x, y)
+    X, Y = X.ravel()[np.newaxis,:], Y.ravel()[np.newaxis,:]
+    Z = maps.reshape(len(maps), -1)
+    valid = np.isfinite(Z)
+    Z = np.where(valid, Z, 0)
+
+    step = np.mean([np.mean(np.diff(x)) if len(x)>1 else 1, np.mean(np.diff(y)) if len(y)>1 else 1])
+    ipeak = np.argmax(np.where(valid, Z, -np.inf), axis=1)
+    params = np.array([Z[np.arange(len(Z)), ipeak]-np.median(Z, axis=1),
+                       X[0,ipeak], Y[0,ipeak],
+                       np.full(len(Z), np.log(step)), np.full(len(Z), np.log(step)),
+                       np.median(Z, axis=1)]).T
+
+    def error(p):
+        return np.sum(valid*(Z-gaussian_2d(p, X, Y))**2, axis=1)
+
+    lam = np.full(len(Z), damping)
+    current = error(params)
+    for i in range(Niter):
+        J = gaussian_jacobian(params, X, Y)*valid[:,:,np.newaxis]
+        r = valid*(Z-gaussian_2d(params, X, Y))
+        JtJ = np.einsum('npi,npj->nij', J, J)
+        Jtr = np.einsum('npi,np->ni', J, r)
+        # damped normal equations, for all ROIs at once
+        H = JtJ+lam[:,np.newaxis,np.newaxis]*np.eye(6)*np.diagonal(JtJ, axis1=1, axis2=2)[:,:,np.newaxis]
+        delta = np.linalg.solve(H+1e-12*np.eye(6), Jtr[:,:,np.newaxis])[:,:,0]
+
+        candidate = params+delta
+        new = error(candidate)
+        better = new<current
+        params[better], current[better] = candidate[better], new[better]
+        lam = np.where(better, lam/3, lam*3)
+
+    variance = np.sum(valid*(Z-np.sum(Z, axis=1, keepdims=True)/valid.sum(axis=1, keepdims=True))**2, axis=1)
+
+    output = {key:params[:,i] for i, key in enumerate(PARAMETERS)}
+    output['sx'], output['sy'] = np.exp(output['log_sx']), np.exp(output['log_sy'])
+    output['residual'] = current/np.clip(variance, 1e-12, None)
+    return output
+
+
+def rf_filename(data, params, folder=None):
+    """
+    storage file of the receptive fields of a session for a set of parameters,
+    keyed by the content of the quantity (so that any change of its build arguments is a new entry)
+    """
+    from imaging import array_digest
+    key = json.dumps(dict(params, datafile=os.path.basename(str(getattr(data, 'filename', ''))),
+                          content=array_digest(getattr(data, params['quantity']))), sort_keys=True)
+    return os.path.join(folder or os.path.join(tempfile.gettempdir(), 'receptive-fields'),
+                        'rf-%s.npy' % hashlib.md5(key.encode()).hexdigest())
+
+
+def rf_centers(data,
+               quantity='dFoF',
+               protocol_name='spatial-mapping',
+               interval_pre=[-1,0],
+               interval_post=[1,2],
+               folder=None,
+               recompute=False,
+               verbose=True):
+    """
+    receptive-field fits of all ROIs of a session (the `fit_gaussians`
+    output, with 'x', 'y', 'maps'), computed once and stored in `folder`
+
+    the ROIs are the rows of `data.<quantity>` (the quantity must be built first)
+    """
+    params = dict(quantity=quantity, protocol_name=protocol_name,
+                  interval_pre=list(interval_pre), interval_post=list(interval_post))
+    filename = rf_filename(data, params, folder=folder)
+
+    if os.path.isfile(filename) and not recompute:
+        if verbose:
+            print('   - receptive fields loaded from: %s' % filename)
+        return np.load(filename, allow_pickle=True).item()
+
+    from episodes import build_episode_tensor
+    tensor = build_episode_tensor(data, quantity=quantity,
+                                  protocol_name=protocol_name, verbose=verbose)
+
+    RF = response_maps(tensor, interval_pre=interval_pre, interval_post=interval_post)
+    RF.update(fit_gaussians(RF['maps'], RF['x'], RF['y']))
+
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    np.save(filename, RF)
+    return RF
@@ -0,0 +1,453 @@
+import itertools
+import numpy as np
+from scipy import stats
+
+from analysis import shift_orientation_according_to_pref
+from episodes import cumulative_responses, window_mean
+import profiling
+
+
+def evoked_stats(pre, post, condition,
+                 test='ttest'):
+    """
+    statistical test of the evoked responses for all ROIs and conditions at once
+
+    pre, post: (episodes x ROIs) window means
+    condition: (episodes,) condition index of each episode
+    test: None skips the tests (p=1)
+
+    returns a dictionary of (ROIs x conditions) arrays:
+        'value' : mean of post-pre
+        'std-value' : std of post-pre
+        'pvalue' : (two-sided) p-value of the test
+        'ntrials' : number of episodes per condition
+    """
+    Nconds = condition.max()+1
+    summary = {'value':np.zeros((pre.shape[1], Nconds)),
+               'std-value':np.zeros((pre.shape[1], Nconds)),
+               'pvalue':np.ones((pre.shape[1], Nconds)),
+               'ntrials':np.bincount(condition, minlength=Nconds)}
+
+    for c in range(Nconds):
+
+        x, y = pre[condition==c], post[condition==c]
+
+        summary['value'][:,c] = np.mean(y-x, axis=0)
+        summary['std-value'][:,c] = np.std(y-x, axis=0)
+
+        if test is None:
+            pass # values only
+        elif test=='ttest':
+            summary['pvalue'][:,c] = stats.ttest_rel(x, y, axis=0).pvalue
+        elif test=='wilcoxon':
+            summary['pvalue'][:,c] = stats.wilcoxon(x, y, axis=0).pvalue
+        elif test=='anova':
+            summary['pvalue'][:,c] = stats.f_oneway(x, y, axis=0).pvalue
+        else:
+            raise ValueError('test "%s" not recognized !!' % test)
+
+    # constant responses give nan p-values -> never significant
+    summary['pvalue'][~np.isfinite(summary['pvalue'])] = 1.
+
+    return summary
+
+
+def significant(summary,
+                threshold=0.01,
+                positive=True):
+    """
+    (ROIs x conditions) significance, "positive" restricts to increases
+    """
+    signif = summary['pvalue']<threshold
+    if positive:
+        signif &= (summary['value']>0)
+    return signif
+
+
+def screen_statistic(pre, post, condition,
+                     test='ttest'):
+    """
+    (ROIs x conditions) statistic of the test, from group sums
+    (two-pass, for the accuracy of the variances):
+        'ttest' : |t| of the paired t-test
+        'anova' : F of the one-way anova between pre and post
+    """
+    Nconds = condition.max()+1
+    onehot = (condition[np.newaxis,:]==np.arange(Nconds)[:,np.newaxis]).astype(float)
+    n = onehot.sum(axis=1)
+
+    def group_mean(X):
+        return (onehot @ X).T/n
+
+    def group_ss(X, mean):
+        return (onehot @ (X-mean.T[condition])**2).T
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if test=='ttest':
+            d = post-pre
+            mean = group_mean(d)
+            return np.abs(mean)/np.sqrt(group_ss(d, mean)/(n-1)/n)
+        elif test=='anova':
+            mx, my = group_mean(pre), group_mean(post)
+            within = group_ss(pre, mx)+group_ss(post, my)
+            return n/2*(my-mx)**2/(within/(2*n-2))
+        else:
+            raise ValueError('no screening statistic for test "%s"' % test)
+
+
+def screen(pre, post, condition,
+           test='ttest',
+           threshold=0.01,
+           positive=True,
+           conditions=None,
+           margin=1e-6):
+    """
+    (ROIs,) candidates: ROIs that can be significant in at least one condition
+
+    the other ROIs have, in all conditions, a test statistic below the critical
+    value of `threshold` (minus a relative `margin` for rounding errors),
+    or a negative mean change if `positive`: they are not significant
+    at `threshold` (or below) and the full test can be skipped for them
+    (no statistic for 'wilcoxon': only the sign is screened)
+
+    conditions: boolean mask of the conditions to consider (default: all)
+    """
+    Nconds = condition.max()+1
+    conditions = np.ones(Nconds, dtype=bool) if conditions is None else np.asarray(conditions)
+    n = np.bincount(condition, minlength=Nconds)
+
+    possible = np.ones((pre.shape[1], Nconds), dtype=bool)
+    if positive:
+        onehot = (condition[np.newaxis,:]==np.arange(Nconds)[:,np.newaxis])
+        possible &= ((onehot @ (post-pre)).T>0)
+
+    if test in ['ttest', 'anova']:
+        with np.errstate(invalid='ignore'):
+            critical = stats.t.isf(threshold/2, n-1) if test=='ttest' else\
+                            stats.f.isf(threshold, 1, 2*n-2)
+        possible &= (screen_statistic(pre, post, condition, test=test)>=critical*(1-margin))
+
+    return np.any(possible[:,conditions], axis=1)
+
+
+def shift_index_table(angles, shifted_angle):
+    """
+    table[ipref, k] is the index in `shifted_angle` of angles[k]
+    once re-centered on the preferred angle angles[ipref]
+    """
+    table = np.zeros((len(angles), len(angles)), dtype=int)
+    for ipref, pref in enumerate(angles):
+        for k, angle in enumerate(angles):
+            new_angle = shift_orientation_according_to_pref(angle,
+                                                            pref_angle=pref,
+                                                            start_angle=-22.5,
+                                                            angle_range=180)
+            table[ipref, k] = np.flatnonzero(shifted_angle==new_angle)[0]
+    return table
+
+
+def tuning_summary(summary, conditions, angles,
+                   signif=None,
+                   contrast=1):
+    """
+    same output than `analysis.compute_tuning_response_per_cells`
+    but computed for all ROIs at once from the (ROIs x conditions) summary
+
+    angles: the varied values of the angle parameter
+    """
+    cond = np.ones(len(conditions['angle']), dtype=bool)
+    if 'contrast' in conditions:
+        cond = (conditions['contrast']==contrast)
+
+    shifted_angle = angles-angles[1]
+
+    responsive = np.sum(signif[:,cond], axis=1)>0
+    values = summary['value'][:,cond][responsive]
+
+    ipref = np.argmax(values, axis=1)
+    table = shift_index_table(conditions['angle'][cond], shifted_angle)
+
+    RESPONSES = np.zeros((len(values), len(shifted_angle)))
+    RESPONSES[np.arange(len(values))[:,np.newaxis], table[ipref]] = values
+
+    return {'RESPONSES':RESPONSES,
+            'FRAC_RESP':np.sum(responsive)/len(responsive),
+            'responsive':responsive,
+            'pref_angle':conditions['angle'][cond][ipref],
+            'shifted_angle':shifted_angle}
+
+
+def stat_window_sweep(tensor,
+                      interval_pre=[[-1,0], [-1.5,0]],
+                      interval_post=[[1,2], [1,2.5]],
+                      test=['ttest', 'anova'],
+                      response_significance_threshold=[5e-2, 1e-2, 1e-3],
+                      positive=True,
+                      contrast=1,
+                      verbose=True):
+    """
+    evaluates the responsiveness and tuning summaries over a grid of
+    (interval_pre, interval_post, test, threshold) settings
+    on a single episode tensor (see `episodes.build_episode_tensor`)
+
+    the window means come from a single cumulative sum over time,
+    the tests are run once per (interval_pre, interval_post, test)
+    and the thresholds are applied afterwards
+
+    returns a list of {'stat_test_props', 'response_significance_threshold',
+                       'RESPONSES', 'FRAC_RESP', 'responsive', ...}
+    """
+    C = cumulative_responses(tensor['responses'])
+
+    means = {}
+    for interval in list(interval_pre)+list(interval_post):
+        if tuple(interval) not in means:
+            means[tuple(interval)] = window_mean(C, tensor['t'], interval)
+    del C
+
+    GRID = []
+    for pre, post, t in itertools.product(interval_pre, interval_post, test):
+
+        if verbose:
+            print('   - pre=%s, post=%s, test=%s [...]' % (pre, post, t))
+
+        summary = evoked_stats(means[tuple(pre)], means[tuple(post)],
+                               tensor['condition'], test=t)
+
+        for threshold in response_significance_threshold:
+
+            signif = significant(summary, threshold=threshold, positive=positive)
+            GRID.append(dict(stat_test_props=dict(interval_pre=list(pre),
+                                                  interval_post=list(post),
+                                                  test=t,
+                                                  positive=positive),
+                             response_significance_threshold=threshold,
+                             **tuning_summary(summary,
+                                              tensor['conditions'],
+                                              tensor['varied_parameters']['angle'],
+                                              signif=signif,
+                                              contrast=contrast)))
+    return GRID
+
+
+def pvalue_summary(tensor,
+                   stat_test_props=dict(interval_pre=[-1.5,0],
+                                        interval_post=[1,2.5],
+                                        test='ttest',
+                                        positive=True)):
+    """
+    raw (ROIs x conditions) p-values and evoked values of a session
+
+    this is the threshold-free output of the analysis: the responsive set,
+    the responsive fraction and the tuning summaries can be evaluated
+    afterwards for any threshold or correction (see `responsive_at`)
+    """
+    with profiling.stage('stat_tests'):
+        C = cumulative_responses(tensor['responses'])
+        summary = evoked_stats(window_mean(C, tensor['t'], stat_test_props['interval_pre']),
+                               window_mean(C, tensor['t'], stat_test_props['interval_post']),
+                               tensor['condition'],
+                               test=stat_test_props['test'])
+
+    summary['conditions'] = tensor['conditions']
+    summary['angles'] = tensor['varied_parameters']['angle']
+    summary['stat_test_props'] = dict(stat_test_props)
+
+    return summary
+
+
+def compare_to_per_cell(EPISODES,
+                        quantity='dFoF',
+                        stat_test_props=dict(interval_pre=[-1.5,0],
+                                             interval_post=[1,2.5],
+                                             test='ttest',
+                                             positive=True),
+                        response_significance_threshold=0.01,
+                        contrast=1,
+                        rtol=1e-9):
+    """
+    `pvalue_summary` + `responsive_at` vs the per-ROI `compute_summary_data`
+    of `analysis.tuning_response_per_cells`, on the same EpisodeData
+
+    returns {'same_fraction', 'same_nresponsive',
+             'max_response_diff' (on the tuning curves), 'agree'}
+    """
+    from analysis import tuning_response_per_cells
+    from episodes import episode_tensor
+
+    tensor = episode_tensor(EPISODES, quantity=quantity)
+    tuning = responsive_at(pvalue_summary(tensor, stat_test_props=stat_test_props),
+                           threshold=response_significance_threshold, contrast=contrast)
+    RESPONSES, frac_resp, _ = tuning_response_per_cells(EPISODES, quantity, tensor['responses'].shape[1],
+                                    stat_test_props=stat_test_props,
+                                    response_significance_threshold=response_significance_threshold,
+                                    contrast=contrast,
+                                    with_screen=False)
+    RESPONSES = np.array(RESPONSES).reshape((len(RESPONSES), -1))
+
+    output = {'same_fraction':bool(frac_resp==tuning['FRAC_RESP']),
+              'same_nresponsive':len(RESPONSES)==len(tuning['RESPONSES'])}
+    output['max_response_diff'] = float(np.max(np.abs(RESPONSES-tuning['RESPONSES']), initial=0))\
+                                        if output['same_nresponsive'] else np.nan
+    scale = np.max(np.abs(RESPONSES), initial=0)
+    output['agree'] = bool(output['same_fraction'] and output['same_nresponsive'] and\
+                           output['max_response_diff']<=rtol*max([scale, 1e-12]))
+    return output
+
+
+def compare_to_physion(data,
+                       quantity='dFoF',
+                       protocol_name='ff-gratings-8orientation-2contrasts-10repeats',
+                       **compare_args):
+    """
+    `compare_to_per_cell` on a session (the quantity must be built first),
+    to validate the tensor path before it replaces `compute_tuning_response_per_cells`
+    """
+    from analysis import load_EpisodeData
+    from deconvolution import episode_quantity
+
+    EpisodeData = load_EpisodeData()
+    with episode_quantity(data, quantity) as q:
+        EPISODES = EpisodeData(data, quantities=[q],
+                               protocol_id=data.get_protocol_id(protocol_name=protocol_name),
+                               verbose=False)
+    return compare_to_per_cell(EPISODES, quantity=q, **compare_args)
+
+
+def screened_pvalue_summary(tensor,
+                            stat_test_props=dict(interval_pre=[-1.5,0],
+                                                 interval_post=[1,2.5],
+                                                 test='ttest',
+                                                 positive=True),
+                            threshold=0.01):
+    """
+    `pvalue_summary` where the tests only run on the candidate ROIs of `screen`
+
+    the other ROIs get p=1: the significance at any threshold <= `threshold`
+    is the same as with `pvalue_summary`, without correction, with 'bonferroni'
+    or with a per-ROI 'fdr_bh' (a session-wide 'fdr_bh' depends on the p-values
+    of the screened ROIs, it is refused by `responsive_at`, as larger thresholds)
+    """
+    with profiling.stage('stat_tests'):
+        C = cumulative_responses(tensor['responses'])
+        pre = window_mean(C, tensor['t'], stat_test_props['interval_pre'])
+        post = window_mean(C, tensor['t'], stat_test_props['interval_post'])
+        del C
+
+        candidates = screen(pre, post, tensor['condition'],
+                            test=stat_test_props['test'],
+                            threshold=threshold,
+                            positive=stat_test_props['positive'])
+
+        summary = evoked_stats(pre, post, tensor['condition'], test=None)
+        summary['pvalue'][candidates] = evoked_stats(pre[:,candidates], post[:,candidates],
+                                                     tensor['condition'],
+                                                     test=stat_test_props['test'])['pvalue']
+
+    summary['conditions'] = tensor['conditions']
+    summary['angles'] = tensor['varied_parameters']['angle']
+    summary['stat_test_props'] = dict(stat_test_props)
+    summary['candidates'] = candidates
+    summary['screen_threshold'] = threshold
+
+    return summary
+
+
+def adjusted_pvalues(pvalues,
+                     correction=None,
+                     axis=1):
+    """
+    multiple comparison correction of the (ROIs x conditions) p-values
+
+    correction: None, 'bonferroni' or 'fdr_bh' (Benjamini-Hochberg)
+    axis: 1 -> family = the conditions of each ROI, None -> the whole session
+    """
+    if correction is None:
+        return pvalues
+
+    if axis is None:
+        return adjusted_pvalues(pvalues.reshape(1,-1),
+                                correction=correction).reshape(pvalues.shape)
+
+    n = pvalues.shape[axis]
+
+    if correction=='bonferroni':
+        return np.clip(n*pvalues, 0, 1)
+
+    elif correction=='fdr_bh':
+        order = np.argsort(pvalues, axis=axis)
+        ranked = np.take_along_axis(pvalues, order, axis=axis)
+        ranked = ranked*n/np.arange(1, n+1)
+        # enforce monotonicity from the largest p-value down
+        ranked = np.flip(np.minimum.accumulate(np.flip(ranked, axis=axis), axis=axis), axis=axis)
+        adjusted = np.empty_like(pvalues)
+        np.put_along_axis(adjusted, order, np.clip(ranked, 0, 1), axis=axis)
+        return adjusted
+
+    else:
+        raise ValueError('correction "%s" not recognized !!' % correction)
+
+
+def responsive_at(summary,
+                  threshold=0.01,
+                  correction=None,
+                  axis=1,
+                  contrast=1):
+    """
+    tuning summary (see `tuning_summary`) at a given threshold and correction,
+    evaluated from the stored p-values of `pvalue_summary`
+    """
+    if 'screen_threshold' in summary:
+        if threshold>summary['screen_threshold']:
+            raise ValueError('threshold %.1e above the screening threshold (%.1e) of the summary' %\
+                                (threshold, summary['screen_threshold']))
+        if (correction=='fdr_bh') and (axis is None):
+            raise ValueError('session-wide fdr_bh needs all p-values: use `pvalue_summary`')
+    corrected = dict(summary, pvalue=adjusted_pvalues(summary['pvalue'],
+                                                      correction=correction,
+                                                      axis=axis))
+    signif = significant(corrected,
+                         threshold=threshold,
+                         positive=summary['stat_test_props']['positive'])
+    return tuning_summary(summary, summary['conditions'], summary['angles'],
+                          signif=signif, contrast=contrast)
+
+
+def roi_min_pvalue(summary,
+                   correction=None,
+                   axis=1,
+                   contrast=1):
+    """
+    smallest (corrected) p-value over the conditions of each ROI,
+    a ROI is responsive at threshold p if its min. p-value is below p
+    """
+    pvalues = adjusted_pvalues(summary['pvalue'], correction=correction, axis=axis)
+    if summary['stat_test_props']['positive']:
+        pvalues = np.where(summary['value']>0, pvalues, 1.)
+
+    cond = np.ones(pvalues.shape[1], dtype=bool)
+    if 'contrast' in summary['conditions']:
+        cond = (summary['conditions']['contrast']==contrast)
+
+    return np.min(pvalues[:,cond], axis=1)
+
+
+def fraction_responsive_curves(SUMMARIES,
+                               thresholds=np.logspace(-4, -1, 31),
+                               correction=None,
+                               axis=1,
+                               contrast=1):
+    """
+    fraction of responsive ROIs vs threshold for a list of sessions
+
+    returns a (sessions x thresholds) array
+    """
+    thresholds = np.asarray(thresholds)
+    curves = np.zeros((len(SUMMARIES), len(thresholds)))
+
+    for i, summary in enumerate(SUMMARIES):
+        min_p = np.sort(roi_min_pvalue(summary, correction=correction,
+                                       axis=axis, contrast=contrast))
+        curves[i,:] = np.searchsorted(min_p, thresholds, side='left')/len(min_p)
+
+    return curves
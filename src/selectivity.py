@@ -0,0 +1,127 @@
+"""
+vector-sum selectivity of the (ROIs x angles) tuning responses
+
+    OSI = |sum_k r_k exp(2i theta_k)| / sum_k r_k   (circular variance = 1-OSI)
+    DSI = |sum_k r_k exp(i theta_k)| / sum_k r_k
+
+computed for all ROIs at once with a single complex matrix product,
+the direction quantities are only defined for protocols covering 360 degrees
+"""
+import numpy as np
+
+from episodes import cumulative_responses, window_mean
+
+
+def vector_sum(R, angles,
+               rectify=True):
+    """
+    R: (ROIs x angles) responses, angles: in degrees
+
+    returns a dictionary of (ROIs,) arrays:
+        'OSI', 'circular_variance', 'pref_orientation' (in [0,180[),
+        'DSI', 'pref_direction' (in [0,360[, nan if the angles span <=180 degrees)
+    """
+    R = np.atleast_2d(R)
+    if rectify:
+        R = np.clip(R, 0, None)
+
+    theta = np.deg2rad(np.asarray(angles, dtype=float))
+    Z = R @ np.exp(1j*np.array([2*theta, theta]).T) # (ROIs x 2): orientation, direction
+    total = np.sum(R, axis=1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        norm = np.where(total[:,np.newaxis]>0, np.abs(Z)/total[:,np.newaxis], 0)
+
+    output = {'OSI':norm[:,0],
+              'circular_variance':1-norm[:,0],
+              'pref_orientation':np.rad2deg(np.angle(Z[:,0])/2)%180}
+
+    if np.ptp(angles)>180:
+        output['DSI'] = norm[:,1]
+        output['pref_direction'] = np.rad2deg(np.angle(Z[:,1]))%360
+    else:
+        output['DSI'] = np.full(len(R), np.nan)
+        output['pref_direction'] = np.full(len(R), np.nan)
+
+    return output
+
+
+def trial_responses(tensor,
+                    interval_pre=[-1.5,0],
+                    interval_post=[1,2.5],
+                    contrast=1):
+    """
+    evoked response (post-pre window means) of each episode of an episode tensor
+    (see `episodes.build_episode_tensor`)
+
+    returns (episodes x ROIs) evoked responses and the (episodes,) angles
+    """
+    C = cumulative_responses(tensor['responses'])
+    evoked = window_mean(C, tensor['t'], interval_post)-window_mean(C, tensor['t'], interval_pre)
+
+    cond = np.ones(len(evoked), dtype=bool)
+    if 'contrast' in tensor:
+        cond = (tensor['contrast']==contrast)
+
+    return evoked[cond], tensor['angle'][cond]
+
+
+def tuning_matrix(evoked, angle):
+    """
+    (ROIs x angles) trial-averaged responses and the sorted unique angles
+    """
+    angles, labels = np.unique(angle, return_inverse=True)
+    counts = np.bincount(labels, minlength=len(angles))
+    # (angles x episodes) averaging matrix
+    W = (labels[np.newaxis,:]==np.arange(len(angles))[:,np.newaxis])/counts[:,np.newaxis]
+    return (W @ evoked).T, angles
+
+
+def bootstrap_preferred_angle(evoked, angle,
+                              domain='orientation',
+                              N=1000,
+                              alpha=0.05,
+                              rectify=True,
+                              seed=0):
+    """
+    bootstrap confidence interval on the vector-sum preferred angle
+
+    the trials are resampled with replacement within each angle,
+    for all ROIs at once: each resample is a matrix of trial counts,
+    so that the resampled tuning curves are matrix products
+
+    domain: 'orientation' (period 180) or 'direction' (period 360)
+
+    returns a dictionary of (ROIs,) arrays:
+        'pref', 'ci_low', 'ci_high', 'ci_width' (in degrees)
+    """
+    k, period = (2, 180.) if domain=='orientation' else (1, 360.)
+
+    rng = np.random.default_rng(seed)
+    angles, labels = np.unique(angle, return_inverse=True)
+    if domain=='direction' and np.ptp(angles)<=180:
+        raise ValueError('the direction is not defined for angles within 180 degrees')
+
+    Z = np.zeros((N, evoked.shape[1]), dtype=complex)
+    for a, value in enumerate(angles):
+        trials = np.flatnonzero(labels==a)
+        # (resamples x trials) counts, normalized to give the resampled means
+        W = rng.multinomial(len(trials), np.ones(len(trials))/len(trials), size=N)/len(trials)
+        mean = W @ evoked[trials]
+        if rectify:
+            mean = np.clip(mean, 0, None)
+        Z += mean*np.exp(1j*k*np.deg2rad(value))
+
+    R, _ = tuning_matrix(evoked, angle)
+    key = 'pref_orientation' if domain=='orientation' else 'pref_direction'
+    pref = vector_sum(R, angles, rectify=rectify)[key]
+
+    boot = np.rad2deg(np.angle(Z)/k)%period
+    # circular deviations from the point estimate, in [-period/2, period/2[
+    deviation = (boot-pref+period/2)%period-period/2
+    low, high = np.percentile(deviation, [100*alpha/2, 100*(1-alpha/2)], axis=0)
+
+    return {'pref':pref,
+            'ci_low':(pref+low)%period,
+            'ci_high':(pref+high)%period,
+            'ci_width':high-low}
@@ -0,0 +1,262 @@
+"""
+size tuning of all ROIs from the episode tensors of the size-tuning protocols
+
+    tensor = build_episode_tensor(data, protocol_name='size-tuning-protocol-loc')
+    sizes = build_episode_tensor(data, protocol_name='size-tuning-protocol-dep')
+    ST = size_tuning(tensor, tensor_sizes=sizes, rf=rf_centers(data))
+    ST['responses'] # (responsive ROIs x radii), as `center_and_compute_size_tuning`
+
+the (ROIs x conditions) evoked statistics are computed once (`evoked_stats`)
+and re-arranged with the condition index into a dense
+(ROIs x locations x angles x radii) grid, so that the centering,
+the preferred angle and the radius curves are array reductions over all ROIs
+
+the outputs are meant to be those of physion's `center_and_compute_size_tuning`
+(same ROIs, angles, curves and radius convention, on which the slices of
+`suppression_index` rely): `compare_to_physion` checks it on a session
+"""
+import warnings
+import numpy as np
+
+from episodes import cumulative_responses, window_mean
+from responsiveness import evoked_stats, significant
+
+
+def condition_grid(conditions, keys):
+    """
+    position of each condition along the `keys` axes of the dense grid
+
+    returns the unique values per key and the (conditions x keys) indices
+    (keys absent from the conditions give a single axis entry)
+    """
+    Nconds = len(next(iter(conditions.values()))) if len(conditions)>0 else 1
+    values, indices = [], []
+    for key in keys:
+        if key in conditions:
+            u, i = np.unique(conditions[key], return_inverse=True)
+        else:
+            u, i = np.array([np.nan]), np.zeros(Nconds, dtype=int)
+        values.append(u)
+        indices.append(i.ravel())
+    return values, np.array(indices).T
+
+
+def to_grid(X, index, shape, fill=np.nan):
+    """ (ROIs x conditions) -> (ROIs x *shape), missing conditions filled with `fill` """
+    grid = np.full((len(X),)+tuple(shape), fill, dtype=np.result_type(X, type(fill)))
+    grid[(slice(None),)+tuple(index.T)] = X
+    return grid
+
+
+def evoked_grid(tensor, keys,
+                interval_pre=[-1,0],
+                interval_post=[1,2],
+                test='ttest',
+                response_significance_threshold=0.01,
+                positive=True):
+    """
+    (ROIs x *keys) evoked values and significance of an episode tensor (see `condition_grid`)
+
+    returns the unique values per key, the values and the significance grids
+    """
+    C = cumulative_responses(tensor['responses'])
+    summary = evoked_stats(window_mean(C, tensor['t'], interval_pre),
+                           window_mean(C, tensor['t'], interval_post),
+                           tensor['condition'], test=test)
+    del C
+    signif = significant(summary, threshold=response_significance_threshold, positive=positive)
+
+    values, index = condition_grid(tensor['conditions'], keys)
+    shape = [len(v) for v in values]
+    return values, to_grid(summary['value'], index, shape), to_grid(signif, index, shape, fill=False)
+
+
+def size_tuning(tensor,
+                tensor_sizes=None,
+                interval_pre=[-1,0],
+                interval_post=[1,2],
+                test='ttest',
+                response_significance_threshold=0.01,
+                positive=True,
+                rf=None,
+                max_rf_residual=0.5,
+                size_location=(0,0),
+                xkey='x-center',
+                ykey='y-center'):
+    """
+    centering, preferred angle and radius curves of all ROIs
+
+    tensor: episode tensor of the centering protocol ('size-tuning-protocol-loc')
+    tensor_sizes: episode tensor of the size variations presented at `size_location`
+        ('size-tuning-protocol-dep'), None: the radii varied in `tensor` at each location
+
+    - center: stimulus location of the largest response (over all conditions),
+        or, if `rf` is given (see `receptive_fields.rf_centers`), the stimulus location
+        the closest to the fitted RF center of the ROIs with a good fit (residual<max_rf_residual)
+    - preferred angle: angle of the largest response at the center
+    - responsive: at least one significant condition at the center
+        (and, with `tensor_sizes`, the center at `size_location`)
+    - curves: responses at the preferred angle per radius, with a leading
+        radius 0 of response 0 (the convention of the `suppression_index` slices)
+
+    returns a dictionary with:
+        'radii', 'angles', 'locations' : (locations x 2) x,y of the stimulus positions
+        'center' (ROIs,) location index, 'pref_angle' (ROIs,) angle index
+        'curves' : (ROIs x radii) responses at the center and preferred angle
+        'responsive' : (ROIs,) boolean
+        'responses', 'rois', 'pref_angles' : the curves, ROI indices and preferred
+            angles of the responsive ROIs (the `center_and_compute_size_tuning` outputs)
+    """
+    stat_args = dict(interval_pre=interval_pre, interval_post=interval_post, test=test,
+                     response_significance_threshold=response_significance_threshold,
+                     positive=positive)
+    (y, x, angles, radii), values, sig = evoked_grid(tensor, [ykey, xkey, 'angle', 'radius'],
+                                                     **stat_args)
+    # locations: the (x,y) pairs, flattened (location index: iy*len(x)+ix)
+    Nrois = len(values)
+    values = values.reshape((Nrois, len(y)*len(x), len(angles), len(radii)))
+    sig = sig.reshape(values.shape)
+    X, Y = np.meshgrid(x, y)
+    locations = np.array([X.ravel(), Y.ravel()]).T
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning) # untested locations
+        location_max = np.nanmax(values, axis=(2,3))
+    tested = np.isfinite(location_max)
+    center = np.argmax(np.where(tested, location_max, -np.inf), axis=1)
+
+    if (rf is not None) and (len(locations)>1):
+        good = rf['residual']<max_rf_residual
+        d2 = (rf['x0'][:,np.newaxis]-locations[np.newaxis,:,0])**2+\
+                (rf['y0'][:,np.newaxis]-locations[np.newaxis,:,1])**2
+        center = np.where(good, np.argmin(np.where(tested, d2, np.inf), axis=1), center)
+
+    rois = np.arange(Nrois)
+    at_center = values[rois, center]                       # (ROIs x angles x radii)
+    best = np.argmax(np.where(np.isfinite(at_center), at_center, -np.inf).reshape(Nrois, -1), axis=1)
+    pref_angle = best//len(radii)
+    responsive = np.any(sig[rois, center], axis=(1,2))
+
+    if tensor_sizes is None:
+        curves = at_center[rois, pref_angle]               # (ROIs x radii)
+    else:
+        at_size_location = np.flatnonzero((locations[:,0]==size_location[0]) &\
+                                          (locations[:,1]==size_location[1]))
+        responsive &= np.isin(center, at_size_location)
+        (size_angles, radii), size_values, _ = evoked_grid(tensor_sizes, ['angle', 'radius'],
+                                                           **stat_args)
+        ia = np.searchsorted(size_angles, angles[pref_angle]).clip(0, len(size_angles)-1)
+        curves = np.where((size_angles[ia]==angles[pref_angle])[:,np.newaxis],
+                          size_values[rois, ia], np.nan)
+
+    radii = np.concatenate([[0], radii])
+    curves = np.concatenate([np.zeros((Nrois, 1)), curves], axis=1)
+
+    return {'radii':radii, 'angles':angles, 'locations':locations,
+            'center':center, 'pref_angle':pref_angle,
+            'curves':curves, 'responsive':responsive,
+            'responses':curves[responsive],
+            'rois':np.flatnonzero(responsive),
+            'pref_angles':angles[pref_angle[responsive]]}
+
+
+def compare_to_physion(data,
+                       quantity='dFoF',
+                       protocol_name='size-tuning-protocol-loc',
+                       sizes_protocol_name='size-tuning-protocol-dep',
+                       rtol=1e-6,
+                       **size_tuning_args):
+    """
+    `size_tuning` vs physion's `center_and_compute_size_tuning` on a session
+    (the quantity must be built first)
+
+    physion (1.0) stores as preferred angle the angle of the i-th condition of
+    all the centering conditions, i being the index of the best angle among the
+    center ones: the preferred angles (and curves) only agree for the ROIs
+    preferring the first angle
+
+    returns {'same_radii', 'same_rois', 'same_pref_angles' (on the common ROIs),
+             'max_curve_diff' (on the common ROIs), 'agree'}
+    """
+    from physion.analysis.protocols.size_tuning import center_and_compute_size_tuning
+    from episodes import build_episode_tensor
+    from deconvolution import episode_quantity
+
+    tensors = [build_episode_tensor(data, quantity=quantity, protocol_name=name, verbose=False)\
+                    for name in [protocol_name, sizes_protocol_name]]
+    ST = size_tuning(tensors[0], tensor_sizes=tensors[1], **size_tuning_args)
+    with episode_quantity(data, quantity) as q:
+        radii, responses, rois, pref_angles = center_and_compute_size_tuning(data,
+                                                        imaging_quantity=q,
+                                                        with_rois_and_angles=True,
+                                                        verbose=False)
+    radii, responses = np.asarray(radii), np.asarray(responses).reshape((len(rois), -1))
+
+    common, i, j = np.intersect1d(ST['rois'], rois, return_indices=True)
+    output = {'same_radii':(len(radii)==len(ST['radii'])) and np.allclose(radii, ST['radii']),
+              'same_rois':np.array_equal(np.sort(ST['rois']), np.sort(rois)),
+              'same_pref_angles':bool(np.allclose(ST['pref_angles'][i], np.asarray(pref_angles)[j])),
+              'max_curve_diff':float(np.max(np.abs(ST['responses'][i]-responses[j])))\
+                                    if (len(common)>0 and responses.shape[1]==ST['responses'].shape[1])\
+                                    else np.nan}
+    scale = np.max(np.abs(responses)) if responses.size>0 else 1.
+    output['agree'] = bool(output['same_radii'] and output['same_rois'] and output['same_pref_angles'] and\
+                           (output['max_curve_diff']<=rtol*max([scale, 1e-12]) or len(common)==0))
+    return output
+
+
+def ragged_to_dense(curves, Nradii=None):
+    """
+    list of per-session (ROIs x radii) curves -> one (all ROIs x radii) array
+    and the (sessions+1,) offsets: session i is dense[offsets[i]:offsets[i+1]]
+    """
+    lengths = np.array([len(c) for c in curves], dtype=int)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    if lengths.sum()==0:
+        return np.zeros((0, Nradii or 0)), offsets
+    return np.concatenate([c for c, n in zip(curves, lengths) if n>0]), offsets
+
+
+def session_means(X, offsets):
+    """ (sessions x ...) means of the rows of each session (nan for empty sessions) """
+    counts = np.diff(offsets)
+    nonempty = counts>0
+    means = np.full((len(counts),)+X.shape[1:], np.nan)
+    if np.any(nonempty):
+        # empty sessions have no rows, so the next start is the end of the previous segment
+        sums = np.add.reduceat(X, offsets[:-1][nonempty], axis=0)
+        means[nonempty] = sums/counts[nonempty].reshape((-1,)+(1,)*(X.ndim-1))
+    return means
+
+
+def suppression_index(curves,
+                      center=slice(2,5),
+                      surround=slice(-3,None)):
+    """ (center-surround)/center of the (... x radii) curves, clipped to [0,1] """
+    resp1 = np.clip(np.mean(curves[...,center], axis=-1), 1e-2, np.inf)
+    return np.clip((resp1-np.mean(curves[...,surround], axis=-1))/resp1, 0, 1)
+
+
+def population_summary(dense, offsets,
+                       center=slice(2,5),
+                       surround=slice(-3,None)):
+    """
+    size-tuning summary of a group of sessions, averaged over ROIs and over sessions
+
+    the curves are clipped to positive values, the suppression indices
+    are computed per ROI ('ROIs') or on the session averages ('sessions')
+
+    returns {'ROIs':{...}, 'sessions':{...}} with 'responses', 'mean', 'sem', 'SI'
+    """
+    resp = np.clip(dense, 0, np.inf)
+    counts = np.diff(offsets)
+    output = {}
+    for average_by, X in zip(['ROIs', 'sessions'],
+                             [resp, session_means(resp, offsets)[counts>0]]):
+        output[average_by] = {'responses':X,
+                              'mean':np.mean(X, axis=0),
+                              'sem':np.std(X, axis=0, ddof=1)/np.sqrt(len(X)) if len(X)>1\
+                                        else np.full(X.shape[1:], np.nan),
+                              'SI':suppression_index(X, center=center, surround=surround)}
+    output['n_rois'] = counts
+    return output
@@ -0,0 +1,317 @@
+"""
+parameter sweeps from a grid file
+
+    python src/sweep.py grid.json --store data/sweep.db --Nproc 4
+
+grid.json:
+    {"folder": "~/CURATED/SST-WT-NR1-GluN3-2023",   (or "files": [...])
+     "defaults": {"test": "anova", "threshold": 0.05},
+     "grid": [{"quantity": ["rawFluo", "neuropil", "dFoF", "deconvolved"]},
+              {"neuropil_correction_factor": [0.6, 0.7, 0.8, 0.9]},
+              {"roi_to_neuropil_fluo_inclusion_factor": [1.05, 1.1, 1.15, 1.2, 1.25, 1.3],
+               "threshold": [0.05, 0.01]}]}
+
+each entry of "grid" is a cartesian product over its lists, the points are
+completed with the defaults (see DEFAULTS) and the duplicates are removed.
+
+the points of a session share their upstream stages:
+    read (once per session) > build of the quantity (BUILD_KEYS)
+        > episode tensor (protocol) > statistical tests (STAT_KEYS)
+            > responsive ROIs and tuning (threshold, contrast)
+each stage runs once for all the points that share it, the sessions are
+distributed over `Nproc` processes and the results are written to a
+single sqlite file, keyed by (parameters, file), with a status:
+    'done', 'no_protocol' (none of the protocols in the session, not run again)
+    or 'failed' (the traceback as result, run again on the next call)
+
+    query('data/sweep.db', quantity='dFoF', threshold=0.05)
+"""
+import os, sys, json, pickle, sqlite3, itertools, pathlib, traceback
+import multiprocessing as mp
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parent))
+import profiling
+
+DEFAULTS = dict(quantity='dFoF',
+                # build_dFoF
+                roi_to_neuropil_fluo_inclusion_factor=1.15,
+                neuropil_correction_factor=0.7,
+                method_for_F0='sliding_percentile',
+                percentile=5.,
+                sliding_window=300.,
+                # episodes: the first protocol of the list found in the session
+                protocol=['ff-gratings-8orientation-2contrasts-15repeats',
+                          'ff-gratings-8orientation-2contrasts-10repeats'],
+                # stat_test_props
+                interval_pre=[-1.,0],
+                interval_post=[1.,2.],
+                test='anova',
+                positive=True,
+                # responsiveness
+                threshold=0.05,
+                contrast=1)
+
+BUILD_KEYS = ['roi_to_neuropil_fluo_inclusion_factor', 'neuropil_correction_factor',
+              'method_for_F0', 'percentile', 'sliding_window']
+STAT_KEYS = ['interval_pre', 'interval_post', 'test', 'positive']
+
+
+def normalize(value):
+    """ numbers as floats (so that 5 and 5. are the same parameter value) """
+    if isinstance(value, (list, tuple)):
+        return [normalize(v) for v in value]
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return value
+
+
+def point_key(point):
+    """ canonical string of a grid point """
+    return json.dumps({k:normalize(v) for k, v in point.items()}, sort_keys=True)
+
+
+def expand_grid(config):
+    """ list of the (unique) parameter dictionaries of a grid configuration """
+    defaults = dict(DEFAULTS, **config.get('defaults', {}))
+    unknown = set(defaults)-set(DEFAULTS)
+    for sub in config.get('grid', [{}]):
+        unknown |= set(sub)-set(DEFAULTS)
+    if len(unknown)>0:
+        raise ValueError('unknown sweep parameters: %s' % ', '.join(sorted(unknown)))
+
+    POINTS, keys = [], set()
+    for sub in config.get('grid', [{}]):
+        for values in itertools.product(*sub.values()):
+            point = {k:normalize(v) for k, v in dict(defaults, **dict(zip(sub.keys(), values))).items()}
+            if point_key(point) not in keys:
+                keys.add(point_key(point))
+                POINTS.append(point)
+    return POINTS
+
+
+def build_args(point):
+    """ the `build_dFoF` arguments, only relevant for dFoF-derived quantities """
+    if point['quantity'] in ['dFoF', 'deconvolved']:
+        return {k:point[k] for k in BUILD_KEYS}
+    return {}
+
+
+def stage_keys(point):
+    """ keys of the successive shared stages of a point """
+    build = (point['quantity'], json.dumps(build_args(point), sort_keys=True))
+    tensor = build+(json.dumps(point['protocol']),)
+    stats = tensor+(json.dumps({k:point[k] for k in STAT_KEYS}, sort_keys=True),)
+    return build, tensor, stats
+
+
+def stage_counts(POINTS):
+    """ number of runs of each stage per session, once the shared stages are deduplicated """
+    keys = [stage_keys(p) for p in POINTS]
+    return {'points':len(POINTS),
+            'build':len(set(k[0] for k in keys)),
+            'tensor':len(set(k[1] for k in keys)),
+            'stats':len(set(k[2] for k in keys))}
+
+
+def run_session(f, POINTS, verbose=False):
+    """
+    all the grid points on one session, each shared stage computed once
+
+    returns [(point, status, result), ...], result: the `responsive_at` output
+    ('RESPONSES', 'FRAC_RESP', 'responsive', 'pref_angle', 'shifted_angle'),
+    None if status='no_protocol'
+    """
+    import analysis # adds physion to the path
+    from physion.analysis.read_NWB import Data
+    from prefetch import build_quantity
+    from episodes import build_episode_tensor
+    from responsiveness import pvalue_summary, responsive_at
+
+    # points sorted so that the points sharing a stage follow each other
+    order = sorted(range(len(POINTS)), key=lambda i: stage_keys(POINTS[i]))
+    RESULTS = []
+
+    with profiling.session(f):
+        with profiling.stage('read'):
+            data = Data(f, verbose=False)
+
+        try:
+            current = [None, None, None]
+            for i in order:
+                point = POINTS[i]
+                keys = stage_keys(point)
+
+                if keys[0]!=current[0]:
+                    build_quantity(data, quantity=point['quantity'], **build_args(point))
+                    current = [keys[0], None, None]
+
+                if keys[1]!=current[1]:
+                    protocols = [point['protocol']] if isinstance(point['protocol'], str)\
+                                    else point['protocol']
+                    protocol = [p for p in protocols if p in data.protocols]
+                    tensor = build_episode_tensor(data, quantity=point['quantity'],
+                                                  protocol_name=protocol[0],
+                                                  verbose=verbose) if len(protocol)>0 else None
+                    current[1:] = [keys[1], None]
+
+                if tensor is None:
+                    # stored, so that the session is not run again on resume
+                    RESULTS.append((point, 'no_protocol', None))
+                    continue
+
+                if keys[2]!=current[2]:
+                    pvalues = pvalue_summary(tensor,
+                                             stat_test_props={k:point[k] for k in STAT_KEYS})
+                    current[2] = keys[2]
+
+                RESULTS.append((point, 'done', responsive_at(pvalues, threshold=point['threshold'],
+                                                             contrast=point['contrast'])))
+        finally:
+            data.io.close()
+
+    return RESULTS
+
+
+def _run_session(args):
+    """ worker: a failing session is returned as 'failed' (with the traceback), not raised """
+    f, POINTS, logfile, run = args
+    if logfile is not None:
+        profiling.enable(logfile, run=run) # in each worker process, with the run id of the sweep
+    try:
+        return f, run_session(f, POINTS)
+    except Exception:
+        error = traceback.format_exc()
+        return f, [(point, 'failed', error) for point in POINTS]
+
+
+def open_store(store):
+    db = sqlite3.connect(store)
+    db.execute('CREATE TABLE IF NOT EXISTS results '
+               '(point TEXT, file TEXT, result BLOB, status TEXT, PRIMARY KEY (point, file))')
+    if 'status' not in [column[1] for column in db.execute('PRAGMA table_info(results)')]:
+        # stores written before the status column: all their entries were completed runs
+        db.execute("ALTER TABLE results ADD COLUMN status TEXT DEFAULT 'done'")
+    return db
+
+
+def run_sweep(config,
+              store='sweep.db',
+              FILES=None,
+              Nproc=None,
+              recompute=False,
+              logfile=None,
+              verbose=True):
+    """
+    runs the grid of `config` (a dictionary or a json file) on all files,
+    the (point, file) pairs already in the store are skipped (unless recompute),
+    except the failed ones
+
+    logfile: profiling log of the stages (for the cost model of `progress`)
+    """
+    if isinstance(config, str):
+        with open(config) as f:
+            config = json.load(f)
+
+    POINTS = expand_grid(config)
+    FILES = list_files(config) if FILES is None else FILES
+
+    db = open_store(store)
+    done = set(db.execute("SELECT point, file FROM results WHERE status!='failed'").fetchall())
+
+    run = profiling.new_run_id() if logfile is not None else None
+    JOBS = []
+    for f in FILES:
+        todo = [p for p in POINTS if recompute or ((point_key(p), f) not in done)]
+        if len(todo)>0:
+            JOBS.append((f, todo, logfile, run))
+
+    if verbose:
+        counts = stage_counts(POINTS)
+        print('%i points on %i sessions (%i to run): %i builds, %i tensors, %i stat tests per session' %\
+                (counts['points'], len(FILES), len(JOBS), counts['build'], counts['tensor'], counts['stats']))
+
+    Nproc = Nproc or max([1, mp.cpu_count()-1])
+    pool = mp.get_context('spawn').Pool(Nproc) if (Nproc>1 and len(JOBS)>1) else None
+    results = pool.imap_unordered(_run_session, JOBS) if pool is not None else map(_run_session, JOBS)
+
+    from progress import track, session_cost, session_size
+
+    try:
+        for f, RESULTS in track(results, total=len(JOBS),
+                                costs=None if pool is not None else\
+                                        [session_cost(session_size(job[0])) for job in JOBS]):
+            # written as the sessions complete, so that an interrupted sweep can be resumed
+            db.executemany('INSERT OR REPLACE INTO results (point, file, result, status) VALUES (?, ?, ?, ?)',
+                           [(point_key(point), f, pickle.dumps(result), status)
+                                for point, status, result in RESULTS])
+            db.commit()
+            if verbose:
+                status = RESULTS[0][1] if len(set(r[1] for r in RESULTS))==1 else 'done'
+                print(' - "%s" %s' % (f, status))
+                if status=='failed':
+                    print(RESULTS[0][2])
+        if pool is not None:
+            pool.close()
+            pool.join()
+    finally:
+        if pool is not None:
+            pool.terminate() # interrupted: the workers are stopped (no-op once joined)
+        db.close()
+
+
+def list_files(config):
+    if 'files' in config:
+        return list(config['files'])
+    import analysis # adds physion to the path
+    from physion.analysis.read_NWB import scan_folder_for_NWBfiles
+    return list(scan_folder_for_NWBfiles(os.path.expanduser(config['folder']),
+                                         verbose=False)['files'])
+
+
+def query(store,
+          files=None,
+          status='done',
+          **params):
+    """
+    results of the store matching the given parameter values
+    (status: 'done', 'no_protocol' or 'failed', the failed results are the tracebacks)
+
+    returns [(point, file, result), ...]
+    """
+    db = open_store(store)
+    OUTPUT = []
+    for key, f, blob in db.execute('SELECT point, file, result FROM results WHERE status=?', (status,)):
+        point = json.loads(key)
+        if ((files is None) or (f in files)) and\
+                all(point.get(k)==normalize(v) for k, v in params.items()):
+            OUTPUT.append((point, f, pickle.loads(blob)))
+    db.close()
+    return OUTPUT
+
+
+if __name__=='__main__':
+
+    import argparse
+
+    parser=argparse.ArgumentParser(description='parameter sweep from a grid file')
+
+    parser.add_argument("grid", type=str, help='json grid file')
+    parser.add_argument("--store", type=str, default='sweep.db')
+    parser.add_argument("--Nproc", type=int, default=None)
+    parser.add_argument("--recompute", action='store_true')
+    parser.add_argument("--profile", type=str, default=None,
+                        help='json-lines file where the stage timings are logged (see progress.py)')
+    parser.add_argument("--dry_run", action='store_true', help='only prints the expanded grid')
+
+    args = parser.parse_args()
+
+    if args.dry_run:
+        with open(args.grid) as f:
+            config = json.load(f)
+        POINTS = expand_grid(config)
+        for point in POINTS:
+            print(point_key(point))
+        print(stage_counts(POINTS))
+    else:
+        run_sweep(args.grid, store=args.store, Nproc=args.Nproc, recompute=args.recompute,
+                  logfile=args.profile)
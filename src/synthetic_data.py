@@ -0,0 +1,410 @@
+"""
+synthetic NWB sessions for benchmarking, with a known ground truth
+
+the files follow the layout of the sessions assembled with physion
+(ophys processing module with 'Fluorescence', 'Neuropil' and the
+'PlaneSegmentation', one stimulus timeseries per episode parameter),
+so that they can be read with `physion.analysis.read_NWB.Data`
+"""
+import os, datetime, tempfile
+import numpy as np
+from scipy.signal import lfilter
+from scipy.special import erf
+
+PROTOCOLS = {\
+    'luminosity':dict(keys=['light-level'],
+                      values=[[-2, -1, 0]], # dark, black, grey
+                      repeats=1,
+                      shuffle=False,
+                      duration=60.,
+                      interstim=0.),
+    'ff-gratings-8orientation-2contrasts-10repeats':\
+                 dict(keys=['angle', 'contrast'],
+                      values=[np.arange(8)*22.5, [0.5, 1.]],
+                      repeats=10,
+                      shuffle=True,
+                      duration=2.,
+                      interstim=2.),
+    # size tuning, as physion's protocol pair: the stimulus location (centering),
+    # then the size variations at the screen center (x=y=0)
+    'size-tuning-protocol-loc':\
+                 dict(keys=['x-center', 'y-center', 'angle'],
+                      values=[[-20., 0., 20.], [-15., 0., 15.],
+                              [0., 45., 90., 135.]],
+                      repeats=5,
+                      shuffle=True,
+                      duration=2.,
+                      interstim=2.),
+    'size-tuning-protocol-dep':\
+                 dict(keys=['radius', 'angle'],
+                      values=[[5., 10., 15., 20., 30., 40., 50., 60., 80., 100.],
+                              [0., 45., 90., 135.]],
+                      repeats=5,
+                      shuffle=True,
+                      duration=2.,
+                      interstim=2.)}
+
+
+def stimulus_sequence(protocols,
+                      duration=600.,
+                      blank=10.,
+                      seed=0):
+    """
+    sequence of episodes for the successive protocols
+
+    episodes ending after the recording end are dropped
+
+    returns a dictionary of (episodes,) arrays:
+        'time_start', 'time_stop', 'protocol_id' and one array per parameter
+    """
+    rng = np.random.default_rng(seed)
+
+    keys = sorted(set(sum([PROTOCOLS[p]['keys'] for p in protocols], [])))
+    sequence = {key:[] for key in ['time_start', 'time_stop', 'protocol_id']+keys}
+
+    tstart = blank
+    for ip, protocol in enumerate(protocols):
+
+        props = PROTOCOLS[protocol]
+        grid = np.array(np.meshgrid(*props['values'], indexing='ij')).reshape(len(props['keys']), -1).T
+
+        for repeat in range(props['repeats']):
+
+            order = rng.permutation(len(grid)) if props['shuffle'] else np.arange(len(grid))
+
+            for i in order:
+                if tstart+props['duration']<duration:
+                    sequence['time_start'].append(tstart)
+                    sequence['time_stop'].append(tstart+props['duration'])
+                    sequence['protocol_id'].append(ip)
+                    for key in keys:
+                        # non-varied parameters are set to 0 in the other protocols
+                        sequence[key].append(grid[i][props['keys'].index(key)]\
+                                                    if key in props['keys'] else 0.)
+                tstart += props['duration']+props['interstim']
+
+        tstart += blank
+
+    return {key:np.array(sequence[key]) for key in sequence}
+
+
+def ground_truth(nROIs,
+                 responsive_fraction=0.5,
+                 included_fraction=0.9,
+                 pref_angle=None,
+                 kappa=None,
+                 amplitude=None,
+                 seed=0):
+    """
+    per-ROI ground truth of the synthetic session
+
+    pref_angle (degrees), kappa (orientation tuning sharpness, larger is narrower)
+    and amplitude (dF/F at the preferred angle): a value or (ROIs,) values,
+    None draws them at random
+    """
+    rng = np.random.default_rng(seed)
+
+    truth = {'responsive':rng.uniform(size=nROIs)<responsive_fraction,
+             'included':rng.uniform(size=nROIs)<included_fraction,
+             'amplitude':rng.lognormal(np.log(0.8), 0.5, size=nROIs), # dF/F
+             'pref_angle':rng.choice(np.arange(8)*22.5, size=nROIs),
+             'kappa':rng.uniform(0.5, 3., size=nROIs), # orientation tuning sharpness
+             'center_radius':rng.uniform(10., 30., size=nROIs), # size tuning
+             'surround_radius':rng.uniform(40., 80., size=nROIs),
+             'suppression':rng.uniform(0., 0.8, size=nROIs),
+             'lum_levels':rng.normal(0., 0.2, size=(nROIs, 3)),
+             'F0':rng.uniform(200., 400., size=nROIs),
+             'Fneu0':rng.uniform(50., 150., size=nROIs)}
+    # receptive field (degrees), drawn last so that the other values do not depend on it
+    truth['rf_x'] = rng.choice([-20., 0., 0., 20.], size=nROIs)+rng.normal(0, 3., size=nROIs)
+    truth['rf_y'] = rng.choice([-15., 0., 0., 15.], size=nROIs)+rng.normal(0, 3., size=nROIs)
+    truth['rf_width'] = rng.uniform(8., 12., size=nROIs)
+
+    # the values are drawn anyway, so that the other ones do not depend on these settings
+    for key, value in zip(['pref_angle', 'kappa', 'amplitude'], [pref_angle, kappa, amplitude]):
+        if value is not None:
+            truth[key] = np.broadcast_to(np.asarray(value, dtype=float), (nROIs,)).copy()
+
+    return truth
+
+
+def evoked_amplitude(truth, sequence, protocols, rois):
+    """
+    (ROIs x episodes) amplitude of the evoked dF/F
+    """
+    amp = np.zeros((len(rois), len(sequence['time_start'])))
+
+    for ip, protocol in enumerate(protocols):
+
+        cond = (sequence['protocol_id']==ip)
+
+        if protocol=='luminosity':
+            amp[:,cond] = truth['lum_levels'][rois][:,sequence['light-level'][cond].astype(int)+2]
+            continue
+
+        angle = sequence['angle'][cond]
+        dangle = np.deg2rad(2*(angle[np.newaxis,:]-truth['pref_angle'][rois][:,np.newaxis]))
+        tuning = np.exp(truth['kappa'][rois][:,np.newaxis]*(np.cos(dangle)-1))
+
+        if 'contrast' in PROTOCOLS[protocol]['keys']:
+            tuning *= sequence['contrast'][cond][np.newaxis,:]**0.7
+
+        if 'radius' in PROTOCOLS[protocol]['keys']:
+            radius = sequence['radius'][cond][np.newaxis,:]
+            size = erf(radius/truth['center_radius'][rois][:,np.newaxis])-\
+                    truth['suppression'][rois][:,np.newaxis]*\
+                        erf(radius/truth['surround_radius'][rois][:,np.newaxis])
+            tuning *= np.clip(size, 0, np.inf)
+
+        if 'x-center' in PROTOCOLS[protocol]['keys']:
+            d2 = (sequence['x-center'][cond][np.newaxis,:]-truth['rf_x'][rois][:,np.newaxis])**2+\
+                    (sequence['y-center'][cond][np.newaxis,:]-truth['rf_y'][rois][:,np.newaxis])**2
+            tuning *= np.exp(-d2/2/truth['rf_width'][rois][:,np.newaxis]**2)
+
+        amp[:,cond] = (truth['amplitude']*truth['responsive'])[rois][:,np.newaxis]*tuning
+
+    return amp
+
+
+def generate_traces(truth, sequence, protocols, t,
+                    rois,
+                    noise=0.1,
+                    decay=1.3, # s, GCaMP6s
+                    neuropil_correction_factor=0.7,
+                    seed=0):
+    """
+    (ROIs x time) fluorescence and neuropil of a block of ROIs
+    """
+    rng = np.random.default_rng([seed, rois[0]])
+    dt = t[1]-t[0]
+
+    # episode index at each frame (-1 outside episodes)
+    episode = np.full(len(t), -1)
+    i0 = np.searchsorted(t, sequence['time_start'])
+    i1 = np.searchsorted(t, sequence['time_stop'])
+    for e, (a, b) in enumerate(zip(i0, i1)):
+        episode[a:b] = e
+
+    amp = evoked_amplitude(truth, sequence, protocols, rois)
+    drive = np.where(episode>=0, amp[:,episode], 0.)
+
+    # AR(1) calcium kernel, normalized to a unit plateau
+    gamma = np.exp(-dt/decay)
+    dFoF = lfilter([1-gamma], [1, -gamma], drive, axis=1)
+    dFoF += noise*rng.standard_normal(dFoF.shape)
+
+    neuropil = truth['Fneu0'][rois][:,np.newaxis]*\
+            (1+0.05*lfilter([0.01], [1, -0.99], rng.standard_normal(dFoF.shape), axis=1))
+
+    # excluded ROIs have a fluorescence close to the neuropil level
+    F0 = np.where(truth['included'][rois], truth['F0'][rois], 0.2*truth['Fneu0'][rois])
+    fluo = F0[:,np.newaxis]*(1+dFoF)+neuropil_correction_factor*neuropil
+
+    return fluo.astype(np.float32), neuropil.astype(np.float32)
+
+
+def running_speed(t, seed=0):
+    """
+    running bouts (cm/s) occupying about a third of the recording
+    """
+    rng = np.random.default_rng(seed)
+    state = lfilter([0.002], [1, -0.998], rng.standard_normal(len(t)))>0.01
+    return np.where(state, np.abs(5+2*rng.standard_normal(len(t))), 0.)
+
+
+def write_session(filename,
+                  nROIs=500,
+                  duration=30., # min
+                  frame_rate=30., # Hz
+                  protocols=['luminosity',
+                             'ff-gratings-8orientation-2contrasts-10repeats'],
+                  responsive_fraction=0.5,
+                  included_fraction=0.9,
+                  pref_angle=None,
+                  kappa=None,
+                  amplitude=None,
+                  block_size=100,
+                  seed=0,
+                  verbose=True):
+    """
+    writes a synthetic session to `filename`
+    and its ground truth to `filename.replace('.nwb', '.ground-truth.npy')`
+
+    pref_angle, kappa, amplitude: the orientation tuning (see `ground_truth`)
+
+    the traces are generated and written by blocks of ROIs,
+    so that large sessions fit in memory
+    """
+    import pynwb
+    from hdmf.data_utils import DataChunkIterator
+    from pynwb.ophys import ImageSegmentation, Fluorescence, OpticalChannel
+    from pynwb.base import Images
+    from pynwb.image import GrayscaleImage
+
+    t = np.arange(int(60.*duration*frame_rate))/frame_rate
+    sequence = stimulus_sequence(protocols, duration=60.*duration, seed=seed)
+    truth = ground_truth(nROIs,
+                         responsive_fraction=responsive_fraction,
+                         included_fraction=included_fraction,
+                         pref_angle=pref_angle,
+                         kappa=kappa,
+                         amplitude=amplitude,
+                         seed=seed)
+
+    if verbose:
+        print('writing "%s" : %i ROIs, %.1f min, %i episodes [...]' % (filename, nROIs, duration,
+                                                                      len(sequence['time_start'])))
+
+    metadata = {'protocol':'synthetic-%s' % ('BlankFirst' if protocols[0]=='luminosity' else 'BlankLast'),
+                'Presentation':'multiprotocol',
+                'subject_ID':'synthetic-%i' % seed,
+                'notes':'synthetic session (seed=%i)' % seed,
+                'CaImaging':True}
+    for ip, protocol in enumerate(protocols):
+        metadata['Protocol-%i' % (ip+1)] = '%s.json' % protocol
+
+    nwbfile = pynwb.NWBFile(identifier=os.path.basename(filename),
+                            session_description=str(metadata),
+                            experiment_description='synthetic session',
+                            session_start_time=datetime.datetime.now(datetime.timezone.utc),
+                            subject=pynwb.file.Subject(subject_id=metadata['subject_ID'],
+                                                       species='Mus musculus',
+                                                       description='synthetic'))
+
+    # -- visual stimulation
+    for key in sequence:
+        nwbfile.add_stimulus(pynwb.TimeSeries(name=key,
+                                              data=sequence[key],
+                                              unit='seconds' if 'time' in key else 'NA',
+                                              timestamps=np.arange(len(sequence[key]))))
+    for key in ['time_start', 'time_stop']:
+        # no photodiode realignement needed here
+        nwbfile.add_stimulus(pynwb.TimeSeries(name=key+'_realigned',
+                                              data=sequence[key],
+                                              unit='seconds',
+                                              timestamps=np.arange(len(sequence[key]))))
+    nwbfile.add_stimulus(pynwb.TimeSeries(name='time_duration',
+                                          data=sequence['time_stop']-sequence['time_start'],
+                                          unit='seconds',
+                                          timestamps=np.arange(len(sequence['time_start']))))
+
+    # -- behavior
+    nwbfile.add_acquisition(pynwb.TimeSeries(name='Running-Speed',
+                                             data=running_speed(t, seed=seed),
+                                             starting_time=0.,
+                                             unit='cm/s',
+                                             rate=frame_rate))
+
+    # -- imaging
+    device = nwbfile.create_device('Microscope')
+    optical_channel = OpticalChannel('OpticalChannel', 'green channel', 500.)
+    imaging_plane = nwbfile.create_imaging_plane('ImagingPlane', optical_channel,
+                                                 description='synthetic plane',
+                                                 device=device,
+                                                 excitation_lambda=920.,
+                                                 imaging_rate=frame_rate,
+                                                 indicator='GCaMP6s',
+                                                 location='V1')
+    ophys_module = nwbfile.create_processing_module('ophys', 'synthetic ophys data')
+
+    img_seg = ImageSegmentation()
+    ps = img_seg.create_plane_segmentation('synthetic ROIs', imaging_plane, 'PlaneSegmentation')
+    ps.add_column('iscell', 'two columns - iscell & probcell')
+
+    rng = np.random.default_rng(seed)
+    Lx = int(np.ceil(np.sqrt(nROIs)))*10
+    for roi in range(nROIs):
+        x, y = rng.integers(3, Lx-3, size=2)
+        ps.add_roi(pixel_mask=[(int(x+dx), int(y+dy), 1.) for dx in range(-2, 3) for dy in range(-2, 3)],
+                   iscell=[1., 1.])
+    ophys_module.add(img_seg)
+
+    images = Images('Backgrounds_0')
+    for key in ['meanImg', 'max_proj', 'meanImgE']:
+        images.add_image(GrayscaleImage(name=key, data=rng.uniform(size=(Lx, Lx))))
+    ophys_module.add(images)
+
+    rt_region = ps.create_roi_table_region('all ROIs', region=list(range(nROIs)))
+
+    # each block of traces is generated once: the series written first
+    # keeps the block of the other one in a temporary memory-mapped file
+    folder = tempfile.TemporaryDirectory()
+    stored, generated = {}, set()
+
+    def blocks(index):
+        # yields one ROI trace at a time, generating blocks of ROIs on demand
+        for b in range(0, nROIs, block_size):
+            e = min([b+block_size, nROIs])
+            if b in generated:
+                traces = stored[index][b:e]
+            else:
+                traces = generate_traces(truth, sequence, protocols, t,
+                                         np.arange(b, e), seed=seed)
+                if (1-index) not in stored:
+                    stored[1-index] = np.lib.format.open_memmap(os.path.join(folder.name, '%i.npy' % (1-index)),
+                                                                mode='w+', dtype=np.float32,
+                                                                shape=(nROIs, len(t)))
+                stored[1-index][b:e] = traces[1-index]
+                generated.add(b)
+                traces = traces[index]
+            for trace in traces:
+                yield np.array(trace)
+
+    for index, name in enumerate(['Fluorescence', 'Neuropil']):
+        fluorescence = Fluorescence(name=name)
+        ophys_module.add(fluorescence)
+        fluorescence.create_roi_response_series(name=name,
+                                                data=DataChunkIterator(data=blocks(index),
+                                                                       maxshape=(nROIs, len(t)),
+                                                                       dtype=np.dtype('float32')),
+                                                rois=rt_region,
+                                                unit='lumens',
+                                                timestamps=t)
+
+    try:
+        with pynwb.NWBHDF5IO(filename, 'w') as io:
+            io.write(nwbfile)
+    finally:
+        stored.clear()
+        folder.cleanup()
+
+    truth['sequence'] = sequence
+    truth['protocols'] = protocols
+    np.save(filename.replace('.nwb', '.ground-truth.npy'), truth)
+
+    return filename
+
+
+if __name__=='__main__':
+
+    import argparse
+
+    parser=argparse.ArgumentParser(description='writes a synthetic NWB session')
+
+    parser.add_argument("filename", type=str)
+    parser.add_argument("--nROIs", type=int, default=500)
+    parser.add_argument("--duration", type=float, default=30., help='in minutes')
+    parser.add_argument("--frame_rate", type=float, default=30.)
+    parser.add_argument("--protocols", nargs='*',
+                        default=['luminosity', 'ff-gratings-8orientation-2contrasts-10repeats'],
+                        help='among: %s' % ', '.join(PROTOCOLS.keys()))
+    parser.add_argument("--responsive_fraction", type=float, default=0.5)
+    parser.add_argument("--included_fraction", type=float, default=0.9)
+    parser.add_argument("--pref_angle", type=float, default=None, help='(degrees) of all ROIs, random if not set')
+    parser.add_argument("--kappa", type=float, default=None, help='orientation tuning sharpness, random if not set')
+    parser.add_argument("--amplitude", type=float, default=None, help='(dF/F) at the preferred angle, random if not set')
+    parser.add_argument("-s", "--seed", type=int, default=0)
+
+    args = parser.parse_args()
+
+    write_session(args.filename,
+                  nROIs=args.nROIs,
+                  duration=args.duration,
+                  frame_rate=args.frame_rate,
+                  protocols=args.protocols,
+                  responsive_fraction=args.responsive_fraction,
+                  included_fraction=args.included_fraction,
+                  pref_angle=args.pref_angle,
+                  kappa=args.kappa,
+                  amplitude=args.amplitude,
+                  seed=args.seed)
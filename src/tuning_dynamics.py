@@ -0,0 +1,86 @@
+"""
+time-resolved tuning: tuning curves in sliding windows along the response
+
+    windows = sliding_windows(tensor['t'], width=0.25, tstop=3)
+    dynamics = time_resolved_tuning(tensor, windows, key='angle')
+    dynamics['values'] # (windows x ROIs x angles)
+
+the episodes are processed by blocks of ROIs: one cumulative sum per block
+gives the means of all the windows, and the trial averages per parameter
+value are a single matrix product, so that only the
+(windows x ROIs x parameter values) output is kept in memory
+"""
+import numpy as np
+
+from episodes import cumulative_responses, window_slice
+from selectivity import vector_sum
+
+
+def sliding_windows(t,
+                    width=0.25,
+                    step=None,
+                    tstart=0,
+                    tstop=None):
+    """ [[t0, t0+width], ...] windows every `step` (default: width) seconds """
+    step = step or width
+    tstop = t[-1] if tstop is None else tstop
+    return [[float(t0), float(t0+width)] for t0 in np.arange(tstart, tstop-width+1e-9, step)]
+
+
+def time_resolved_tuning(tensor,
+                         windows,
+                         key='angle',
+                         interval_pre=[-1,0],
+                         contrast=1,
+                         episodes=None,
+                         roi_block=256):
+    """
+    trial-averaged evoked responses (window mean - pre-stimulus mean)
+    per value of the parameter `key`, for all the windows
+
+    tensor: episode tensor (see `episodes.build_episode_tensor`)
+    key: the varied parameter, e.g. 'angle' or 'radius' (size-tuning protocols)
+    contrast: restricts to the episodes of that contrast (if varied)
+    episodes: boolean mask for a further restriction (e.g. the preferred angle for size tuning)
+
+    returns a dictionary with:
+        'windows', 'centers', key : the parameter values
+        'values' : (windows x ROIs x parameter values)
+        for key='angle', the vector-sum 'OSI' and 'pref_orientation' (windows x ROIs)
+    """
+    episodes = np.ones(tensor['responses'].shape[0], dtype=bool) if episodes is None\
+                    else np.array(episodes, dtype=bool)
+    if ('contrast' in tensor) and (key!='contrast'):
+        episodes &= (tensor['contrast']==contrast)
+
+    parameter, labels = np.unique(tensor[key][episodes], return_inverse=True)
+    counts = np.bincount(labels, minlength=len(parameter))
+    # (parameter values x episodes) averaging matrix
+    A = (labels[np.newaxis,:]==np.arange(len(parameter))[:,np.newaxis])/counts[:,np.newaxis]
+
+    bounds = np.array([window_slice(tensor['t'], w) for w in windows]) # (windows x 2)
+    pre0, pre1 = window_slice(tensor['t'], interval_pre)
+
+    Nrois = tensor['responses'].shape[1]
+    values = np.zeros((len(windows), Nrois, len(parameter)))
+
+    for r0 in range(0, Nrois, roi_block):
+        r1 = min([r0+roi_block, Nrois])
+        C = cumulative_responses(tensor['responses'][episodes, r0:r1, :])
+        baseline = (C[...,pre1]-C[...,pre0])/(pre1-pre0)
+        # (episodes x ROIs x windows) window means
+        means = (C[...,bounds[:,1]]-C[...,bounds[:,0]])/(bounds[:,1]-bounds[:,0])
+        evoked = means-baseline[...,np.newaxis]
+        values[:,r0:r1,:] = np.tensordot(A, evoked, axes=(1,0)).transpose(2,1,0)
+
+    output = {'windows':np.array(windows),
+              'centers':np.mean(windows, axis=1),
+              key:parameter,
+              'values':values}
+
+    if key=='angle':
+        selectivity = [vector_sum(v, parameter) for v in values]
+        for q in ['OSI', 'pref_orientation']:
+            output[q] = np.array([s[q] for s in selectivity])
+
+    return output
@@ -0,0 +1,187 @@
+"""
+watches a folder of assembled NWB files and generates their Summary.pdf
+
+    python src/watch_folder.py ~/DATA/session5/Assembled --workers 2
+
+a file is considered complete when its size has not changed since the
+previous poll, it has not been modified for `stable_for` seconds and its
+header is a valid HDF5 signature,
+it is then queued and `pdf_lum_with_tuning.py` runs on it in a subprocess,
+at most `workers` at a time
+
+the outcomes are appended to `watch-log.jsonl` in the folder:
+    {'file', 'size', 'mtime', 'status' ('done', 'failed', 'timeout'),
+     'returncode', 'duration', 'stderr', 'time', 'attempt', 'gave_up'}
+files already done (with the same size and mtime) are not processed again,
+also after a restart of the watcher
+
+with `retry_failed`, a failed file is queued again at the next polls,
+at most `max_attempts` times per version of the file (size and mtime):
+the last failed attempt is recorded with 'gave_up': True
+"""
+import os, sys, time, json, pathlib, threading, subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+SCRIPT = str(pathlib.Path(__file__).resolve().parent/'pdf_lum_with_tuning.py')
+HDF5_SIGNATURE = b'\x89HDF\r\n\x1a\n'
+
+
+def has_hdf5_header(f):
+    """ the HDF5 signature (at 0, 512, 1024, ... bytes: the possible superblock offsets) """
+    try:
+        with open(f, 'rb') as io:
+            offset = 0
+            while True:
+                io.seek(offset)
+                head = io.read(len(HDF5_SIGNATURE))
+                if head==HDF5_SIGNATURE:
+                    return True
+                if len(head)<len(HDF5_SIGNATURE):
+                    return False
+                offset = 512 if offset==0 else 2*offset
+    except OSError:
+        return False
+
+
+def read_outcomes(logfile):
+    """ last outcome per file """
+    OUTCOMES = {}
+    if os.path.isfile(logfile):
+        with open(logfile) as io:
+            for line in io:
+                if line.strip():
+                    record = json.loads(line)
+                    OUTCOMES[record['file']] = record
+    return OUTCOMES
+
+
+def attempt_number(outcome, size, mtime):
+    """ number of the next attempt on a file, given its last outcome (1 for a new or modified file) """
+    if outcome is None or (outcome['size'], outcome['mtime'])!=(size, mtime):
+        return 1
+    return outcome.get('attempt', 1)+1
+
+
+def run_pdf(f,
+            timeout=3600,
+            args=[]):
+    """ `pdf_lum_with_tuning.py f` in a subprocess, returns the outcome record """
+    stat = os.stat(f)
+    tstart = time.time()
+    try:
+        process = subprocess.run([sys.executable, SCRIPT, f]+list(args),
+                                 capture_output=True, text=True, timeout=timeout,
+                                 cwd=pathlib.Path(SCRIPT).parent.parent) # the script imports from ./src
+        status = 'done' if process.returncode==0 else 'failed'
+        returncode, stderr = process.returncode, process.stderr
+    except subprocess.TimeoutExpired as error:
+        status, returncode = 'timeout', None
+        stderr = error.stderr.decode() if isinstance(error.stderr, bytes) else (error.stderr or '')
+    return dict(file=f, size=stat.st_size, mtime=stat.st_mtime,
+                status=status, returncode=returncode,
+                duration=time.time()-tstart,
+                stderr=stderr[-2000:], # the end of the traceback
+                time=time.strftime('%Y-%m-%d %H:%M:%S'))
+
+
+def watch(folder,
+          workers=1,
+          interval=30., # s
+          stable_for=120., # s
+          timeout=3600., # s, per file
+          retry_failed=False,
+          max_attempts=3, # per file, with retry_failed
+          once=False,
+          pdf_args=[],
+          verbose=True):
+    """
+    polls `folder` every `interval` seconds (a single pass if once=True)
+    """
+    logfile = os.path.join(folder, 'watch-log.jsonl')
+    OUTCOMES = read_outcomes(logfile)
+    seen = {} # file -> (size, mtime) at the last poll
+    running = {}
+    lock = threading.Lock()
+
+    def processed(f, stat):
+        outcome = OUTCOMES.get(f)
+        if outcome is None or (outcome['size'], outcome['mtime'])!=(stat.st_size, stat.st_mtime):
+            return False # new or modified file
+        return (outcome['status']=='done') or (not retry_failed) or outcome.get('gave_up', False)
+
+    def record(future, f):
+        outcome = future.result()
+        with lock:
+            outcome['attempt'] = attempt_number(OUTCOMES.get(f), outcome['size'], outcome['mtime'])
+            outcome['gave_up'] = retry_failed and (outcome['status']!='done') and\
+                                        (outcome['attempt']>=max_attempts)
+            OUTCOMES[f] = outcome
+            with open(logfile, 'a') as io:
+                io.write(json.dumps(outcome)+'\n')
+        if verbose:
+            print('[%s] %s: %s (%.0fs)' % (outcome['time'], outcome['status'], f, outcome['duration']),
+                  flush=True)
+            if outcome['gave_up']:
+                print('   giving up after %i attempts' % outcome['attempt'], flush=True)
+
+    pool = ThreadPoolExecutor(max_workers=max([1, workers])) # threads waiting on subprocesses
+    try:
+        while True:
+            now = time.time()
+            for f in sorted(str(p) for p in pathlib.Path(folder).glob('**/*.nwb')):
+                try:
+                    stat = os.stat(f)
+                except OSError:
+                    continue # removed in between
+                if (f in running) or processed(f, stat):
+                    continue
+                # complete: same size since the last poll and not modified for `stable_for`
+                unchanged = seen.get(f)==(stat.st_size, stat.st_mtime)
+                seen[f] = (stat.st_size, stat.st_mtime)
+                if (unchanged or once) and (now-stat.st_mtime>=stable_for) and has_hdf5_header(f):
+                    if verbose:
+                        print('[%s] queued: %s' % (time.strftime('%Y-%m-%d %H:%M:%S'), f), flush=True)
+                    running[f] = pool.submit(run_pdf, f, timeout=timeout, args=pdf_args)
+                    running[f].add_done_callback(lambda future, f=f: record(future, f))
+
+            for f in [f for f in running if running[f].done()]:
+                del running[f]
+
+            if once:
+                break
+            time.sleep(interval)
+
+    except KeyboardInterrupt:
+        if verbose:
+            print('stopping, waiting for the %i running jobs [...]' % len(running))
+    finally:
+        pool.shutdown(wait=True)
+
+
+if __name__=='__main__':
+
+    import argparse
+
+    parser=argparse.ArgumentParser(description='generates the Summary.pdf of the new NWB files of a folder')
+
+    parser.add_argument("folder", type=str)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--interval", type=float, default=30., help='polling interval (s)')
+    parser.add_argument("--stable_for", type=float, default=120.,
+                        help='duration (s) without size change before a file is complete')
+    parser.add_argument("--timeout", type=float, default=3600., help='per file (s)')
+    parser.add_argument("--retry_failed", action='store_true')
+    parser.add_argument("--max_attempts", type=int, default=3, help='per file, with --retry_failed')
+    parser.add_argument("--once", action='store_true',
+                        help='a single pass on the files of the folder (e.g. from a cron job)')
+
+    args = parser.parse_args()
+
+    watch(os.path.expanduser(args.folder),
+          workers=args.workers,
+          interval=args.interval,
+          stable_for=args.stable_for,
+          timeout=args.timeout,
+          retry_failed=args.retry_failed,
+          max_attempts=args.max_attempts,
+          once=args.once)
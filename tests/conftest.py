@@ -0,0 +1,78 @@
+import sys, pathlib
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent/'src'))
+
+from synthetic_data import stimulus_sequence, ground_truth, generate_traces
+from episodes import condition_index
+
+PROTOCOL = 'ff-gratings-8orientation-2contrasts-10repeats'
+
+
+class Series:
+    """ stand-in of a pynwb RoiResponseSeries (the arrays support the h5py hyperslab reads) """
+    def __init__(self, data, timestamps):
+        self.data, self.timestamps = data, timestamps
+
+
+class Session:
+    """ stand-in of the `physion` Data object, for the modules reading the ophys series """
+    def __init__(self, recording):
+        self.Fluorescence = Series(recording['rawFluo'], recording['t'])
+        self.Neuropil = Series(recording['neuropil'], recording['t'])
+        self.iscell = np.ones(len(recording['rawFluo']), dtype=bool)
+        self.filename = 'synthetic.nwb'
+
+
+def physion_episodes(tensor):
+    """
+    physion `EpisodeData` holding the episode tensor (without NWB file),
+    the test is skipped if physion can not be imported
+    """
+    from analysis import load_EpisodeData
+    try:
+        EpisodeData = load_EpisodeData()
+    except ImportError:
+        pytest.skip('physion is not available')
+    EPISODES = EpisodeData.__new__(EpisodeData)
+    EPISODES.t, EPISODES.quantities = tensor['t'], ['dFoF']
+    EPISODES.dFoF = tensor['responses']
+    EPISODES.varied_parameters = tensor['varied_parameters']
+    EPISODES.time_start = np.zeros(len(tensor['responses']))
+    for key in tensor['varied_parameters']:
+        setattr(EPISODES, key, tensor[key])
+    return EPISODES
+
+
+@pytest.fixture(scope='session')
+def recording():
+    """ in-memory synthetic recording: 60 ROIs, 12 min at 5Hz of the gratings protocol """
+    nROIs, frame_rate, duration = 60, 5., 12*60.
+    t = np.arange(int(duration*frame_rate))/frame_rate
+    sequence = stimulus_sequence([PROTOCOL], duration=duration, seed=1)
+    truth = ground_truth(nROIs, seed=1)
+    rawFluo, neuropil = generate_traces(truth, sequence, [PROTOCOL], t, np.arange(nROIs), seed=1)
+    return {'t':t, 'dt':1./frame_rate, 'sequence':sequence, 'truth':truth,
+            'rawFluo':rawFluo.astype(np.float64), 'neuropil':neuropil.astype(np.float64)}
+
+
+@pytest.fixture(scope='session')
+def tensor(recording):
+    """ episode tensor (see `episodes.episode_tensor`) of the dFoF of the synthetic recording """
+    from dfof import compute_dFoF
+
+    dFoF, _ = compute_dFoF(recording['rawFluo'], recording['neuropil'], recording['dt'],
+                           sliding_window=60)
+    t, sequence = recording['t'], recording['sequence']
+    t_episode = np.arange(-10, 21)*recording['dt'] # [-2, 4]s
+    i0 = np.searchsorted(t, sequence['time_start'])
+    keep = (i0-10>=0) & (i0+21<=len(t))
+
+    tensor = {'t':t_episode,
+              'responses':np.ascontiguousarray(np.stack([dFoF[:,i-10:i+21] for i in i0[keep]])),
+              'varied_parameters':{key:np.unique(sequence[key]) for key in ['angle', 'contrast']}}
+    for key in ['angle', 'contrast']:
+        tensor[key] = sequence[key][keep]
+    tensor['condition'], tensor['conditions'] = condition_index(tensor)
+    return tensor
@@ -0,0 +1,29 @@
+import numpy as np
+from scipy.spatial.distance import squareform
+
+from correlations import response_matrix, noise_correlations, signal_correlations
+
+
+def upper(M):
+    return M[np.triu_indices(len(M), k=1)]
+
+
+def test_noise_correlations(tensor):
+    X, condition = response_matrix(tensor, [1,2])
+    conds, n = np.unique(condition, return_counts=True)
+    # reference: trial-weighted average of the per-condition correlation matrices
+    reference = sum(w*np.corrcoef(X[condition==c].T) for c, w in zip(conds, n/n.sum()))
+
+    # blocks smaller than the number of ROIs, not dividing it
+    output = noise_correlations(tensor, interval=[1,2], per_condition=True, block_size=16)
+    np.testing.assert_allclose(output['pairs'], upper(reference), atol=1e-5)
+    np.testing.assert_allclose(output['per_condition'][3], upper(np.corrcoef(X[condition==conds[3]].T)),
+                               atol=1e-5)
+    np.testing.assert_allclose(squareform(output['pairs'])+np.eye(X.shape[1]), reference, atol=1e-5)
+
+
+def test_signal_correlations(tensor):
+    X, condition = response_matrix(tensor, [1,2])
+    means = np.array([X[condition==c].mean(axis=0) for c in np.unique(condition)])
+    np.testing.assert_allclose(signal_correlations(tensor, interval=[1,2], block_size=16),
+                               upper(np.corrcoef(means.T)), atol=1e-5)
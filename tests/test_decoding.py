@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from decoding import decoding_data, stratified_folds, nearest_centroid_cv, ridge_cv
+
+
+def per_fold(X, labels, fold, fit_predict):
+    """ reference: each fold trained and tested on its own """
+    prediction = np.zeros(len(X), dtype=int)
+    for k in np.unique(fold):
+        test = (fold==k)
+        prediction[test] = fit_predict(X[~test], labels[~test], X[test])
+    return prediction
+
+
+def nearest_centroid(Xtrain, ytrain, Xtest):
+    centroids = np.array([Xtrain[ytrain==c].mean(axis=0) for c in range(ytrain.max()+1)])
+    return np.argmin(((Xtest[:,np.newaxis,:]-centroids[np.newaxis])**2).sum(axis=2), axis=1)
+
+
+def ridge(alpha):
+    def fit_predict(Xtrain, ytrain, Xtest):
+        Xa = np.concatenate([Xtrain, np.ones((len(Xtrain), 1))], axis=1)
+        Y = (ytrain[:,np.newaxis]==np.arange(ytrain.max()+1)).astype(float)
+        W = np.linalg.solve(Xa.T @ Xa+alpha*np.eye(Xa.shape[1]), Xa.T @ Y)
+        return np.argmax(np.concatenate([Xtest, np.ones((len(Xtest), 1))], axis=1) @ W, axis=1)
+    return fit_predict
+
+
+@pytest.fixture(scope='module')
+def decoding_set(tensor):
+    X, y = decoding_data(tensor, interval_pre=[-1,0], interval_post=[1,2])
+    labels = np.unique(y, return_inverse=True)[1].ravel()
+    return X, labels, stratified_folds(labels, K=5, seed=1)
+
+
+def test_nearest_centroid(decoding_set):
+    X, labels, fold = decoding_set
+    np.testing.assert_array_equal(nearest_centroid_cv(X, labels, fold),
+                                  per_fold(X, labels, fold, nearest_centroid))
+
+
+@pytest.mark.parametrize('dual', [False, True])
+def test_ridge(decoding_set, dual):
+    X, labels, fold = decoding_set
+    if dual: # more ROIs than samples
+        X = np.concatenate([X, X**2], axis=1)
+    assert (X.shape[1]+1>len(X))==dual
+    np.testing.assert_array_equal(ridge_cv(X, labels, fold, alpha=0.1),
+                                  per_fold(X, labels, fold, ridge(0.1)))
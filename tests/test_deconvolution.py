@@ -0,0 +1,85 @@
+import tempfile
+import numpy as np
+from scipy.linalg import cholesky_banded, cho_solve_banded
+
+from deconvolution import ar_coefficients, apply_D, banded_system, deconvolve, episode_quantity
+
+
+def dense_D(g, T):
+    D = np.eye(T)
+    for k, gk in enumerate(g):
+        D -= gk*np.eye(T, k=-k-1)
+    return D
+
+
+def ar1_traces(nROIs=20, T=3000, dt=1/30., rate=0.5, noise=0.1, seed=0):
+    """ AR(1) calcium traces of sparse unit spikes (rate in Hz) with a baseline and white noise """
+    rng = np.random.default_rng(seed)
+    g = ar_coefficients(dt)
+    spikes = (rng.uniform(size=(nROIs, T))<rate*dt).astype(float)
+    calcium = np.zeros((nROIs, T))
+    for i in range(T):
+        calcium[:,i] = spikes[:,i]+(g[0]*calcium[:,i-1] if i>0 else 0)
+    baseline = rng.uniform(0, 0.5, size=(nROIs, 1))
+    return baseline+calcium+noise*rng.normal(size=(nROIs, T)), spikes, baseline[:,0], g
+
+
+def test_banded_solve_equals_dense_solve():
+    T, rho = 50, 1.7
+    rhs = np.random.default_rng(0).normal(size=(T, 3))
+    for g in [ar_coefficients(0.1), ar_coefficients(0.1, tau_rise=0.2)]:
+        D = dense_D(g, T)
+        np.testing.assert_allclose(apply_D(rhs, g), D @ rhs)
+        A = np.eye(T)+rho*D.T @ D
+        factor = cholesky_banded(banded_system(g, T, rho=rho))
+        np.testing.assert_allclose(cho_solve_banded((factor, False), rhs),
+                                   np.linalg.solve(A, rhs), atol=1e-10)
+
+
+def test_ar1_spikes_are_recovered():
+    Y, spikes, baseline, g = ar1_traces()
+    S, B = deconvolve(Y, g, roi_block=8)
+    assert np.all(S>=0)
+    # spike counts in 100ms bins (the l1 penalty may shift a spike by a frame)
+    binned = lambda x: x.reshape(len(x), -1, 3).sum(axis=-1)
+    r = [np.corrcoef(s, k)[0,1] for s, k in zip(binned(S), binned(spikes))]
+    assert np.min(r)>0.95
+    # the activity is sparse: zero between the spikes
+    assert np.median(S[binned(spikes).repeat(3, axis=1)==0])<1e-3
+    # the baseline converges more slowly than the spike times
+    S, B = deconvolve(Y, g, roi_block=8, Niter=1000, tol=1e-6)
+    np.testing.assert_allclose(B, baseline, atol=0.02)
+    np.testing.assert_allclose(S.sum(axis=1), spikes.sum(axis=1), rtol=0.1)
+
+
+def test_threads_give_the_same_result():
+    Y, _, _, g = ar1_traces(nROIs=10, T=500)
+    S1, B1 = deconvolve(Y, g, roi_block=3, Nthreads=1)
+    S2, B2 = deconvolve(Y, g, roi_block=3, Nthreads=3)
+    np.testing.assert_array_equal(S1, S2)
+    np.testing.assert_array_equal(B1, B2)
+
+
+class Data:
+    def __init__(self, dFoF, dt):
+        self.dFoF, self.t_dFoF = dFoF, np.arange(dFoF.shape[1])*dt
+        self.filename = 'synthetic.nwb'
+
+
+def test_episode_quantity_follows_dFoF(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path)) # cache of the deconvolution
+    Y, _, _, _ = ar1_traces(nROIs=4, T=600)
+    data = Data(Y, 1/30.)
+    with episode_quantity(data, 'deconvolved') as q:
+        assert q=='dFoF'
+        first = data.dFoF.copy()
+    assert data.dFoF is Y # restored
+
+    # build_dFoF rerun (e.g. other arguments): the deconvolution follows
+    data.dFoF = 2*Y
+    with episode_quantity(data, 'deconvolved'):
+        second = data.dFoF.copy()
+    assert not np.allclose(first, second)
+    data.dFoF = Y
+    with episode_quantity(data, 'deconvolved'):
+        np.testing.assert_array_equal(data.dFoF, first)
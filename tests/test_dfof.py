@@ -0,0 +1,43 @@
+import os
+import numpy as np
+import pytest
+
+from dfof import compute_dFoF, build_dFoF_streaming
+from conftest import Session
+
+
+@pytest.mark.parametrize('layout', ['roi-major', 'time-major'])
+def test_streaming_equals_in_memory(recording, tmp_path, layout):
+    dFoF, valid = compute_dFoF(recording['rawFluo'], recording['neuropil'], recording['dt'],
+                               sliding_window=60)
+
+    session = Session(recording)
+    if layout=='time-major':
+        for series in [session.Fluorescence, session.Neuropil]:
+            series.data = np.ascontiguousarray(series.data.T)
+    # chunks much shorter than the recording (and than the F0 window)
+    build_dFoF_streaming(session, sliding_window=60, chunk_duration=50,
+                         filename=str(tmp_path/'dFoF.npy'), verbose=False)
+
+    np.testing.assert_array_equal(session.valid_roiIndices, valid)
+    np.testing.assert_allclose(session.dFoF, dFoF, rtol=0, atol=1e-12)
+
+
+def test_unsupported_options_are_rejected(recording, tmp_path):
+    with pytest.raises(ValueError):
+        compute_dFoF(recording['rawFluo'], recording['neuropil'], recording['dt'],
+                     method_for_F0='sliding_minmax')
+    with pytest.raises(ValueError):
+        build_dFoF_streaming(Session(recording), with_correctedFluo_and_F0=True,
+                             filename=str(tmp_path/'dFoF.npy'), verbose=False)
+
+
+def test_default_memmap_is_temporary(recording):
+    sessions = [Session(recording), Session(recording)]
+    for session in sessions:
+        build_dFoF_streaming(session, sliding_window=60, chunk_duration=50, verbose=False)
+    # two runs on the same session do not share their file, none is left on disk
+    assert sessions[0].dFoF.filename!=sessions[1].dFoF.filename
+    for session in sessions:
+        assert not os.path.exists(session.dFoF.filename)
+    np.testing.assert_array_equal(sessions[0].dFoF, sessions[1].dFoF)
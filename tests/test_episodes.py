@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from episodes import window_slice
+from responsiveness import pvalue_summary, significant
+from conftest import physion_episodes
+
+
+def test_window_slice_is_closed(tensor):
+    t = tensor['t'] # frame-aligned: the bounds are samples
+    for interval in [[-1,0], [-1.5,0], [1,2], [1,2.5], [-0.9,0.1]]:
+        i0, i1 = window_slice(t, interval)
+        np.testing.assert_array_equal(np.arange(len(t))[i0:i1],
+                                      np.flatnonzero((t>=interval[0]) & (t<=interval[1])))
+
+
+@pytest.mark.parametrize('test', ['ttest', 'anova'])
+def test_pvalue_summary_equals_compute_summary_data(tensor, test):
+    EPISODES = physion_episodes(tensor)
+    props = dict(interval_pre=[-1,0], interval_post=[1,2], test=test, positive=True)
+    summary = pvalue_summary(tensor, stat_test_props=props)
+    signif = significant(summary, threshold=0.01, positive=True)
+
+    for roi in range(tensor['responses'].shape[1]):
+        cell_resp = EPISODES.compute_summary_data(props,
+                                response_significance_threshold=0.01,
+                                response_args=dict(quantity='dFoF', roiIndex=roi),
+                                verbose=False)
+        np.testing.assert_allclose(cell_resp['value'], summary['value'][roi], rtol=1e-10)
+        np.testing.assert_allclose(cell_resp['std-value'], summary['std-value'][roi], rtol=1e-10)
+        np.testing.assert_array_equal(cell_resp['significant'], signif[roi])
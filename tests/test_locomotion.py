@@ -0,0 +1,47 @@
+import numpy as np
+
+from locomotion import evoked_responses, running_modulation, sensitivity_curves
+
+
+def running_tensor(tensor, gain=1., modulated=10, seed=0):
+    """ the episode tensor with a random running speed, the evoked responses of
+    the first `modulated` ROIs being scaled by 1+gain on running episodes """
+    rng = np.random.default_rng(seed)
+    speed = rng.exponential(1., size=len(tensor['responses']))
+    responses = tensor['responses'].copy()
+    post = tensor['t']>=0
+    responses[speed>0.5, :modulated, :] += gain*(responses[speed>0.5, :modulated, :]*post+\
+                                                 0.5*post) # a larger evoked response
+    return dict(tensor, responses=responses, running_speed=speed)
+
+
+def test_run_still_means(tensor):
+    T = running_tensor(tensor)
+    output = running_modulation(T, thresholds=[0.5, 1.], Npermutations=20)
+    X = evoked_responses(T)
+    for i, threshold in enumerate([0.5, 1.]):
+        for c in [0, 7]:
+            run = (T['condition']==c) & (T['running_speed']>threshold)
+            still = (T['condition']==c) & ~(T['running_speed']>threshold)
+            assert output['n_run'][i,c]==run.sum() and output['n_still'][i,c]==still.sum()
+            np.testing.assert_allclose(output['run'][i,:,c], X[run].mean(axis=0))
+            np.testing.assert_allclose(output['still'][i,:,c], X[still].mean(axis=0))
+
+
+def test_modulated_rois_are_detected(tensor):
+    output = running_modulation(running_tensor(tensor, modulated=10),
+                                thresholds=[0.5], Npermutations=200)
+    curves_modulated = sensitivity_curves(output, rois=np.arange(10))
+    curves_other = sensitivity_curves(output, rois=np.arange(10, tensor['responses'].shape[1]))
+    assert curves_modulated['fraction_modulated'][0]>0.8
+    assert curves_other['fraction_modulated'][0]<0.15
+    assert curves_modulated['mean_modulation_index'][0]>curves_other['mean_modulation_index'][0]+0.2
+    # permutation p-values: within [1/(N+1), 1]
+    assert np.all((output['pvalue']>=1/201) & (output['pvalue']<=1))
+
+
+def test_empty_split_gives_nan(tensor):
+    # no episode above the threshold
+    output = running_modulation(running_tensor(tensor), thresholds=[1e9], Npermutations=10)
+    assert np.all(output['n_run']==0)
+    assert np.all(np.isnan(output['modulation_index'])) and np.all(output['pvalue']==1.)
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from online import OnlineTuning, replay_stream, condition_grid, episode_message, read_message
+from episodes import cumulative_responses, window_mean
+from responsiveness import evoked_stats
+from analysis import selectivity_index
+
+
+@pytest.mark.parametrize('test', ['ttest', 'anova'])
+def test_online_equals_evoked_stats(tensor, test):
+    online = OnlineTuning(tensor['responses'].shape[1], tensor['conditions'], test=test)
+    for episode in replay_stream(tensor, interval_pre=[-1,0], interval_post=[1,2]):
+        # through the json messages of the file and socket streams
+        episode = read_message(episode_message(**episode))
+        online.update(episode['pre'], episode['post'], episode['parameters'])
+
+    C = cumulative_responses(tensor['responses'])
+    reference = evoked_stats(window_mean(C, tensor['t'], [-1,0]), window_mean(C, tensor['t'], [1,2]),
+                             tensor['condition'], test=test)
+    summary = online.summary()
+    np.testing.assert_array_equal(summary['ntrials'], reference['ntrials'])
+    for key in ['value', 'std-value', 'pvalue']:
+        np.testing.assert_allclose(summary[key], reference[key], rtol=1e-9, atol=1e-12)
+
+
+def test_online_selectivity_index(tensor):
+    online = OnlineTuning(tensor['responses'].shape[1], tensor['conditions'])
+    for episode in replay_stream(tensor):
+        online.update(episode['pre'], episode['post'], episode['parameters'])
+
+    tuning = online.tuning(contrast=1)
+    cond = (tensor['conditions']['contrast']==1)
+    values = online.summary()['value'][:,cond]
+    np.testing.assert_allclose(tuning['SI'],
+                               [selectivity_index(tensor['conditions']['angle'][cond], v) for v in values])
+
+
+def test_condition_grid(tensor):
+    conditions = condition_grid(tensor['varied_parameters'])
+    for key in tensor['conditions']:
+        np.testing.assert_array_equal(conditions[key], tensor['conditions'][key])
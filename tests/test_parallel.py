@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+from responsiveness import pvalue_summary
+from parallel import parallel_pvalue_summary
+from prefetch import prefetch_sessions
+
+
+@pytest.mark.parametrize('test', ['ttest', 'anova'])
+def test_parallel_equals_pvalue_summary(tensor, test):
+    props = dict(interval_pre=[-1,0], interval_post=[1,2], test=test, positive=True)
+    reference = pvalue_summary(tensor, stat_test_props=props)
+    summary = parallel_pvalue_summary(tensor, stat_test_props=props, Nproc=2, block_size=7)
+    for key in ['value', 'std-value', 'pvalue', 'ntrials']:
+        np.testing.assert_allclose(summary[key], reference[key], rtol=1e-10, atol=1e-14)
+
+
+def test_parallel_during_a_prefetch(tensor):
+    # the workers are spawned: forking while the prefetch thread holds locks could deadlock them
+    props = dict(interval_pre=[-1,0], interval_post=[1,2], test='ttest', positive=True)
+    reference = pvalue_summary(tensor, stat_test_props=props)
+    for f, data in prefetch_sessions(['a', 'b', 'c'], load=lambda f: tensor):
+        summary = parallel_pvalue_summary(data, stat_test_props=props, Nproc=2)
+        np.testing.assert_allclose(summary['pvalue'], reference['pvalue'], rtol=1e-10, atol=1e-14)
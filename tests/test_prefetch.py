@@ -0,0 +1,62 @@
+import time, threading
+import pytest
+
+from prefetch import prefetch_sessions
+
+
+class Loader:
+    """ sessions that count how many of them are alive """
+
+    def __init__(self, duration=0.02, failing=None):
+        self.duration, self.failing = duration, failing
+        self.alive, self.peak, self.loaded = 0, 0, []
+        self.lock = threading.Lock()
+
+    def __call__(self, f):
+        time.sleep(self.duration)
+        if f==self.failing:
+            raise IOError('cannot read "%s"' % f)
+        return Session(self, f)
+
+
+class Session:
+
+    def __init__(self, loader, f):
+        self.loader = loader
+        with loader.lock:
+            loader.alive += 1
+            loader.peak = max([loader.peak, loader.alive])
+            loader.loaded.append(f)
+
+    def __del__(self):
+        with self.loader.lock:
+            self.loader.alive -= 1
+
+
+@pytest.mark.parametrize('depth', [1, 2])
+def test_prefetch_caps_the_sessions_in_memory(depth):
+    load = Loader()
+    FILES = ['session-%i.nwb' % i for i in range(8)]
+    output = []
+    for f, data in prefetch_sessions(FILES, load=load, depth=depth):
+        time.sleep(0.05) # analysis slower than the loads: the prefetch runs ahead
+        output.append(f)
+    assert output==FILES
+    assert load.peak==depth+1
+
+
+def test_prefetch_raises_at_the_failing_session():
+    load = Loader(failing='session-2.nwb')
+    output = []
+    with pytest.raises(IOError):
+        for f, data in prefetch_sessions(['session-%i.nwb' % i for i in range(5)], load=load):
+            output.append(f)
+    assert output==['session-0.nwb', 'session-1.nwb']
+
+
+def test_prefetch_stops_when_the_loop_is_left():
+    load = Loader()
+    for f, data in prefetch_sessions(['session-%i.nwb' % i for i in range(20)], load=load):
+        break
+    time.sleep(0.3)
+    assert len(load.loaded)<=3
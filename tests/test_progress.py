@@ -0,0 +1,56 @@
+import io, json
+import numpy as np
+import pytest
+
+from progress import Progress, track, format_duration, fit_cost_model, predict, predict_sweep
+
+
+def write_log(tmp_path, timings):
+    """ profiling log of (file size in bytes, stage, wall time) records, and the files """
+    FILES, records = {}, []
+    for nbytes, stage, wall_time in timings:
+        if nbytes not in FILES:
+            FILES[nbytes] = tmp_path/('session-%i.nwb' % nbytes)
+            FILES[nbytes].write_bytes(b'0'*nbytes) # not an HDF5 file: the cost is its size
+        records.append({'session':str(FILES[nbytes]), 'stage':stage, 'wall_time':wall_time})
+    logfile = tmp_path/'profile.jsonl'
+    logfile.write_text(''.join(json.dumps(r)+'\n' for r in records))
+    return str(logfile), {n:str(f) for n, f in FILES.items()}
+
+
+def test_fit_cost_model(tmp_path):
+    logfile, FILES = write_log(tmp_path, [(n, 'read', 0.5+1e-3*n) for n in [100, 200, 400]]+\
+                                         [(200, 'build_dFoF', 2.), (200, 'build_dFoF', 4.)]+\
+                                         [(0, 'EpisodeData', 1.5)])
+    model = fit_cost_model(logfile)
+    np.testing.assert_allclose(model['read'], (0.5, 1e-3))
+    # a single size: proportional to it, or a constant for an empty file (no division by zero)
+    np.testing.assert_allclose(model['build_dFoF'], (0., 3./200))
+    np.testing.assert_allclose(model['EpisodeData'], (1.5, 0.))
+    assert np.isnan(predict(model, 'stat_tests', 100))
+
+    prediction = predict_sweep({'grid':[{'threshold':[0.05, 0.01]}]}, model,
+                               FILES=[FILES[100], FILES[400], FILES[200]], Nproc=2)
+    per_file = [0.6+1.5+1.5, 0.9+6+1.5, 0.7+3+1.5]
+    np.testing.assert_allclose(prediction['per_file'], per_file)
+    assert prediction['missing']==['stat_tests']
+    # the longest session alone, the two others on the second process
+    np.testing.assert_allclose(prediction['wall'], max([per_file[1], per_file[0]+per_file[2]]))
+
+
+def test_progress_eta():
+    stream = io.StringIO()
+    progress = Progress(3, costs=[1, 2, 1], stream=stream)
+    progress.step()
+    assert progress.fraction()==0.25
+    progress.step(nROIs=100)
+    assert progress.fraction()==0.75
+    assert '[2/3 sessions, 75%]' in stream.getvalue().splitlines()[-1]
+    assert format_duration(3725)=='1h02m' and format_duration(65)=='1m05s' and format_duration(np.inf)=='?'
+
+
+def test_track_counts_an_item_once_the_next_is_requested(capsys):
+    for i, item in enumerate(track(['a', 'b'])):
+        # the report of the previous item is printed, not the one of the current item
+        assert capsys.readouterr().out.count('sessions')==min([i, 1])
+    assert '[2/2 sessions, 100%]' in capsys.readouterr().out
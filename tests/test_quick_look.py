@@ -0,0 +1,54 @@
+import numpy as np
+
+from conftest import Session
+from dfof import compute_dFoF
+from quick_look import build_roi_subset, sample_sessions, subsample_tensor, hierarchical_bootstrap
+
+BUILD_ARGS = dict(roi_to_neuropil_fluo_inclusion_factor=1.15, sliding_window=60)
+
+
+def test_dFoF_subset_is_the_full_run_dFoF(recording):
+    dFoF, valid = compute_dFoF(recording['rawFluo'], recording['neuropil'], recording['dt'], **BUILD_ARGS)
+    excluded = np.setdiff1d(np.arange(len(recording['rawFluo'])), valid)
+    assert len(excluded)>0
+    rois = np.sort(np.concatenate([valid[::3], excluded]))
+
+    data = build_roi_subset(Session(recording), rois, quantity='dFoF', **BUILD_ARGS)
+    # the excluded ROIs are dropped, the others have the dFoF (same F0) of the full run
+    np.testing.assert_array_equal(data.valid_roiIndices, valid[::3])
+    np.testing.assert_allclose(data.dFoF, dFoF[::3], rtol=1e-9, atol=1e-12)
+
+
+def test_raw_subset_without_inclusion_criterion(recording):
+    rois = np.arange(0, 60, 4)
+    for quantity in ['rawFluo', 'neuropil']:
+        data = build_roi_subset(Session(recording), rois, quantity=quantity, **BUILD_ARGS)
+        np.testing.assert_array_equal(data.valid_roiIndices, rois)
+        np.testing.assert_array_equal(getattr(data, quantity), recording[quantity][rois])
+
+
+def test_sample_sessions_spread_over_subjects():
+    FILES = ['f%i' % i for i in range(12)]
+    subjects = np.repeat(['m1', 'm2', 'm3', 'm4'], 3)
+    chosen = sample_sessions(FILES, subjects=subjects, fraction=1/3., seed=1)
+    assert len(chosen)==4
+    assert sorted(subjects[[FILES.index(f) for f in chosen]])==['m1', 'm2', 'm3', 'm4']
+
+
+def test_subsample_tensor(tensor):
+    sub = subsample_tensor(tensor, roi_fraction=0.5, episode_fraction=0.5, seed=2)
+    Nrois = tensor['responses'].shape[1]
+    assert sub['responses'].shape[1]==round(0.5*Nrois)==len(sub['roi_indices'])
+    counts, sub_counts = np.bincount(tensor['condition']), np.bincount(sub['condition'])
+    np.testing.assert_array_equal(sub_counts, np.maximum(3, np.round(0.5*counts)))
+
+
+def test_hierarchical_bootstrap():
+    rng = np.random.default_rng(0)
+    # sessions with different means: the session level dominates the error bars
+    sessions = [rng.normal(m, 1., size=(50, 2)) for m in rng.normal(0, 1., size=8)]
+    boot = hierarchical_bootstrap(sessions, Nboot=500)
+    np.testing.assert_allclose(boot['mean'], np.concatenate(sessions).mean(axis=0))
+    assert np.all(boot['ci'][0]<boot['mean']) and np.all(boot['mean']<boot['ci'][1])
+    # wider than the bootstrap of the pooled ROIs (~1/sqrt(400))
+    assert np.all(boot['std']>2/np.sqrt(400))
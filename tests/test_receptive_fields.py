@@ -0,0 +1,44 @@
+import numpy as np
+
+from receptive_fields import response_maps, gaussian_2d, fit_gaussians
+
+X_POS, Y_POS = np.arange(-40, 41, 10.), np.arange(-20, 21, 10.)
+
+
+def test_fit_gaussians_recovers_known_centers():
+    rng = np.random.default_rng(0)
+    nROIs = 50
+    truth = np.array([rng.uniform(0.5, 2., nROIs),              # amplitude
+                      rng.uniform(-30, 30, nROIs),              # x0
+                      rng.uniform(-15, 15, nROIs),              # y0
+                      np.log(rng.uniform(8, 15, nROIs)),        # log_sx
+                      np.log(rng.uniform(8, 15, nROIs)),        # log_sy
+                      rng.uniform(-0.1, 0.1, nROIs)]).T         # offset
+    X, Y = np.meshgrid(X_POS, Y_POS)
+    maps = gaussian_2d(truth, X.ravel()[np.newaxis,:], Y.ravel()[np.newaxis,:])
+    maps = maps.reshape(nROIs, len(Y_POS), len(X_POS))
+
+    fit = fit_gaussians(maps, X_POS, Y_POS, Niter=100)
+    np.testing.assert_allclose(fit['x0'], truth[:,1], atol=0.1)
+    np.testing.assert_allclose(fit['y0'], truth[:,2], atol=0.1)
+    np.testing.assert_allclose(fit['sx'], np.exp(truth[:,3]), rtol=0.01)
+    assert np.all(fit['residual']<1e-4)
+
+    # with noise and a missing position: centers within a fraction of the grid step
+    noisy = maps+0.05*rng.normal(size=maps.shape)
+    noisy[:,0,0] = np.nan
+    fit = fit_gaussians(noisy, X_POS, Y_POS)
+    assert np.median(np.hypot(fit['x0']-truth[:,1], fit['y0']-truth[:,2]))<2.
+    assert np.median(fit['residual'])<0.1
+
+
+def test_response_maps():
+    # two repeats of each position, the response of ROI r at position p: r+p
+    t = np.arange(-10, 21)*0.2
+    x, y = np.meshgrid(X_POS[:3], Y_POS[:2])
+    x, y = np.tile(x.ravel(), 2), np.tile(y.ravel(), 2)
+    responses = np.zeros((len(x), 4, len(t)))
+    responses[:,:,t>0] = (np.arange(4)[np.newaxis,:]+np.tile(np.arange(6), 2)[:,np.newaxis])[:,:,np.newaxis]
+    RF = response_maps({'t':t, 'responses':responses, 'x-center':x, 'y-center':y})
+    np.testing.assert_array_equal(RF['x'], X_POS[:3])
+    np.testing.assert_allclose(RF['maps'][2], 2+np.arange(6).reshape(2, 3))
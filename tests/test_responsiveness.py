@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from responsiveness import pvalue_summary, screened_pvalue_summary, responsive_at, compare_to_per_cell
+from conftest import physion_episodes
+
+
+@pytest.mark.parametrize('test', ['ttest', 'anova', 'wilcoxon'])
+def test_screen_keeps_the_responsive_rois(tensor, test):
+    props = dict(interval_pre=[-1,0], interval_post=[1,2], test=test, positive=True)
+    full = pvalue_summary(tensor, stat_test_props=props)
+    screened = screened_pvalue_summary(tensor, stat_test_props=props, threshold=0.05)
+    if test!='wilcoxon': # only the sign is screened for the wilcoxon test
+        assert screened['candidates'].sum()<len(screened['candidates'])
+
+    for threshold in [0.05, 0.01, 1e-3]:
+        for correction in [None, 'bonferroni', 'fdr_bh']:
+            reference = responsive_at(full, threshold=threshold, correction=correction)
+            output = responsive_at(screened, threshold=threshold, correction=correction)
+            np.testing.assert_array_equal(output['responsive'], reference['responsive'])
+            np.testing.assert_array_equal(output['RESPONSES'], reference['RESPONSES'])
+
+
+def test_screened_summary_refuses_what_it_cannot_answer(tensor):
+    props = dict(interval_pre=[-1,0], interval_post=[1,2], test='ttest', positive=True)
+    screened = screened_pvalue_summary(tensor, stat_test_props=props, threshold=0.01)
+    with pytest.raises(ValueError):
+        responsive_at(screened, threshold=0.05)
+    with pytest.raises(ValueError):
+        responsive_at(screened, threshold=0.01, correction='fdr_bh', axis=None)
+
+
+@pytest.mark.parametrize('test', ['ttest', 'anova'])
+@pytest.mark.parametrize('contrast', [0.5, 1])
+def test_responsive_at_equals_per_cell_summaries(tensor, test, contrast):
+    props = dict(interval_pre=[-1,0], interval_post=[1,2], test=test, positive=True)
+    comparison = compare_to_per_cell(physion_episodes(tensor), stat_test_props=props,
+                                     response_significance_threshold=0.05, contrast=contrast)
+    assert comparison['agree'], comparison
+
+
+@pytest.mark.parametrize('test', ['ttest', 'anova'])
+@pytest.mark.parametrize('contrast', [0.5, 1])
+def test_screened_tuning_response_per_cells(tensor, test, contrast):
+    from analysis import tuning_response_per_cells
+    props = dict(interval_pre=[-1.5,0], interval_post=[1,2.5], test=test, positive=True)
+    EPISODES = physion_episodes(tensor)
+    nROIs = tensor['responses'].shape[1]
+
+    calls = []
+    summary = EPISODES.compute_summary_data
+    def counted(*args, **kwargs):
+        calls.append(kwargs['response_args']['roiIndex'])
+        return summary(*args, **kwargs)
+    EPISODES.compute_summary_data = counted
+
+    outputs = [tuning_response_per_cells(EPISODES, 'dFoF', nROIs, stat_test_props=props,
+                                         response_significance_threshold=0.01, contrast=contrast,
+                                         with_screen=with_screen) for with_screen in [False, True]]
+    # the screen skips the ROIs that can not be responsive, same output
+    assert len(calls)-nROIs<nROIs
+    assert outputs[0][1]==outputs[1][1]
+    np.testing.assert_array_equal(outputs[0][0], outputs[1][0])
+    np.testing.assert_array_equal(outputs[0][2], outputs[1][2])
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from selectivity import vector_sum, bootstrap_preferred_angle
+
+ANGLES = np.arange(8)*22.5
+
+
+def test_vector_sum_single_peak():
+    R = np.zeros((3, 8))
+    R[0,0], R[1,2], R[2,4] = 1., 2., 0.5 # one-hot at 0, 45 and 90 degrees
+    output = vector_sum(R, ANGLES)
+    np.testing.assert_allclose(output['OSI'], 1.)
+    np.testing.assert_allclose(output['circular_variance'], 0., atol=1e-12)
+    np.testing.assert_allclose(output['pref_orientation'], [0., 45., 90.], atol=1e-9)
+    # angles within 180 degrees: no direction
+    assert np.all(np.isnan(output['DSI']))
+
+
+def test_vector_sum_untuned_and_negative():
+    output = vector_sum(np.array([np.ones(8), -np.ones(8)]), ANGLES)
+    np.testing.assert_allclose(output['OSI'], 0., atol=1e-12)
+
+
+def test_vector_sum_direction():
+    angles = np.arange(8)*45.
+    output = vector_sum(np.eye(8)[[2]], angles)
+    np.testing.assert_allclose(output['DSI'], 1.)
+    np.testing.assert_allclose(output['pref_direction'], 90., atol=1e-9)
+
+
+def test_bootstrap_ci_shrinks_with_the_signal_to_noise_ratio():
+    rng = np.random.default_rng(0)
+    angle = np.repeat(ANGLES, 20)
+    tuning = np.exp(2*(np.cos(np.deg2rad(2*(angle-45.)))-1)) # preferred orientation: 45
+    widths = []
+    for amplitude in [0.5, 1., 2., 4.]:
+        evoked = amplitude*tuning[:,np.newaxis]+rng.standard_normal((len(angle), 50))
+        boot = bootstrap_preferred_angle(evoked, angle, N=500, seed=1)
+        widths.append(np.median(boot['ci_width']))
+        deviation = (boot['pref']-45.+90.)%180.-90.
+        assert np.median(np.abs(deviation))<np.median(boot['ci_width'])
+    assert np.all(np.diff(widths)<0), widths
+
+
+def test_bootstrap_direction_needs_360_degrees():
+    with pytest.raises(ValueError):
+        bootstrap_preferred_angle(np.zeros((16, 2)), np.repeat(ANGLES[:2], 8), domain='direction')
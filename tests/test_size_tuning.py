@@ -0,0 +1,98 @@
+import types
+import numpy as np
+import pytest
+
+from conftest import physion_episodes
+from synthetic_data import stimulus_sequence, ground_truth, generate_traces
+from episodes import condition_index
+from size_tuning import size_tuning, ragged_to_dense, session_means
+
+PROTOCOLS = ['size-tuning-protocol-loc', 'size-tuning-protocol-dep']
+
+
+@pytest.fixture(scope='module')
+def size_tensors():
+    """
+    episode tensors of the two size-tuning protocols of a synthetic recording
+    (40 ROIs, 26 min at 5Hz), all ROIs preferring the angle 0
+    """
+    from dfof import compute_dFoF
+
+    nROIs, dt, duration = 40, 0.2, 26*60.
+    t = np.arange(int(duration/dt))*dt
+    sequence = stimulus_sequence(PROTOCOLS, duration=duration, seed=3)
+    truth = ground_truth(nROIs, responsive_fraction=0.8, pref_angle=0., kappa=5., amplitude=1., seed=3)
+    rawFluo, neuropil = generate_traces(truth, sequence, PROTOCOLS, t, np.arange(nROIs), seed=3)
+    dFoF, valid = compute_dFoF(rawFluo.astype(np.float64), neuropil.astype(np.float64), dt,
+                               sliding_window=60)
+
+    t_episode = np.arange(-10, 21)*dt # [-2, 4]s
+    i0 = np.searchsorted(t, sequence['time_start'])
+    tensors = []
+    for ip, keys in enumerate([['angle', 'x-center', 'y-center'], ['angle', 'radius']]):
+        episodes = (sequence['protocol_id']==ip) & (i0-10>=0) & (i0+21<=len(t))
+        tensor = {'t':t_episode,
+                  'responses':np.ascontiguousarray(np.stack([dFoF[:,i-10:i+21] for i in i0[episodes]])),
+                  # alphabetical, as the varied parameters read from the NWB file
+                  'varied_parameters':{key:np.unique(sequence[key][episodes]) for key in keys}}
+        for key in keys:
+            tensor[key] = sequence[key][episodes]
+        tensor['condition'], tensor['conditions'] = condition_index(tensor)
+        tensors.append(tensor)
+    return tensors, {key:truth[key][valid] for key in truth if np.ndim(truth[key])==1}
+
+
+def test_centering_on_the_receptive_fields(size_tensors):
+    (tensor, sizes), truth = size_tensors
+    ST = size_tuning(tensor, tensor_sizes=sizes)
+    assert np.all(ST['radii'][0]==0) and np.all(ST['curves'][:,0]==0)
+    np.testing.assert_array_equal(ST['radii'][1:], np.unique(sizes['radius']))
+
+    # the centered ROIs: responsive ROIs with a receptive field close to the screen center
+    close = truth['responsive'] & (np.abs(truth['rf_x'])<5) & (np.abs(truth['rf_y'])<5)
+    far = ~truth['responsive'] | (np.abs(truth['rf_x'])>15) | (np.abs(truth['rf_y'])>10)
+    assert np.mean(ST['responsive'][close])>0.9
+    assert not np.any(ST['responsive'][far])
+    np.testing.assert_array_equal(ST['pref_angles'], 0.)
+
+    # with the stored receptive fields: centers on the closest stimulus location
+    rf = {'x0':truth['rf_x'], 'y0':truth['rf_y'], 'residual':np.zeros(len(truth['rf_x']))}
+    ST = size_tuning(tensor, tensor_sizes=sizes, rf=rf)
+    d2 = (truth['rf_x'][:,np.newaxis]-ST['locations'][:,0])**2+(truth['rf_y'][:,np.newaxis]-ST['locations'][:,1])**2
+    np.testing.assert_array_equal(ST['center'], np.argmin(d2, axis=1))
+
+
+def test_size_tuning_equals_center_and_compute_size_tuning(size_tensors):
+    """
+    same centered ROIs, preferred angles, radii and curves (within 1e-9, i.e.
+    up to the summation order of the window means) as physion's per-ROI functions
+    (`center_and_compute_size_tuning` without its NWB reading)
+    """
+    import analysis # adds physion to the path
+    try:
+        import physion.analysis.protocols.size_tuning as physion_st
+    except ImportError:
+        pytest.skip('physion size-tuning protocol is not available')
+    (tensor, sizes), truth = size_tensors
+    ST = size_tuning(tensor, tensor_sizes=sizes)
+
+    loc, dep = physion_episodes(tensor), physion_episodes(sizes)
+    data = types.SimpleNamespace(nROIs=tensor['responses'].shape[1])
+    rois, angles = physion_st.extract_centered_rois(data, loc)
+    radii, curves = physion_st.compute_size_tuning_curves(data, dep, rois, angles,
+                                                          physion_st.stat_test_props)
+
+    assert len(rois)>0
+    np.testing.assert_array_equal(ST['rois'], rois)
+    np.testing.assert_array_equal(ST['pref_angles'], angles)
+    np.testing.assert_allclose(ST['radii'], radii)
+    np.testing.assert_allclose(ST['responses'], np.array(curves), atol=1e-9)
+
+
+def test_ragged_to_dense_and_session_means():
+    curves = [np.ones((2, 3)), np.zeros((0, 3)), 3*np.ones((1, 3))]
+    dense, offsets = ragged_to_dense(curves)
+    np.testing.assert_array_equal(offsets, [0, 2, 2, 3])
+    means = session_means(dense, offsets)
+    np.testing.assert_array_equal(means[[0,2]], [[1,1,1], [3,3,3]])
+    assert np.all(np.isnan(means[1]))
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+import sweep
+from sweep import expand_grid, stage_counts, run_sweep, query
+
+
+def test_expand_grid():
+    config = {'defaults':{'threshold':0.01},
+              'grid':[{'quantity':['rawFluo', 'dFoF']},
+                      {'neuropil_correction_factor':[0.6, 0.7], 'threshold':[0.05, 0.01]}]}
+    POINTS = expand_grid(config)
+    # (dFoF, 0.7, 0.01) is in both entries: counted once
+    assert len(POINTS)==2+4-1
+    assert all(p['test']=='anova' for p in POINTS) # a default
+    assert sorted(p['threshold'] for p in POINTS)==[0.01, 0.01, 0.01, 0.05, 0.05]
+    # builds: rawFluo and the two neuropil factors of dFoF, the thresholds share the stat tests
+    assert stage_counts(POINTS)=={'points':5, 'build':3, 'tensor':3, 'stats':3}
+    # 5 and 5. are the same parameter value
+    assert len(expand_grid({'grid':[{'percentile':[5, 5.]}]}))==1
+    with pytest.raises(ValueError):
+        expand_grid({'grid':[{'unknown_parameter':[1, 2]}]})
+
+
+def test_run_sweep_store_and_resume(tmp_path, monkeypatch):
+    calls = []
+    def run_session(f, POINTS, verbose=False):
+        calls.append((f, len(POINTS)))
+        if f=='bad.nwb':
+            raise RuntimeError('corrupted file')
+        if f=='other.nwb':
+            return [(point, 'no_protocol', None) for point in POINTS]
+        return [(point, 'done', {'FRAC_RESP':point['threshold']}) for point in POINTS]
+    monkeypatch.setattr(sweep, 'run_session', run_session)
+
+    store = str(tmp_path/'sweep.db')
+    config = {'grid':[{'threshold':[0.05, 0.01]}]}
+    FILES = ['good.nwb', 'bad.nwb', 'other.nwb']
+    run_sweep(config, store=store, FILES=FILES, Nproc=1, verbose=False)
+
+    # a failing session does not stop the sweep, its traceback is stored
+    done = query(store, threshold=0.01)
+    assert [(f, r['FRAC_RESP']) for _, f, r in done]==[('good.nwb', 0.01)]
+    failed = query(store, status='failed')
+    assert len(failed)==2 and all('corrupted file' in r for _, f, r in failed)
+    assert len(query(store, status='no_protocol'))==2
+
+    # resume: only the failed session is run again, then a new grid point everywhere
+    calls.clear()
+    run_sweep(config, store=store, FILES=FILES, Nproc=1, verbose=False)
+    assert calls==[('bad.nwb', 2)]
+    calls.clear()
+    run_sweep({'grid':[{'threshold':[0.05, 0.01, 0.001]}]}, store=store, FILES=FILES, Nproc=1, verbose=False)
+    assert calls==[('good.nwb', 1), ('bad.nwb', 3), ('other.nwb', 1)]
+    np.testing.assert_allclose(sorted(r['FRAC_RESP'] for _, f, r in query(store)), [0.001, 0.01, 0.05])
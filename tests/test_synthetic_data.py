@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+import synthetic_data
+from synthetic_data import stimulus_sequence, ground_truth, evoked_amplitude, generate_traces
+
+PROTOCOL = 'ff-gratings-8orientation-2contrasts-10repeats'
+
+
+def test_ground_truth_tuning():
+    sequence = stimulus_sequence([PROTOCOL], duration=12*60., seed=1)
+    truth = ground_truth(20, responsive_fraction=1, pref_angle=45., kappa=2., amplitude=0.5, seed=1)
+    amp = evoked_amplitude(truth, sequence, [PROTOCOL], np.arange(20))
+
+    full = (sequence['contrast']==1)
+    np.testing.assert_allclose(amp[:,full & (sequence['angle']==45.)], 0.5)
+    np.testing.assert_allclose(amp[:,full & (sequence['angle']==135.)], 0.5*np.exp(-4.))
+    assert np.all(amp[:,full]<=0.5+1e-12)
+
+    # the other settings are those of the random draws
+    random = ground_truth(20, responsive_fraction=1, seed=1)
+    for key in ['responsive', 'included', 'F0', 'Fneu0', 'center_radius']:
+        np.testing.assert_array_equal(truth[key], random[key])
+
+
+def test_write_session_generates_each_block_once(tmp_path, monkeypatch):
+    pytest.importorskip('pynwb')
+    h5py = pytest.importorskip('h5py')
+
+    calls = []
+    def counted(*args, **kwargs):
+        calls.append(args[4][0])
+        return generate_traces(*args, **kwargs)
+    monkeypatch.setattr(synthetic_data, 'generate_traces', counted)
+
+    filename = str(tmp_path/'synthetic.nwb')
+    synthetic_data.write_session(filename, nROIs=25, duration=2., frame_rate=5.,
+                                 protocols=[PROTOCOL], block_size=10, seed=2, verbose=False)
+    assert sorted(calls)==[0, 10, 20]
+
+    truth = np.load(filename.replace('.nwb', '.ground-truth.npy'), allow_pickle=True).item()
+    t = np.arange(int(60.*2*5))/5.
+    fluo, neuropil = [np.concatenate(traces) for traces in zip(*[\
+            generate_traces(truth, truth['sequence'], [PROTOCOL], t, np.arange(b, min([b+10, 25])), seed=2)\
+                for b in range(0, 25, 10)])]
+    with h5py.File(filename, 'r') as f:
+        np.testing.assert_array_equal(f['processing/ophys/Fluorescence/Fluorescence/data'][:], fluo)
+        np.testing.assert_array_equal(f['processing/ophys/Neuropil/Neuropil/data'][:], neuropil)
@@ -0,0 +1,43 @@
+import numpy as np
+
+from episodes import window_slice
+from tuning_dynamics import sliding_windows, time_resolved_tuning
+
+
+def test_sliding_windows():
+    t = np.arange(-10, 21)*0.2
+    assert sliding_windows(t, width=1., tstop=3) == [[0.,1.], [1.,2.], [2.,3.]]
+    np.testing.assert_allclose(sliding_windows(t, width=1., step=0.5, tstop=2),
+                               [[0.,1.], [0.5,1.5], [1.,2.]])
+
+
+def test_time_resolved_tuning(tensor):
+    windows = sliding_windows(tensor['t'], width=0.6, step=0.4, tstop=3)
+    # ROI blocks smaller than, and not dividing, the number of ROIs
+    dynamics = time_resolved_tuning(tensor, windows, key='angle', roi_block=16)
+
+    t, R = tensor['t'], tensor['responses']
+    cond = tensor['contrast']==1
+    pre = slice(*window_slice(t, [-1,0]))
+    for iw, window in enumerate(windows):
+        w = slice(*window_slice(t, window))
+        evoked = R[cond][:,:,w].mean(axis=-1)-R[cond][:,:,pre].mean(axis=-1)
+        for ia, angle in enumerate(dynamics['angle']):
+            np.testing.assert_allclose(dynamics['values'][iw,:,ia],
+                                       evoked[tensor['angle'][cond]==angle].mean(axis=0),
+                                       atol=1e-10)
+    assert dynamics['OSI'].shape==dynamics['pref_orientation'].shape==(len(windows), R.shape[1])
+
+
+def test_pref_orientation_after_onset(tensor, recording):
+    from dfof import compute_dFoF
+    _, valid = compute_dFoF(recording['rawFluo'], recording['neuropil'], recording['dt'],
+                            sliding_window=60)
+    truth = {key:recording['truth'][key][valid] for key in ['responsive', 'pref_angle']}
+
+    dynamics = time_resolved_tuning(tensor, [[-2,-1], [0.4,2]], key='angle')
+    responsive = truth['responsive']
+    # the ground-truth preferred orientation is recovered once the response has started
+    error = np.abs((dynamics['pref_orientation'][1]-truth['pref_angle']+90)%180-90)
+    assert np.mean(error[responsive]<=22.5)>0.8
+    assert np.median(dynamics['OSI'][1][responsive])>2*np.median(dynamics['OSI'][0][responsive])
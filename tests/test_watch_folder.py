@@ -0,0 +1,65 @@
+import os, time
+
+import watch_folder
+
+
+def fake_session(filename):
+    with open(filename, 'wb') as io:
+        io.write(watch_folder.HDF5_SIGNATURE+bytes(100))
+    old = time.time()-60.
+    os.utime(filename, (old, old)) # not modified for a minute
+
+
+def fake_run_pdf(status, calls):
+    def run_pdf(f, timeout=3600, args=[]):
+        calls.append(f)
+        stat = os.stat(f)
+        return dict(file=f, size=stat.st_size, mtime=stat.st_mtime, status=status,
+                    returncode=1, duration=0., stderr='', time='')
+    return run_pdf
+
+
+def test_hdf5_header(tmp_path):
+    fake_session(tmp_path/'complete.nwb')
+    (tmp_path/'partial.nwb').write_bytes(bytes(10))
+    assert watch_folder.has_hdf5_header(tmp_path/'complete.nwb')
+    assert not watch_folder.has_hdf5_header(tmp_path/'partial.nwb')
+    assert not watch_folder.has_hdf5_header(tmp_path/'missing.nwb')
+
+
+def test_failed_file_retried_at_most_max_attempts(tmp_path, monkeypatch):
+    filename = str(tmp_path/'session.nwb')
+    fake_session(filename)
+    calls = []
+    monkeypatch.setattr(watch_folder, 'run_pdf', fake_run_pdf('failed', calls))
+
+    # one pass per call, the attempts are counted from the log (i.e. across restarts)
+    for i in range(5):
+        watch_folder.watch(str(tmp_path), stable_for=10., retry_failed=True, max_attempts=3,
+                           once=True, verbose=False)
+    assert len(calls)==3
+    OUTCOMES = watch_folder.read_outcomes(str(tmp_path/'watch-log.jsonl'))
+    assert OUTCOMES[filename]['attempt']==3 and OUTCOMES[filename]['gave_up']
+
+    # a new version of the file gets new attempts
+    with open(filename, 'ab') as io:
+        io.write(bytes(10))
+    os.utime(filename, (time.time()-60., time.time()-60.))
+    watch_folder.watch(str(tmp_path), stable_for=10., retry_failed=True, max_attempts=3,
+                       once=True, verbose=False)
+    assert len(calls)==4
+    OUTCOMES = watch_folder.read_outcomes(str(tmp_path/'watch-log.jsonl'))
+    assert OUTCOMES[filename]['attempt']==1 and not OUTCOMES[filename]['gave_up']
+
+
+def test_done_and_failed_files_not_reprocessed(tmp_path, monkeypatch):
+    for status, retry_failed in [('done', True), ('failed', False)]:
+        folder = tmp_path/status
+        folder.mkdir()
+        fake_session(folder/'session.nwb')
+        calls = []
+        monkeypatch.setattr(watch_folder, 'run_pdf', fake_run_pdf(status, calls))
+        for i in range(3):
+            watch_folder.watch(str(folder), stable_for=10., retry_failed=retry_failed,
+                               once=True, verbose=False)
+        assert len(calls)==1